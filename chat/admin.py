@@ -13,7 +13,7 @@ class MessageInline(admin.TabularInline):
 
 @admin.register(Conversation)
 class ConversationAdmin(admin.ModelAdmin):
-    list_display = ('id', 'buyer', 'seller', 'product', 'created_at')
+    list_display = ('id', 'buyer', 'seller', 'product', 'last_message_at', 'buyer_unread_count', 'seller_unread_count')
     list_filter = ('created_at',)
     inlines = [MessageInline]
 
@@ -0,0 +1,112 @@
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.db import models, transaction
+from notifications import outbox
+from users.presence import presence
+
+from . import events
+from .models import Conversation
+from .serializers import MessageSerializer
+
+
+class ChatConsumer(AsyncJsonWebsocketConsumer):
+    """
+    One socket per signed-in device, at ws/chat/.
+
+    The socket joins its user's group and receives every chat event for that
+    user (see chat.events). Clients send JSON frames:
+
+        {"type": "message.send", "conversation_id": 1, "text": "..."}
+        {"type": "message.read", "conversation_id": 1}
+        {"type": "typing", "conversation_id": 1, "is_typing": true}
+        {"type": "ping"}
+
+    Connecting and every frame count as a presence heartbeat (users.presence);
+    a socket that goes quiet drops offline when the heartbeat expires.
+
+    Sending and reading over the socket go through the same model methods as
+    SendMessageView and MessageListView, so both paths keep the inbox counters
+    in step.
+    """
+
+    async def connect(self):
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close()
+            return
+        self.user = user
+        self.group_name = events.user_group(user.id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+        await database_sync_to_async(presence.heartbeat)(user.id)
+
+    async def disconnect(self, code):
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def receive_json(self, content, **kwargs):
+        # Any frame counts as a heartbeat; idle clients send {"type": "ping"}.
+        await database_sync_to_async(presence.heartbeat)(self.user.id)
+        if isinstance(content, dict) and content.get('type') == 'ping':
+            await self.send_json({'type': 'pong'})
+            return
+        handlers = {
+            'message.send': self.send_message,
+            events.MESSAGES_READ: self.mark_read,
+            events.TYPING: self.typing,
+        }
+        handler = handlers.get(content.get('type')) if isinstance(content, dict) else None
+        if handler is None:
+            await self.send_error("Unknown event type")
+            return
+        conversation = await self.get_conversation(content.get('conversation_id'))
+        if conversation is None:
+            await self.send_error("Conversation not found", content.get('conversation_id'))
+            return
+        await handler(conversation, content)
+
+    async def chat_event(self, event):
+        await self.send_json(event['payload'])
+
+    async def send_error(self, error, conversation_id=None):
+        await self.send_json({'type': 'error', 'error': error, 'conversation_id': conversation_id})
+
+    # --- actions -----------------------------------------------------------
+
+    async def send_message(self, conversation, content):
+        serializer = MessageSerializer(data={'text': content.get('text', '')})
+        if not serializer.is_valid():
+            await self.send_error(serializer.errors, conversation.id)
+            return
+        await self._save_message(conversation, serializer)
+
+    async def mark_read(self, conversation, content):
+        await self._mark_read(conversation)
+
+    async def typing(self, conversation, content):
+        await database_sync_to_async(events.typing)(conversation, self.user, content.get('is_typing', True))
+
+    # --- database ----------------------------------------------------------
+
+    @database_sync_to_async
+    def get_conversation(self, conversation_id):
+        try:
+            conversation_id = int(conversation_id)
+        except (TypeError, ValueError):
+            return None
+        return Conversation.objects.filter(
+            models.Q(buyer=self.user) | models.Q(seller=self.user), pk=conversation_id
+        ).first()
+
+    @database_sync_to_async
+    def _save_message(self, conversation, serializer):
+        with transaction.atomic():
+            message = serializer.save(conversation=conversation, sender=self.user)
+            conversation.record_message(message)
+            outbox.chat_message(message)
+            events.message_created(message)
+
+    @database_sync_to_async
+    def _mark_read(self, conversation):
+        if conversation.mark_read(self.user):
+            events.messages_read(conversation, self.user)
@@ -0,0 +1,74 @@
+"""
+Real-time chat events.
+
+Every open chat socket joins a group for its user (see chat.consumers), so an
+event reaches all of that user's devices. Events for a conversation go to the
+groups of both participants; typing indicators go only to the other one.
+
+Events are published after the surrounding transaction commits, so a client
+never hears about a message it cannot fetch yet. When Channels is not
+installed the functions do nothing and clients keep polling.
+"""
+import logging
+from asgiref.sync import async_to_sync
+from django.db import transaction
+
+try:
+    from channels.layers import get_channel_layer
+except ImportError:
+    get_channel_layer = None
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_NEW = 'message.new'
+MESSAGES_READ = 'message.read'
+TYPING = 'typing'
+
+
+def user_group(user_id):
+    return f"chat.user.{user_id}"
+
+
+def _send(user_ids, payload):
+    layer = get_channel_layer() if get_channel_layer else None
+    if layer is None:
+        return
+    for user_id in user_ids:
+        try:
+            async_to_sync(layer.group_send)(user_group(user_id), {'type': 'chat.event', 'payload': payload})
+        except Exception as e:
+            # Delivery is best effort: the message is already saved and polling still finds it.
+            logger.error(f"Chat event {payload['type']} to user {user_id} failed: {e}")
+
+
+def _publish(user_ids, payload):
+    transaction.on_commit(lambda: _send(user_ids, payload))
+
+
+def message_created(message):
+    from .serializers import MessageSerializer
+
+    conversation = message.conversation
+    _publish((conversation.buyer_id, conversation.seller_id), {
+        'type': MESSAGE_NEW,
+        'conversation_id': conversation.id,
+        'message': MessageSerializer(message).data,
+    })
+
+
+def messages_read(conversation, reader):
+    _publish((conversation.buyer_id, conversation.seller_id), {
+        'type': MESSAGES_READ,
+        'conversation_id': conversation.id,
+        'reader_id': reader.id,
+    })
+
+
+def typing(conversation, user, is_typing):
+    other_id = conversation.seller_id if user.id == conversation.buyer_id else conversation.buyer_id
+    _send((other_id,), {
+        'type': TYPING,
+        'conversation_id': conversation.id,
+        'user_id': user.id,
+        'is_typing': bool(is_typing),
+    })
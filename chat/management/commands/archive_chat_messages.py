@@ -0,0 +1,26 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chat.models import ArchivedMessage
+
+
+class Command(BaseCommand):
+    help = 'Moves old, read chat messages from the hot Message table into the archive.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-days', type=int, default=settings.CHAT_ARCHIVE_AFTER_DAYS,
+            help=f'Archive read messages older than this (default: {settings.CHAT_ARCHIVE_AFTER_DAYS}).',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Messages moved per transaction (default: 1000).',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['older_than_days'])
+        moved = ArchivedMessage.archive_before(cutoff, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Archived {moved} message(s) older than {cutoff:%Y-%m-%d}."))
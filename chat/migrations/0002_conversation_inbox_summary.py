@@ -0,0 +1,76 @@
+# Generated by Django 5.2.8 on 2026-10-17 22:43
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Substr
+
+
+def backfill_inbox_summary(apps, schema_editor):
+    Conversation = apps.get_model('chat', 'Conversation')
+    Message = apps.get_model('chat', 'Message')
+
+    latest = Message.objects.filter(conversation=OuterRef('pk')).order_by('-created_at', '-id')
+
+    def unread_from(sender_field):
+        # Unread messages sent by the other participant.
+        return Subquery(
+            Message.objects.filter(conversation=OuterRef('pk'), is_read=False)
+            .exclude(sender_id=OuterRef(sender_field))
+            .values('conversation')
+            .annotate(n=Count('id'))
+            .values('n')[:1]
+        )
+
+    Conversation.objects.update(
+        last_message_at=Coalesce(Subquery(latest.values('created_at')[:1]), F('created_at')),
+        last_message_preview=Coalesce(Substr(Subquery(latest.values('text')[:1]), 1, 100), Value('')),
+        buyer_unread_count=Coalesce(unread_from('buyer_id'), Value(0)),
+        seller_unread_count=Coalesce(unread_from('seller_id'), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0001_initial'),
+        ('market', '0030_order_checkout_reference'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='conversation',
+            options={'ordering': ['-last_message_at']},
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='buyer_unread_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_preview',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='seller_unread_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['buyer', '-last_message_at'], name='chat_conv_buyer_activity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['seller', '-last_message_at'], name='chat_conv_seller_activity_idx'),
+        ),
+        migrations.RunPython(backfill_inbox_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.8 on 2026-10-17 22:48
+
+from django.db import migrations, models
+
+
+def backfill_last_message_id(apps, schema_editor):
+    Conversation = apps.get_model('chat', 'Conversation')
+    Message = apps.get_model('chat', 'Message')
+    latest = Message.objects.filter(conversation=models.OuterRef('pk')).order_by('-id').values('id')[:1]
+    Conversation.objects.update(last_message_id=models.Subquery(latest))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_conversation_inbox_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_last_message_id, migrations.RunPython.noop),
+    ]
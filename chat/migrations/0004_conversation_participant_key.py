@@ -0,0 +1,49 @@
+# Generated by Django 5.2.8 on 2026-10-17 22:50
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_participant_key(apps, schema_editor):
+    Conversation = apps.get_model('chat', 'Conversation')
+    seen = set()
+    keyed = []
+    # The newest conversation of each pair gets the key, which is the one
+    # StartConversationView used to reopen (.first() under -created_at).
+    # Older duplicates keep NULL so the unique index can be built. They stay
+    # reachable by id.
+    conversations = Conversation.objects.order_by('-created_at', '-id').only('id', 'buyer_id', 'seller_id')
+    for conversation in conversations.iterator():
+        low, high = sorted((conversation.buyer_id, conversation.seller_id))
+        key = f"{low}:{high}"
+        if key in seen:
+            continue
+        seen.add(key)
+        conversation.participant_key = key
+        keyed.append(conversation)
+    Conversation.objects.bulk_update(keyed, ['participant_key'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_conversation_last_message_id'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='participant_key',
+            field=models.CharField(blank=True, editable=False, max_length=41, null=True, unique=True),
+        ),
+        migrations.RunPython(backfill_participant_key, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'id'], name='chat_msg_conv_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'is_read', 'sender'], name='chat_msg_conv_unread_idx'),
+        ),
+    ]
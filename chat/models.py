@@ -1,5 +1,13 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, Greatest
 from django.conf import settings
+from django.utils import timezone
+
+PREVIEW_LENGTH = 100
+# Messages returned when a chat is opened, and per before_id page.
+HISTORY_WINDOW = 30
+MAX_HISTORY_WINDOW = 100
 
 
 class Conversation(models.Model):
@@ -16,13 +24,105 @@ class Conversation(models.Model):
         related_name='conversations'
     )
     created_at = models.DateTimeField(auto_now_add=True)
+    # "<lower user id>:<higher user id>", the same whichever side started the
+    # chat. Unique, so a pair of users has one conversation and finding it is
+    # a single index probe. Null only on duplicates that predate the key.
+    participant_key = models.CharField(max_length=41, unique=True, null=True, blank=True, editable=False)
+
+    # Inbox summary, kept in step with the messages by record_message() and
+    # mark_read() so the inbox never has to look at the message table.
+    # last_message_at starts at creation time so new chats sort by activity too.
+    last_message_at = models.DateTimeField(default=timezone.now)
+    # Id of the newest message; MessageListView builds its ETag from it.
+    last_message_id = models.BigIntegerField(null=True, blank=True)
+    # Highest message id moved to ArchivedMessage; history() only reads the
+    # archive when a window reaches that far back.
+    archived_through_id = models.BigIntegerField(null=True, blank=True)
+    last_message_preview = models.CharField(max_length=PREVIEW_LENGTH, blank=True, default='')
+    buyer_unread_count = models.PositiveIntegerField(default=0)
+    seller_unread_count = models.PositiveIntegerField(default=0)
 
     class Meta:
-        ordering = ['-created_at']
+        ordering = ['-last_message_at']
+        indexes = [
+            models.Index(fields=['buyer', '-last_message_at'], name='chat_conv_buyer_activity_idx'),
+            models.Index(fields=['seller', '-last_message_at'], name='chat_conv_seller_activity_idx'),
+        ]
 
     def __str__(self):
         return f"Chat: {self.buyer.email} ↔ {self.seller.email} about {self.product}"
 
+    @staticmethod
+    def pair_key(user_id, other_user_id):
+        low, high = sorted((int(user_id), int(other_user_id)))
+        return f"{low}:{high}"
+
+    def save(self, *args, **kwargs):
+        # Only new rows: a legacy duplicate keeps NULL, since its pair's key
+        # already belongs to the conversation the backfill picked.
+        if self._state.adding and self.participant_key is None and self.buyer_id and self.seller_id:
+            self.participant_key = self.pair_key(self.buyer_id, self.seller_id)
+        super().save(*args, **kwargs)
+
+    def unread_field_for(self, user):
+        """Name of the counter holding `user`'s unread messages."""
+        return 'buyer_unread_count' if user.pk == self.buyer_id else 'seller_unread_count'
+
+    def unread_count_for(self, user):
+        return getattr(self, self.unread_field_for(user))
+
+    def history(self, before_id=None, limit=HISTORY_WINDOW):
+        """
+        The latest `limit` messages (older than `before_id` when given), oldest
+        first, plus the before_id that fetches the window before them, or None
+        at the start of the thread. A keyset read on (conversation, id), so it
+        costs the same however long the thread is. Windows that reach back
+        past archived_through_id are merged with ArchivedMessage.
+        """
+        def window(qs):
+            qs = qs.select_related('sender').order_by('-id')
+            if before_id is not None:
+                qs = qs.filter(id__lt=before_id)
+            return list(qs[:limit + 1])
+
+        rows = window(self.messages)
+        if self.archived_through_id and (len(rows) <= limit or rows[-1].id <= self.archived_through_id):
+            rows = sorted(rows + window(self.archived_messages), key=lambda m: m.id, reverse=True)[:limit + 1]
+        page = rows[:limit][::-1]
+        return page, (page[0].id if len(rows) > limit else None)
+
+    def record_message(self, message):
+        """
+        Updates the inbox summary for a newly sent message in one UPDATE. The
+        recipient's counter is incremented with F() so concurrent senders
+        never lose a count.
+        """
+        recipient_field = 'seller_unread_count' if message.sender_id == self.buyer_id else 'buyer_unread_count'
+        Conversation.objects.filter(pk=self.pk).update(**{
+            'last_message_id': Greatest(Coalesce(F('last_message_id'), Value(0)), Value(message.id)),
+            'last_message_at': message.created_at,
+            'last_message_preview': message.text[:PREVIEW_LENGTH],
+            recipient_field: F(recipient_field) + 1,
+        })
+
+    def mark_read(self, user):
+        """
+        Marks every message sent to `user` as read, clears their counter and
+        returns how many messages changed. The counter is reset first: that
+        UPDATE takes the conversation's row lock, which a concurrent
+        record_message() waits on, so a message is either marked read here or
+        counted afterwards, never lost between the two.
+        """
+        field = self.unread_field_for(user)
+        if not getattr(self, field):
+            # Nothing unread as of this instance's load: skip the writes.
+            return 0
+        with transaction.atomic():
+            Conversation.objects.filter(pk=self.pk).update(**{field: 0})
+            updated = self.messages.filter(is_read=False).exclude(sender=user).update(is_read=True)
+        setattr(self, field, 0)
+        return updated
+
 
 class Message(models.Model):
     conversation = models.ForeignKey(
@@ -37,6 +137,74 @@ class Message(models.Model):
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            # last_id / before_id paging within a conversation.
+            models.Index(fields=['conversation', 'id'], name='chat_msg_conv_id_idx'),
+            # The mark-read UPDATE: unread messages not sent by the reader.
+            models.Index(fields=['conversation', 'is_read', 'sender'], name='chat_msg_conv_unread_idx'),
+        ]
 
     def __str__(self):
         return f"From {self.sender.email} at {self.created_at}"
+
+
+class ArchivedMessage(models.Model):
+    """
+    Cold storage for old, read messages, moved out of Message by the
+    archive_chat_messages command so the hot table (scanned by polls, unread
+    counts and mark-read) only grows with recent activity. Rows keep their
+    original Message id, so id paging runs across both tables.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE, related_name='archived_messages', db_index=False,
+    )
+    sender = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='archived_chat_messages',
+    )
+    text = models.TextField(blank=True, default='')
+    is_read = models.BooleanField(default=True)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            # The only read path: history() windows within one conversation.
+            models.Index(fields=['conversation', 'id'], name='chat_archive_conv_id_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived message {self.id} in conversation {self.conversation_id}"
+
+    @classmethod
+    def archive_before(cls, cutoff, batch_size=1000):
+        """
+        Moves read messages created before `cutoff` into the archive, one
+        batch per transaction, and returns how many moved. Unread messages
+        stay in Message so mark_read() can still reach them.
+        """
+        moved = 0
+        while True:
+            with transaction.atomic():
+                batch = list(
+                    Message.objects.filter(created_at__lt=cutoff, is_read=True)
+                    .order_by('id')[:batch_size]
+                )
+                if not batch:
+                    return moved
+                cls.objects.bulk_create(
+                    cls(
+                        id=m.id, conversation_id=m.conversation_id, sender_id=m.sender_id,
+                        text=m.text, is_read=m.is_read, created_at=m.created_at,
+                    )
+                    for m in batch
+                )
+                Message.objects.filter(id__in=[m.id for m in batch]).delete()
+                newest = {}
+                for m in batch:
+                    newest[m.conversation_id] = max(newest.get(m.conversation_id, 0), m.id)
+                for conversation_id, message_id in newest.items():
+                    Conversation.objects.filter(pk=conversation_id).update(archived_through_id=Greatest(
+                        Coalesce(F('archived_through_id'), Value(0)), Value(message_id),
+                    ))
+            moved += len(batch)
@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from users.presence import presence
 from .models import Conversation, Message
 
 
@@ -19,6 +20,8 @@ class MessageSerializer(serializers.ModelSerializer):
 
 class ConversationSerializer(serializers.ModelSerializer):
     other_user_name = serializers.SerializerMethodField()
+    other_user_online = serializers.SerializerMethodField()
+    other_user_last_seen = serializers.SerializerMethodField()
     product_name = serializers.SerializerMethodField()
     last_message = serializers.SerializerMethodField()
     unread_count = serializers.SerializerMethodField()
@@ -27,24 +30,44 @@ class ConversationSerializer(serializers.ModelSerializer):
         model = Conversation
         fields = [
             'id', 'other_user_name', 'product', 'product_name',
-            'last_message', 'unread_count', 'created_at',
+            'last_message', 'last_message_at', 'unread_count', 'created_at',
+            'other_user_online', 'other_user_last_seen',
         ]
 
     def get_product_name(self, obj):
         return obj.product.name if obj.product else None
 
-    def get_other_user_name(self, obj):
+    def get_other_user(self, obj):
         request = self.context.get('request')
-        if request and request.user == obj.buyer:
-            return obj.seller.full_name or obj.seller.email
-        return obj.buyer.full_name or obj.buyer.email
+        if request and request.user.id == obj.buyer_id:
+            return obj.seller
+        return obj.buyer
+
+    def get_other_user_name(self, obj):
+        other = self.get_other_user(obj)
+        return other.full_name or other.email
+
+    def _presence(self, obj):
+        # ConversationListView looks up the whole page at once and passes it
+        # in the context; single conversations fall back to their own lookup.
+        other = self.get_other_user(obj)
+        states = self.context.get('presence')
+        if states is None or other.id not in states:
+            states = presence.lookup([other])
+        return states[other.id]
+
+    def get_other_user_online(self, obj):
+        return self._presence(obj)['is_online']
+
+    def get_other_user_last_seen(self, obj):
+        last_seen = self._presence(obj)['last_seen']
+        return serializers.DateTimeField().to_representation(last_seen) if last_seen else None
 
     def get_last_message(self, obj):
-        msg = obj.messages.order_by('-created_at').first()
-        return msg.text[:100] if msg else None
+        return obj.last_message_preview or None
 
     def get_unread_count(self, obj):
         request = self.context.get('request')
-        if request:
-            return obj.messages.filter(is_read=False).exclude(sender=request.user).count()
+        if request and request.user.is_authenticated:
+            return obj.unread_count_for(request.user)
         return 0
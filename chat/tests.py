@@ -1,3 +1,389 @@
-from django.test import TestCase
+import importlib
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
 
-# Create your tests here.
+from globalink_core.asgi import application
+from .models import ArchivedMessage, Conversation, Message
+from .views import MessageListView
+
+User = get_user_model()
+
+
+class ChatTestMixin:
+    def setUp(self):
+        self.client = APIClient()
+        self.buyer = User.objects.create_user(email="buyer@example.com", password="password123", full_name="Buyer")
+        self.seller = User.objects.create_user(email="seller@example.com", password="password123", full_name="Seller")
+        self.conversation = Conversation.objects.create(buyer=self.buyer, seller=self.seller)
+
+    def send(self, user, text, conversation=None):
+        self.client.force_authenticate(user=user)
+        conversation = conversation or self.conversation
+        url = reverse('chat-send-message', args=[conversation.id])
+        response = self.client.post(url, {'text': text}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response
+
+
+class ConversationInboxTests(ChatTestMixin, TestCase):
+    def test_send_updates_summary_and_recipient_counter(self):
+        self.send(self.buyer, "Is this still available?")
+        self.send(self.buyer, "Hello?")
+
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.last_message_preview, "Hello?")
+        self.assertEqual(self.conversation.seller_unread_count, 2)
+        self.assertEqual(self.conversation.buyer_unread_count, 0)
+        self.assertEqual(self.conversation.last_message_at, Message.objects.latest('id').created_at)
+
+    def test_reading_messages_clears_only_the_readers_counter(self):
+        self.send(self.buyer, "Hi")
+        self.send(self.seller, "Hello")
+
+        self.client.force_authenticate(user=self.seller)
+        self.client.get(reverse('chat-messages', args=[self.conversation.id]))
+
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.seller_unread_count, 0)
+        self.assertEqual(self.conversation.buyer_unread_count, 1)
+        self.assertFalse(Message.objects.filter(sender=self.buyer, is_read=False).exists())
+
+    def test_start_conversation_marks_read(self):
+        self.send(self.seller, "Your order shipped")
+
+        self.client.force_authenticate(user=self.buyer)
+        response = self.client.post(reverse('chat-start'), {'user_id': self.seller.id}, format='json')
+
+        self.assertEqual(response.data['conversation_id'], self.conversation.id)
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.buyer_unread_count, 0)
+
+    def test_inbox_is_one_query_sorted_by_activity(self):
+        others = [
+            User.objects.create_user(email=f"other{i}@example.com", password="password123", full_name=f"Other {i}")
+            for i in range(3)
+        ]
+        conversations = [Conversation.objects.create(buyer=self.buyer, seller=other) for other in others]
+        self.send(others[0], "first", conversation=conversations[0])
+        self.send(self.seller, "latest")
+
+        self.client.force_authenticate(user=self.buyer)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('chat-conversations'))
+
+        self.assertEqual(response.status_code, 200)
+        rows = response.data['results'] if isinstance(response.data, dict) else response.data
+        self.assertEqual(rows[0]['id'], self.conversation.id)
+        self.assertEqual(rows[0]['last_message'], "latest")
+        self.assertEqual(rows[0]['unread_count'], 1)
+        self.assertEqual(rows[1]['id'], conversations[0].id)
+        # One page query (plus the paginator's COUNT), however many rows.
+        page_queries = [q for q in ctx.captured_queries if 'chat_' in q['sql'] and 'COUNT(' not in q['sql']]
+        self.assertEqual(len(page_queries), 1)
+
+
+class ConversationLookupTests(ChatTestMixin, TestCase):
+    def test_pair_key_is_order_independent_and_unique(self):
+        self.assertEqual(self.conversation.participant_key, Conversation.pair_key(self.seller.id, self.buyer.id))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Conversation.objects.create(buyer=self.seller, seller=self.buyer)
+
+    def test_backfill_keys_the_newest_duplicate_and_legacy_rows_still_save(self):
+        Conversation.objects.update(participant_key=None)
+        newer = Conversation.objects.create(buyer=self.seller, seller=self.buyer)
+        Conversation.objects.filter(pk=self.conversation.pk).update(created_at=newer.created_at - timedelta(days=1))
+        Conversation.objects.update(participant_key=None)
+
+        migration = importlib.import_module('chat.migrations.0004_conversation_participant_key')
+        migration.backfill_participant_key(apps, None)
+
+        newer.refresh_from_db()
+        self.conversation.refresh_from_db()
+        self.assertEqual(newer.participant_key, Conversation.pair_key(self.buyer.id, self.seller.id))
+        self.assertIsNone(self.conversation.participant_key)
+        self.conversation.save()
+        self.assertIsNone(Conversation.objects.get(pk=self.conversation.pk).participant_key)
+
+    def test_start_reuses_the_conversation_from_either_side(self):
+        for user, other in ((self.buyer, self.seller), (self.seller, self.buyer)):
+            self.client.force_authenticate(user=user)
+            response = self.client.post(reverse('chat-start'), {'user_id': other.id}, format='json')
+            self.assertEqual(response.data['conversation_id'], self.conversation.id)
+        self.assertEqual(Conversation.objects.count(), 1)
+
+    def test_resolve_by_conversation_or_legacy_user_id_in_one_query(self):
+        self.client.force_authenticate(user=self.buyer)
+        for url_id in (self.conversation.id, self.seller.id):
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.post(
+                    reverse('chat-send-message', args=[url_id]), {'text': "hi"}, format='json',
+                )
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(response.data['conversation'], self.conversation.id)
+            lookups = [q for q in ctx.captured_queries if q['sql'].startswith('SELECT') and 'chat_conversation' in q['sql']]
+            self.assertEqual(len(lookups), 1)
+
+    def test_unknown_id_is_404(self):
+        self.client.force_authenticate(user=self.buyer)
+        response = self.client.get(reverse('chat-messages', args=[999999]))
+        self.assertEqual(response.status_code, 404)
+
+
+class MessagePollingTests(ChatTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.send(self.buyer, "Hi")
+        self.client.force_authenticate(user=self.seller)
+        self.url = reverse('chat-messages', args=[self.conversation.id])
+
+    def test_unchanged_conversation_answers_304_without_reading_messages(self):
+        etag = self.client.get(self.url)['ETag']
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([q for q in ctx.captured_queries if 'chat_message' in q['sql']])
+
+    def test_new_message_changes_the_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        self.send(self.buyer, "Anyone there?")
+
+        self.client.force_authenticate(user=self.seller)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_read_receipt_changes_the_senders_etag(self):
+        self.client.force_authenticate(user=self.buyer)
+        etag = self.client.get(self.url)['ETag']
+
+        self.client.force_authenticate(user=self.seller)
+        self.client.get(self.url)
+
+        self.client.force_authenticate(user=self.buyer)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['results'][0]['is_read'])
+
+    def test_mark_read_is_skipped_when_nothing_is_unread(self):
+        self.client.get(self.url)
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(self.url)
+
+        self.assertFalse([q for q in ctx.captured_queries if q['sql'].startswith('UPDATE')])
+
+    def test_wait_returns_as_soon_as_a_message_arrives(self):
+        last_id = self.client.get(self.url).data['results'][-1]['id']
+
+        def deliver(seconds):
+            Message.objects.create(conversation=self.conversation, sender=self.buyer, text="Late")
+            self.conversation.record_message(Message.objects.latest('id'))
+
+        with patch('chat.views.time.sleep', side_effect=deliver) as sleep:
+            response = self.client.get(self.url, {'last_id': last_id, 'wait': 20})
+
+        self.assertEqual(sleep.call_count, 1)
+        self.assertEqual([m['text'] for m in response.data['results']], ["Late"])
+
+    def test_wait_times_out_with_304(self):
+        etag = self.client.get(self.url)['ETag']
+
+        with override_settings(CHAT_LONG_POLL_MAX_WAIT=0.2), patch.object(MessageListView, 'POLL_INTERVAL', 0.05):
+            response = self.client.get(self.url, {'wait': 5}, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+
+    @override_settings(CHAT_LONG_POLL_MAX_WAIT=0)
+    def test_wait_is_ignored_when_long_polling_is_off(self):
+        etag = self.client.get(self.url)['ETag']
+
+        with patch('chat.views.time.sleep') as sleep:
+            response = self.client.get(self.url, {'wait': 20}, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        sleep.assert_not_called()
+
+
+class HistoryWindowTests(ChatTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        Message.objects.bulk_create(
+            Message(conversation=self.conversation, sender=self.seller, text=f"m{i}") for i in range(75)
+        )
+        self.client.force_authenticate(user=self.buyer)
+
+    def test_start_returns_only_the_latest_window(self):
+        response = self.client.post(reverse('chat-start'), {'user_id': self.seller.id}, format='json')
+
+        texts = [m['text'] for m in response.data['messages']]
+        self.assertEqual(texts, [f"m{i}" for i in range(45, 75)])
+        self.assertTrue(response.data['has_more'])
+        self.assertEqual(response.data['before_id'], response.data['messages'][0]['id'])
+
+    def test_before_id_pages_back_to_the_start(self):
+        start = self.client.post(reverse('chat-start'), {'user_id': self.seller.id}, format='json').data
+        url = reverse('chat-messages', args=[self.conversation.id])
+
+        texts, before_id = [], start['before_id']
+        while before_id is not None:
+            page = self.client.get(url, {'before_id': before_id}).data
+            texts = [m['text'] for m in page['results']] + texts
+            before_id = page['before_id']
+
+        self.assertEqual(texts, [f"m{i}" for i in range(45)])
+        self.assertFalse(page['has_more'])
+
+    def test_window_cost_does_not_depend_on_thread_length(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('chat-messages', args=[self.conversation.id]), {'before_id': 10 ** 9, 'page_size': 5})
+        history = [q['sql'] for q in ctx.captured_queries if 'FROM "chat_message"' in q['sql']]
+        self.assertEqual(len(history), 1)
+        self.assertIn('LIMIT 6', history[0])
+
+
+class MessageArchiveTests(ChatTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        old = timezone.now() - timedelta(days=400)
+        Message.objects.bulk_create(
+            Message(conversation=self.conversation, sender=self.seller, text=f"m{i}", is_read=i != 3) for i in range(50)
+        )
+        # The first 40 are old; m3 is still unread.
+        Message.objects.filter(id__in=Message.objects.order_by('id').values('id')[:40]).update(created_at=old)
+        self.client.force_authenticate(user=self.buyer)
+
+    def test_command_moves_old_read_messages(self):
+        out = StringIO()
+        call_command('archive_chat_messages', '--older-than-days', '30', '--batch-size', '7', stdout=out)
+
+        self.assertIn("Archived 39", out.getvalue())
+        self.assertEqual(ArchivedMessage.objects.count(), 39)
+        self.assertEqual(list(Message.objects.order_by('id').values_list('text', flat=True)[:1]), ["m3"])
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.archived_through_id, ArchivedMessage.objects.latest('id').id)
+
+    def test_scrolling_back_pages_into_the_archive(self):
+        call_command('archive_chat_messages', '--older-than-days', '30', stdout=StringIO())
+        url = reverse('chat-messages', args=[self.conversation.id])
+
+        texts, before_id = [], 10 ** 9
+        while before_id is not None:
+            page = self.client.get(url, {'before_id': before_id, 'page_size': 8}).data
+            texts = [m['text'] for m in page['results']] + texts
+            before_id = page['before_id']
+
+        self.assertEqual(texts, [f"m{i}" for i in range(50)])
+
+    def test_default_listing_leaves_archived_messages_to_history_paging(self):
+        call_command('archive_chat_messages', '--older-than-days', '30', stdout=StringIO())
+        url = reverse('chat-messages', args=[self.conversation.id])
+
+        listing = self.client.get(url, {'page_size': 100}).data
+        history = self.client.get(url, {'before_id': 10 ** 9, 'page_size': 100}).data
+
+        self.assertEqual([m['text'] for m in listing['results']], ["m3"] + [f"m{i}" for i in range(40, 50)])
+        self.assertEqual([m['text'] for m in history['results']], [f"m{i}" for i in range(50)])
+
+    def test_recent_windows_do_not_read_the_archive(self):
+        call_command('archive_chat_messages', '--older-than-days', '30', stdout=StringIO())
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse('chat-start'), {'user_id': self.seller.id, 'page_size': 5}, format='json')
+
+        self.assertEqual([m['text'] for m in response.data['messages']], [f"m{i}" for i in range(45, 50)])
+        self.assertFalse([q for q in ctx.captured_queries if 'chat_archivedmessage' in q['sql']])
+
+
+# Socket frames are presence heartbeats; write them inline rather than
+# starting the background flusher thread.
+@override_settings(PRESENCE_FLUSH_INTERVAL=0)
+class ChatSocketTests(ChatTestMixin, TransactionTestCase):
+    """Drives ChatConsumer through the ASGI router with the in-memory channel layer."""
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(application, f"/ws/chat/?token={AccessToken.for_user(user)}")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def test_rejects_missing_or_bad_token(self):
+        for path in ("/ws/chat/", "/ws/chat/?token=not-a-jwt"):
+            communicator = WebsocketCommunicator(application, path)
+            connected, _ = await communicator.connect()
+            self.assertFalse(connected)
+
+    async def test_message_reaches_both_participants(self):
+        buyer_socket = await self.connect(self.buyer)
+        seller_socket = await self.connect(self.seller)
+
+        await buyer_socket.send_json_to({
+            'type': 'message.send', 'conversation_id': self.conversation.id, 'text': "Still available?",
+        })
+        for socket in (buyer_socket, seller_socket):
+            event = await socket.receive_json_from()
+            self.assertEqual(event['type'], 'message.new')
+            self.assertEqual(event['message']['text'], "Still available?")
+            self.assertEqual(event['message']['sender'], self.buyer.id)
+
+        conversation = await database_sync_to_async(Conversation.objects.get)(pk=self.conversation.pk)
+        self.assertEqual(conversation.seller_unread_count, 1)
+
+        await seller_socket.send_json_to({'type': 'message.read', 'conversation_id': self.conversation.id})
+        receipt = await buyer_socket.receive_json_from()
+        self.assertEqual(receipt, {
+            'type': 'message.read', 'conversation_id': self.conversation.id, 'reader_id': self.seller.id,
+        })
+        await seller_socket.receive_json_from()
+
+        await buyer_socket.disconnect()
+        await seller_socket.disconnect()
+
+    async def test_rest_send_is_pushed(self):
+        seller_socket = await self.connect(self.seller)
+
+        await database_sync_to_async(self.send)(self.buyer, "Sent over HTTP")
+
+        event = await seller_socket.receive_json_from()
+        self.assertEqual(event['type'], 'message.new')
+        self.assertEqual(event['conversation_id'], self.conversation.id)
+        await seller_socket.disconnect()
+
+    async def test_typing_goes_to_the_other_participant_only(self):
+        buyer_socket = await self.connect(self.buyer)
+        seller_socket = await self.connect(self.seller)
+
+        await buyer_socket.send_json_to({'type': 'typing', 'conversation_id': self.conversation.id})
+
+        event = await seller_socket.receive_json_from()
+        self.assertEqual(event['type'], 'typing')
+        self.assertEqual(event['user_id'], self.buyer.id)
+        self.assertTrue(await buyer_socket.receive_nothing())
+
+        await buyer_socket.disconnect()
+        await seller_socket.disconnect()
+
+    async def test_strangers_cannot_post(self):
+        stranger = await database_sync_to_async(User.objects.create_user)(
+            email="stranger@example.com", password="password123", full_name="Stranger",
+        )
+        socket = await self.connect(stranger)
+
+        await socket.send_json_to({'type': 'message.send', 'conversation_id': self.conversation.id, 'text': "hi"})
+
+        event = await socket.receive_json_from()
+        self.assertEqual(event['type'], 'error')
+        self.assertFalse(await database_sync_to_async(Message.objects.exists)())
+        await socket.disconnect()
@@ -1,10 +1,17 @@
+import hashlib
+import time
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import models, transaction
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 from rest_framework import generics, permissions, status
 from rest_framework.response import Response
 
-from .models import Conversation, Message
+from notifications import outbox
+from users.presence import presence
+from . import events
+from .models import HISTORY_WINDOW, MAX_HISTORY_WINDOW, Conversation, Message
 from .serializers import ConversationSerializer, MessageSerializer
 
 User = get_user_model()
@@ -14,17 +21,36 @@ def _real_user(request):
     return request.user.is_authenticated
 
 
-def _resolve_conversation(request, conversation_id):
+def _int_param(value, default=None):
     try:
-        return Conversation.objects.get(id=conversation_id)
-    except Conversation.DoesNotExist:
-        conv = Conversation.objects.filter(
-            models.Q(buyer=request.user, seller_id=conversation_id)
-            | models.Q(buyer_id=conversation_id, seller=request.user)
-        ).first()
-        if conv:
-            return conv
-    return get_object_or_404(Conversation, id=conversation_id)
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _history_window(value):
+    return max(1, min(_int_param(value, HISTORY_WINDOW), MAX_HISTORY_WINDOW))
+
+
+def _resolve_conversation(request, conversation_id):
+    """
+    Older app builds put the other user's id in the URL instead of the
+    conversation id. One query probes both unique indexes (id and
+    participant_key); a real conversation id wins, as it always has.
+    """
+    conversation_id = _int_param(conversation_id)
+    if conversation_id is None:
+        raise Http404
+    matches = list(Conversation.objects.filter(
+        models.Q(pk=conversation_id)
+        | models.Q(participant_key=Conversation.pair_key(request.user.id, conversation_id))
+    )[:2])
+    for conversation in matches:
+        if conversation.pk == conversation_id:
+            return conversation
+    if matches:
+        return matches[0]
+    raise Http404
 
 
 class ConversationListView(generics.ListAPIView):
@@ -40,39 +66,142 @@ class ConversationListView(generics.ListAPIView):
                 models.Q(buyer=user) | models.Q(seller=user)
             )
             .select_related('buyer', 'seller', 'product')
-            .order_by('-created_at')
+            .order_by('-last_message_at', '-id')
         )
 
+    def get_serializer(self, *args, **kwargs):
+        if kwargs.get('many') and args:
+            # One presence lookup for every chat partner on the page.
+            user_id = self.request.user.id
+            partners = [c.seller if c.buyer_id == user_id else c.buyer for c in args[0]]
+            kwargs.setdefault('context', self.get_serializer_context())['presence'] = presence.lookup(partners)
+        return super().get_serializer(*args, **kwargs)
+
 
 class MessageListView(generics.ListAPIView):
+    """
+    Messages of one conversation, optionally only those after `last_id`.
+    `before_id` pages backwards instead: it returns the window of messages
+    just before that id, with the before_id of the next older window.
+
+    The default page-number listing reads the hot Message table only, so
+    messages moved out by `archive_chat_messages` are reachable through
+    `before_id` paging alone (see Conversation.history).
+
+    Polling clients can make idle polls cheap in two ways:
+    - send back the ETag as If-None-Match. The tag is built from the
+      conversation row only (newest message id, the other side's unread
+      count), so an unchanged conversation answers 304 without reading messages;
+    - add `wait=N` (seconds, capped at settings.CHAT_LONG_POLL_MAX_WAIT) to
+      hold the request until something changes or the wait runs out. The
+      wait ties up a worker, so the cap stays low under WSGI.
+    """
     serializer_class = MessageSerializer
     permission_classes = [permissions.AllowAny]
 
+    POLL_INTERVAL = 1.0
+
     def get_serializer_context(self):
         return {'request': self.request}
 
+    def get_conversation(self):
+        if not hasattr(self, '_conversation'):
+            conversation = None
+            if _real_user(self.request):
+                conversation = _resolve_conversation(self.request, self.kwargs['conversation_id'])
+                if self.request.user.id not in (conversation.buyer_id, conversation.seller_id):
+                    conversation = None
+            self._conversation = conversation
+        return self._conversation
+
+    def get_last_id(self):
+        return _int_param(self.request.query_params.get('last_id'))
+
+    def get_wait(self):
+        try:
+            wait = float(self.request.query_params.get('wait', 0))
+        except (ValueError, TypeError):
+            return 0
+        return max(0, min(wait, settings.CHAT_LONG_POLL_MAX_WAIT))
+
+    def get_etag(self, conversation):
+        # The other participant's counter: it drops to 0 when they read our messages.
+        other_unread = (
+            conversation.seller_unread_count if self.request.user.id == conversation.buyer_id
+            else conversation.buyer_unread_count
+        )
+        # The query (last_id, page) changes the body too; `wait` does not.
+        query = '&'.join(
+            f"{name}={value}" for name, value in sorted(self.request.query_params.items()) if name != 'wait'
+        )
+        digest = hashlib.md5(query.encode()).hexdigest()[:8]
+        return (
+            f'W/"{conversation.id}-{conversation.last_message_id or 0}-'
+            f'{other_unread}-{digest}"'
+        )
+
+    def is_idle(self, conversation, etag, client_etag, last_id):
+        if client_etag:
+            return client_etag == etag
+        if last_id is not None:
+            return (conversation.last_message_id or 0) <= last_id
+        return False
+
+    def list(self, request, *args, **kwargs):
+        conversation = self.get_conversation()
+        if conversation is None:
+            return super().list(request, *args, **kwargs)
+
+        client_etag = request.headers.get('If-None-Match')
+        last_id = self.get_last_id()
+        etag = self.get_etag(conversation)
+
+        wait = self.get_wait()
+        if wait:
+            deadline = time.monotonic() + wait
+            while self.is_idle(conversation, etag, client_etag, last_id) and time.monotonic() < deadline:
+                time.sleep(min(self.POLL_INTERVAL, max(0, deadline - time.monotonic())))
+                conversation.refresh_from_db(fields=[
+                    'last_message_id', 'buyer_unread_count', 'seller_unread_count',
+                ])
+                etag = self.get_etag(conversation)
+
+        if client_etag == etag:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        before_id = _int_param(request.query_params.get('before_id'))
+        if before_id is not None:
+            response = self.history_response(conversation, before_id)
+        else:
+            response = super().list(request, *args, **kwargs)
+        response['ETag'] = etag
+        return response
+
+    def history_response(self, conversation, before_id):
+        limit = _history_window(self.request.query_params.get('page_size'))
+        window, older_id = conversation.history(before_id=before_id, limit=limit)
+        return Response({
+            'page_size': limit,
+            'before_id': older_id,
+            'has_more': older_id is not None,
+            'results': self.get_serializer(window, many=True).data,
+        })
+
     def get_queryset(self):
-        if not _real_user(self.request):
-            return Message.objects.none()
-        conversation_id = self.kwargs['conversation_id']
-        conversation = _resolve_conversation(self.request, conversation_id)
-        if self.request.user not in (conversation.buyer, conversation.seller):
+        conversation = self.get_conversation()
+        if conversation is None:
             return Message.objects.none()
 
         qs = Message.objects.filter(conversation=conversation).select_related('sender')
 
-        last_id = self.request.query_params.get('last_id')
-        if last_id:
-            try:
-                qs = qs.filter(id__gt=int(last_id))
-            except (ValueError, TypeError):
-                pass
+        last_id = self.get_last_id()
+        if last_id is not None:
+            qs = qs.filter(id__gt=last_id)
 
         qs = qs.order_by('created_at')
 
-        Message.objects.filter(
-            conversation=conversation, is_read=False
-        ).exclude(sender=self.request.user).update(is_read=True)
+        if conversation.mark_read(self.request.user):
+            events.messages_read(conversation, self.request.user)
 
         return qs
 
@@ -92,10 +221,14 @@ class SendMessageView(generics.CreateAPIView):
         if self.request.user not in (conversation.buyer, conversation.seller):
             self.permission_denied(self.request)
 
-        serializer.save(
-            conversation=conversation,
-            sender=self.request.user,
-        )
+        with transaction.atomic():
+            message = serializer.save(
+                conversation=conversation,
+                sender=self.request.user,
+            )
+            conversation.record_message(message)
+            outbox.chat_message(message)
+            events.message_created(message)
 
 
 class StartConversationView(generics.GenericAPIView):
@@ -133,25 +266,27 @@ class StartConversationView(generics.GenericAPIView):
 
         receiver = get_object_or_404(User, id=receiver_id)
 
-        conversation = Conversation.objects.filter(
-            models.Q(buyer=request.user, seller=receiver)
-            | models.Q(buyer=receiver, seller=request.user)
-        ).first()
-
-        if not conversation:
-            product_id = request.data.get('product_id')
-            conversation = Conversation.objects.create(
-                buyer=request.user,
-                seller=receiver,
-                product_id=product_id or None,
-            )
+        # get_or_create on the unique pair key: two users opening the chat at
+        # once end up in the same conversation.
+        conversation, _ = Conversation.objects.get_or_create(
+            participant_key=Conversation.pair_key(request.user.id, receiver.id),
+            defaults={
+                'buyer': request.user,
+                'seller': receiver,
+                'product_id': request.data.get('product_id') or None,
+            },
+        )
 
-        other_user = conversation.seller if conversation.buyer == request.user else conversation.buyer
+        other_user = receiver
 
-        Message.objects.filter(
-            conversation=conversation, is_read=False
-        ).exclude(sender=request.user).update(is_read=True)
+        if conversation.mark_read(request.user):
+            events.messages_read(conversation, request.user)
 
+        # Only the latest window; older messages come from MessageListView
+        # with the returned before_id.
+        window, before_id = conversation.history(
+            limit=_history_window(request.data.get('page_size') or request.query_params.get('page_size')),
+        )
         messages = [
             {
                 'id': m.id,
@@ -159,7 +294,7 @@ class StartConversationView(generics.GenericAPIView):
                 'sender__id': m.sender_id,
                 'created_at': m.created_at.isoformat(),
             }
-            for m in conversation.messages.order_by('created_at')
+            for m in window
         ]
 
         return Response({
@@ -167,4 +302,6 @@ class StartConversationView(generics.GenericAPIView):
             'partner_name': other_user.full_name or other_user.email,
             'other_user_name': other_user.full_name or other_user.email,
             'messages': messages,
+            'before_id': before_id,
+            'has_more': before_id is not None,
         }, status=status.HTTP_200_OK)
@@ -3,7 +3,7 @@ import uuid
 from datetime import datetime
 from django.http import HttpResponse
 from django.contrib import admin
-from .models import Wallet, Transaction, WithdrawalTicket, DataMarkup, DataPlanPrice
+from .models import Wallet, Transaction, WithdrawalTicket, DataMarkup, DataPlanPrice, Bank, JournalEntry, Posting, WebhookEvent
 
 
 @admin.register(WithdrawalTicket)
@@ -45,7 +45,38 @@ class WithdrawalTicketAdmin(admin.ModelAdmin):
         return response
 
 
-admin.site.register(Wallet)
+@admin.register(Wallet)
+class WalletAdmin(admin.ModelAdmin):
+    list_display = ['user', 'available_balance', 'locked_balance', 'escrow_balance', 'is_frozen']
+    search_fields = ['user__email', 'account_number']
+    # Balances only move through finance.ledger; see the journal below.
+    readonly_fields = ['available_balance', 'locked_balance', 'escrow_balance']
+
+
+class PostingInline(admin.TabularInline):
+    model = Posting
+    extra = 0
+    can_delete = False
+    readonly_fields = ['wallet', 'account', 'amount']
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(JournalEntry)
+class JournalEntryAdmin(admin.ModelAdmin):
+    list_display = ['pk', 'kind', 'reference', 'description', 'created_at']
+    list_filter = ['kind']
+    search_fields = ['reference', 'description']
+    readonly_fields = ['kind', 'reference', 'description', 'created_at']
+    inlines = [PostingInline]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
 admin.site.register(Transaction)
 
 @admin.register(DataMarkup)
@@ -60,3 +91,26 @@ class DataPlanPriceAdmin(admin.ModelAdmin):
     list_editable = ['is_active', 'selling_price']
     list_filter = ['network', 'is_active']
     search_fields = ['network', 'variation_code', 'plan_name']
+
+@admin.register(Bank)
+class BankAdmin(admin.ModelAdmin):
+    list_display = ['name', 'code', 'is_active', 'updated_at']
+    list_filter = ['is_active']
+    search_fields = ['name', 'code']
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ['pk', 'source', 'event_id', 'status', 'attempts', 'received_at', 'processed_at']
+    list_filter = ['status', 'source']
+    search_fields = ['event_id', 'last_error']
+    readonly_fields = ['source', 'event_id', 'payload', 'received_at', 'processed_at']
+    actions = ['requeue']
+
+    @admin.action(description='Requeue selected events for processing')
+    def requeue(self, request, queryset):
+        events = list(queryset.exclude(status=WebhookEvent.Status.PROCESSED))
+        for event in events:
+            event.requeue()
+        WebhookEvent.objects.bulk_update(events, ['status', 'attempts', 'next_attempt_at'])
+        self.message_user(request, f'{len(events)} event(s) requeued.')
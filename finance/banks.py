@@ -0,0 +1,96 @@
+"""
+Bank directory and account-name lookups, served locally.
+
+The bank list changes rarely, so it lives in the Bank table and is pulled
+from Monnify by `manage.py refresh_banks` (run daily). BankListView serves
+directory(), which caches the active list and its ETag in the 'bank_list'
+alias until the next refresh; clients that send the ETag back get a 304.
+
+resolve_account_name() caches successful name lookups per (bank code,
+account number) in the 'account_names' alias, so reopening the withdraw
+screen for the same account does not go back to Monnify. Failures are not
+cached, so a typo or provider error can be retried straight away.
+"""
+import hashlib
+import json
+import logging
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+from django.utils.connection import ConnectionProxy
+
+from .models import Bank
+from .utils import MonnifyAPI
+
+logger = logging.getLogger(__name__)
+
+_directory_cache = ConnectionProxy(caches, 'bank_list')
+_account_names = ConnectionProxy(caches, 'account_names')
+
+DIRECTORY_KEY = 'directory'
+
+
+def refresh_directory():
+    """
+    Syncs the Bank table with Monnify's list. Returns (created, updated,
+    deactivated) counts, or None if Monnify returned nothing, in which case
+    the table is left as it was.
+    """
+    entries = {str(entry['code']): entry for entry in MonnifyAPI.get_banks() if entry.get('code')}
+    if not entries:
+        logger.warning("Bank directory refresh skipped: Monnify returned no banks")
+        return None
+
+    now = timezone.now()
+    with transaction.atomic():
+        existing = {bank.code: bank for bank in Bank.objects.select_for_update()}
+        created, changed = [], []
+        for code, entry in entries.items():
+            name = entry.get('name', '')
+            bank = existing.get(code)
+            if bank is None:
+                created.append(Bank(code=code, name=name, data=entry))
+            elif bank.data != entry or bank.name != name or not bank.is_active:
+                bank.name, bank.data, bank.is_active, bank.updated_at = name, entry, True, now
+                changed.append(bank)
+        Bank.objects.bulk_create(created)
+        Bank.objects.bulk_update(changed, ['name', 'data', 'is_active', 'updated_at'])
+        deactivated = (
+            Bank.objects.filter(is_active=True).exclude(code__in=entries)
+            .update(is_active=False, updated_at=now)
+        )
+    _directory_cache.delete(DIRECTORY_KEY)
+    return len(created), len(changed), deactivated
+
+
+def directory():
+    """(etag, banks) for the active directory. Fills an empty table from Monnify on first use."""
+    cached = _directory_cache.get(DIRECTORY_KEY)
+    if cached is not None:
+        return cached
+
+    if not Bank.objects.exists():
+        refresh_directory()
+    banks = [bank.data for bank in Bank.objects.filter(is_active=True)]
+    etag = '"%s"' % hashlib.md5(json.dumps(banks, sort_keys=True).encode()).hexdigest()
+    # An empty list means Monnify failed; don't pin that for a day.
+    if banks:
+        _directory_cache.set(DIRECTORY_KEY, (etag, banks))
+    return etag, banks
+
+
+def _account_key(account_number, bank_code):
+    return f"{bank_code}:{account_number}"
+
+
+def resolve_account_name(account_number, bank_code):
+    """Same contract as MonnifyAPI.resolve_bank_account: (account_name, error)."""
+    key = _account_key(account_number, bank_code)
+    account_name = _account_names.get(key)
+    if account_name:
+        return account_name, None
+
+    account_name, error = MonnifyAPI.resolve_bank_account(account_number, bank_code)
+    if account_name:
+        _account_names.set(key, account_name)
+    return account_name, error
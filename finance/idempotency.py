@@ -0,0 +1,184 @@
+"""
+Idempotency-Key support for endpoints that move money.
+
+A mobile client that retries a checkout or purchase after a dropped response
+would otherwise run the whole transactional path again. Decorating the
+view's handler with @idempotent makes a request carrying an
+`Idempotency-Key` header run at most once per user and key:
+
+    class CheckoutView(APIView):
+        @idempotent
+        def post(self, request): ...
+
+The first request claims an IdempotencyKey row (unique on user + key) before
+the view runs, and the row then stores the response. A retry with the same
+key is answered from that row with one indexed lookup and carries an
+`Idempotent-Replayed: true` header. Reusing a key for a different method,
+path or body gets a 422. A retry that arrives while the first request is
+still running gets a 409. A claim left unanswered for
+settings.IDEMPOTENCY_IN_FLIGHT_TIMEOUT seconds (the worker was killed) is
+taken over by the next retry.
+
+While the handler runs, every model save (post_save, see finance.signals)
+registers a transaction.on_commit hook, which Django drops if the block
+around the save rolls back. Every ledger entry is saved, so moving money
+always counts. If no hook has run by the time the handler returns, nothing
+was committed: an exception or a 5xx then releases the key so the client
+can retry safely. Once something was committed, say a wallet debit and its
+refund around a provider outage, the 5xx is stored and replayed like any
+other response, and an exception is stored as a 500, because running the
+handler again would repeat those writes. Requests without the header behave
+as before. Keys expire after settings.IDEMPOTENCY_KEY_TTL seconds.
+"""
+import functools
+import hashlib
+import json
+import logging
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = IdempotencyKey._meta.get_field('key').max_length
+
+# The write tracker of the @idempotent handler running on this thread, if any.
+_local = threading.local()
+
+
+def _encode(value):
+    # Uploaded files are fingerprinted by name and size, not content.
+    if isinstance(value, UploadedFile):
+        return f"{value.name}:{value.size}"
+    return str(value)
+
+
+def fingerprint(request):
+    """SHA-256 of the request's method, path and parsed body."""
+    data = request.data
+    if hasattr(data, 'lists'):  # QueryDict from a form or multipart body
+        data = dict(data.lists())
+    payload = json.dumps([request.method, request.path, data], sort_keys=True, default=_encode)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _claim(user, key, request_fingerprint):
+    """(record, claimed): the row this request owns, or the existing one to answer from."""
+    now = timezone.now()
+    record = IdempotencyKey.objects.filter(user=user, key=key).first()
+    if record is not None and record.expires_at <= now:
+        record.delete()
+        record = None
+    if record is not None:
+        stale = now - timedelta(seconds=settings.IDEMPOTENCY_IN_FLIGHT_TIMEOUT)
+        if record.status_code is None and record.fingerprint == request_fingerprint and record.claimed_at <= stale:
+            # The first request never answered; take its claim over, unless
+            # another retry got there first.
+            if IdempotencyKey.objects.filter(
+                pk=record.pk, status_code__isnull=True, claimed_at=record.claimed_at,
+            ).update(claimed_at=now):
+                record.claimed_at = now
+                return record, True
+        return record, False
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(
+                user=user, key=key, fingerprint=request_fingerprint, claimed_at=now,
+                expires_at=now + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL),
+            ), True
+    except IntegrityError:
+        # A concurrent request with the same key claimed it first.
+        return IdempotencyKey.objects.filter(user=user, key=key).first(), False
+
+
+def _replay(record, request_fingerprint):
+    if record is not None and record.fingerprint != request_fingerprint:
+        return Response(
+            {"error": "This Idempotency-Key was already used for a different request."},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    if record is None or record.status_code is None:
+        return Response(
+            {"error": "A request with this Idempotency-Key is still being processed."},
+            status=status.HTTP_409_CONFLICT,
+        )
+    response = Response(record.response_body, status=record.status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+class _WriteTracker:
+    """Set once a write made by the handler has been committed."""
+
+    def __init__(self):
+        self.committed = False
+
+    def mark_committed(self):
+        self.committed = True
+
+
+def note_write():
+    """Called for every model save; records it against the running @idempotent handler."""
+    writes = getattr(_local, 'writes', None)
+    if writes is not None and not writes.committed:
+        # Runs at once outside a transaction; dropped if the block rolls back.
+        transaction.on_commit(writes.mark_committed)
+
+
+def _owned(record):
+    # A claim taken over by a later retry no longer belongs to this request.
+    return IdempotencyKey.objects.filter(pk=record.pk, claimed_at=record.claimed_at)
+
+
+def _store(record, response, wrote):
+    # Only DRF Responses carry .data to replay; anything else is just released.
+    if not isinstance(response, Response) or (response.status_code >= 500 and not wrote):
+        _owned(record).delete()
+        return
+    try:
+        _owned(record).update(status_code=response.status_code, response_body=response.data)
+    except (TypeError, ValueError):
+        logger.exception("Could not store the response for Idempotency-Key %s", record.key)
+        _owned(record).delete()
+
+
+def idempotent(handler):
+    """Decorates an APIView handler (e.g. post) to honour the Idempotency-Key header."""
+    @functools.wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return handler(view, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {"error": f"{HEADER} must be at most {MAX_KEY_LENGTH} characters."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        request_fingerprint = fingerprint(request)
+        record, claimed = _claim(request.user, key, request_fingerprint)
+        if not claimed:
+            return _replay(record, request_fingerprint)
+        writes, outer = _WriteTracker(), getattr(_local, 'writes', None)
+        _local.writes = writes
+        try:
+            response = handler(view, request, *args, **kwargs)
+        except Exception:
+            _local.writes = outer
+            _store(record, Response(
+                {"error": "The request failed after it was partly applied."},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            ), writes.committed)
+            raise
+        _local.writes = outer
+        _store(record, response, writes.committed)
+        return response
+    return wrapper
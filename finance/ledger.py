@@ -0,0 +1,135 @@
+"""
+Double-entry ledger behind the wallet balances.
+
+Every change to a Wallet balance column is a JournalEntry whose Postings sum
+to zero. A posting moves one account: a wallet's available, locked or escrow
+balance, or a platform account. EXTERNAL is the other side of money entering
+or leaving the platform (bank deposits, withdrawals, bill providers) and
+REVENUE collects platform commission, so a ₦1,000 deposit is
+
+    post(Kind.DEPOSIT, [(available(wallet), 1000), (EXTERNAL, -1000)])
+
+post() applies the wallet legs to the Wallet columns with one conditional
+UPDATE per wallet (see apply()), then writes the entry and its postings, all
+in one transaction. A debit that would overdraw a balance matches no row and
+raises InsufficientFunds before anything is written. Wallet.<account>_balance
+therefore always equals the sum of that account's postings;
+`manage.py reconcile_ledger` checks exactly that.
+
+Balance columns must not be assigned and save()d directly any more; a stale
+instance saved later would overwrite the ledger's updates. Code that edits
+other Wallet fields saves with update_fields.
+"""
+from collections import defaultdict
+from decimal import Decimal
+from typing import NamedTuple
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import JournalEntry, Posting, Wallet
+
+Kind = JournalEntry.Kind
+
+
+class Account(NamedTuple):
+    wallet_id: object
+    name: str
+
+
+class UnbalancedEntry(ValueError):
+    pass
+
+
+class InsufficientFunds(Exception):
+    """A debit leg would take a wallet balance below zero; nothing was written."""
+
+    def __init__(self, wallet_id):
+        super().__init__(f"Insufficient balance in wallet {wallet_id}")
+        self.wallet_id = wallet_id
+
+
+EXTERNAL = Account(None, Posting.Account.EXTERNAL)
+REVENUE = Account(None, Posting.Account.REVENUE)
+
+
+def _wallet_id(wallet):
+    return wallet.pk if isinstance(wallet, Wallet) else wallet
+
+
+def wallet_account(wallet, name):
+    return Account(_wallet_id(wallet), name)
+
+
+def available(wallet):
+    return wallet_account(wallet, Posting.Account.AVAILABLE)
+
+
+def locked(wallet):
+    return wallet_account(wallet, Posting.Account.LOCKED)
+
+
+def escrow(wallet):
+    return wallet_account(wallet, Posting.Account.ESCROW)
+
+
+def balance_field(account):
+    """The Wallet column a wallet account is materialised in."""
+    return f"{account}_balance"
+
+
+def post(kind, legs, description='', reference=''):
+    """
+    Records one journal entry. `legs` is a list of (Account, amount) pairs
+    whose amounts sum to zero; zero-amount legs are dropped. Returns the
+    JournalEntry, or None when nothing moves. Raises InsufficientFunds if a
+    debit leg would overdraw its wallet.
+    """
+    legs = [(account, Decimal(str(amount))) for account, amount in legs if amount]
+    if not legs:
+        return None
+    if sum((amount for _, amount in legs), Decimal('0')) != 0:
+        raise UnbalancedEntry(f"Postings for {kind} do not sum to zero: {legs}")
+
+    changes = defaultdict(lambda: defaultdict(Decimal))
+    for account, amount in legs:
+        if account.wallet_id is not None:
+            changes[account.wallet_id][balance_field(account.name)] += amount
+
+    with transaction.atomic():
+        now = timezone.now()
+        # Wallets are updated in id order, so concurrent entries touching the
+        # same wallets take their row locks in the same order.
+        for wallet_id in sorted(changes):
+            if not apply(wallet_id, changes[wallet_id], now):
+                raise InsufficientFunds(wallet_id)
+        entry = JournalEntry.objects.create(kind=kind, description=description[:255], reference=reference or '')
+        Posting.objects.bulk_create(
+            Posting(entry=entry, wallet_id=account.wallet_id, account=account.name, amount=amount)
+            for account, amount in legs
+        )
+    return entry
+
+
+def apply(wallet_id, changes, now=None):
+    """
+    Applies {balance field: delta} to one wallet with a single conditional
+    UPDATE: every field that goes down must cover the debit, e.g.
+
+        UPDATE wallet SET available_balance = available_balance - X
+        WHERE id = ? AND available_balance >= X
+
+    The row is checked and changed in one statement, so no lock is held
+    across a read and a write. Returns False, changing nothing, when a
+    balance is short.
+    """
+    guards = {f"{field}__gte": -delta for field, delta in changes.items() if delta < 0}
+    return Wallet.objects.filter(pk=wallet_id, **guards).update(
+        updated_at=now or timezone.now(),
+        **{field: F(field) + delta for field, delta in changes.items()},
+    ) == 1
+
+
+def transfer(kind, source, destination, amount, description='', reference=''):
+    """Moves `amount` from one account to another."""
+    return post(kind, [(source, -amount), (destination, amount)], description, reference)
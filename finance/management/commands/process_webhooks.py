@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from finance.webhooks import process_batch
+
+
+class Command(BaseCommand):
+    help = 'Processes queued provider webhooks from the inbox in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help='Events claimed per batch (default: 100).',
+        )
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep polling the inbox instead of exiting once it is drained.',
+        )
+        parser.add_argument(
+            '--interval', type=float, default=2.0,
+            help='Seconds to sleep between polls of an empty inbox with --loop (default: 2).',
+        )
+
+    def handle(self, *args, **options):
+        handled = 0
+        while True:
+            count = process_batch(batch_size=options['batch_size'])
+            handled += count
+            if count:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f"Processed {handled} webhook event(s)."))
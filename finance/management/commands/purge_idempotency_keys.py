@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from finance.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = 'Deletes stored Idempotency-Key responses that have expired.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Rows deleted per statement (default: 1000).',
+        )
+
+    def handle(self, *args, **options):
+        expired = IdempotencyKey.objects.filter(expires_at__lte=timezone.now())
+        deleted = 0
+        while True:
+            batch = list(expired.values_list('pk', flat=True)[:options['batch_size']])
+            if not batch:
+                break
+            deleted += IdempotencyKey.objects.filter(pk__in=batch).delete()[0]
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired idempotency key(s)."))
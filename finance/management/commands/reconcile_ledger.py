@@ -0,0 +1,67 @@
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import DecimalField, F, Q, Sum, Value
+from django.db.models.functions import Coalesce, Round
+
+from finance.ledger import balance_field
+from finance.models import JournalEntry, Posting, Wallet
+
+WALLET_ACCOUNTS = (Posting.Account.AVAILABLE, Posting.Account.LOCKED, Posting.Account.ESCROW)
+CENT = Decimal('0.01')
+
+
+class Command(BaseCommand):
+    help = (
+        "Checks that every wallet balance equals the sum of its ledger postings "
+        "and that every journal entry sums to zero. Exits non-zero on any mismatch."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Rows fetched per round trip while streaming results (default: 1000).',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        problems = 0
+
+        # One GROUP BY over wallets and their postings; only mismatched rows come back.
+        posted = {
+            f"posted_{account}": Round(Coalesce(
+                Sum('postings__amount', filter=Q(postings__account=account)),
+                Value(Decimal('0')), output_field=DecimalField(max_digits=14, decimal_places=2),
+            ), 2)
+            for account in WALLET_ACCOUNTS
+        }
+        mismatch = Q()
+        for account in WALLET_ACCOUNTS:
+            mismatch |= ~Q(**{balance_field(account): F(f"posted_{account}")})
+        wallets = (
+            Wallet.objects.annotate(**posted).filter(mismatch).order_by()
+            .values_list('pk', *(value for account in WALLET_ACCOUNTS for value in (balance_field(account), f"posted_{account}")))
+        )
+        for wallet_id, *values in wallets.iterator(chunk_size=batch_size):
+            problems += 1
+            # SQLite hands the sums back as floats; compare and print them as money.
+            values = [Decimal(str(value)).quantize(CENT) for value in values]
+            details = ", ".join(
+                f"{account} {balance} != posted {total}"
+                for account, balance, total in zip(WALLET_ACCOUNTS, values[::2], values[1::2])
+                if balance != total
+            )
+            self.stderr.write(f"Wallet {wallet_id}: {details}")
+
+        entries = (
+            JournalEntry.objects.annotate(total=Round(Sum('postings__amount'), 2))
+            .exclude(total=0).order_by().values_list('pk', 'total')
+        )
+        for entry_id, total in entries.iterator(chunk_size=batch_size):
+            problems += 1
+            self.stderr.write(f"Journal entry {entry_id} does not balance: postings sum to {total}")
+
+        if problems:
+            raise CommandError(f"Ledger reconciliation found {problems} problem(s).")
+        self.stdout.write(self.style.SUCCESS(
+            f"Ledger reconciled: {Wallet.objects.count()} wallet(s) match their postings."
+        ))
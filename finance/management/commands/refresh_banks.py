@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from finance.banks import refresh_directory
+
+
+class Command(BaseCommand):
+    help = "Pulls Monnify's bank list into the local Bank table. Run daily."
+
+    def handle(self, *args, **options):
+        result = refresh_directory()
+        if result is None:
+            raise CommandError("Monnify returned no banks; the directory was left unchanged.")
+        created, updated, deactivated = result
+        self.stdout.write(self.style.SUCCESS(
+            f"Bank directory refreshed: {created} added, {updated} updated, {deactivated} deactivated."
+        ))
@@ -0,0 +1,36 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from finance.requery import requery_pending
+
+
+class Command(BaseCommand):
+    help = 'Asks Nellobyte about data purchases still pending and settles the finished ones.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-minutes', type=int, default=settings.DATA_PURCHASE_REQUERY_AFTER_MINUTES,
+            help=f'Requery purchases pending longer than this (default: {settings.DATA_PURCHASE_REQUERY_AFTER_MINUTES}).',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help='Purchases loaded per query (default: 100).',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=settings.NELLOBYTE_REQUERY_WORKERS,
+            help=f'Concurrent Nellobyte requests (default: {settings.NELLOBYTE_REQUERY_WORKERS}).',
+        )
+        parser.add_argument(
+            '--rate', type=float, default=settings.NELLOBYTE_REQUERY_RATE,
+            help=f'Maximum Nellobyte requests per second (default: {settings.NELLOBYTE_REQUERY_RATE}).',
+        )
+
+    def handle(self, *args, **options):
+        totals = requery_pending(
+            timedelta(minutes=options['older_than_minutes']),
+            batch_size=options['batch_size'], workers=options['workers'], rate=options['rate'],
+        )
+        summary = ", ".join(f"{totals[key]} {key}" for key in ('succeeded', 'failed', 'pending', 'skipped', 'errors'))
+        self.stdout.write(self.style.SUCCESS(f"Requeried {sum(totals.values())} purchase(s): {summary}."))
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-17 22:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0012_alter_transaction_transaction_type'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['wallet', '-created_at'], name='finance_tra_wallet__4bc174_idx'),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.8 on 2026-10-17 23:19
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Q
+
+BALANCE_ACCOUNTS = ('available', 'locked', 'escrow')
+
+
+def open_wallet_balances(apps, schema_editor):
+    """One opening entry carrying every wallet's current balances, balanced against 'external'."""
+    Wallet = apps.get_model('finance', 'Wallet')
+    JournalEntry = apps.get_model('finance', 'JournalEntry')
+    Posting = apps.get_model('finance', 'Posting')
+
+    wallets = Wallet.objects.filter(
+        ~Q(available_balance=0) | ~Q(locked_balance=0) | ~Q(escrow_balance=0)
+    ).order_by('pk').values_list('pk', *(f"{account}_balance" for account in BALANCE_ACCOUNTS))
+    if not wallets.exists():
+        return
+
+    entry = JournalEntry.objects.create(kind='opening', description="Opening balances")
+    total = Decimal('0')
+    batch = []
+    for wallet_id, *balances in wallets.iterator(chunk_size=1000):
+        for account, balance in zip(BALANCE_ACCOUNTS, balances):
+            if balance:
+                batch.append(Posting(entry=entry, wallet_id=wallet_id, account=account, amount=balance))
+                total += balance
+        if len(batch) >= 1000:
+            Posting.objects.bulk_create(batch)
+            batch = []
+    batch.append(Posting(entry=entry, account='external', amount=-total))
+    Posting.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0014_bank'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JournalEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('opening', 'Opening Balance'), ('deposit', 'Deposit (Top-up)'), ('payment', 'Payment for Order/Job'), ('escrow_lock', 'Locked in Escrow'), ('escrow_release', 'Released from Escrow'), ('refund', 'Refund'), ('withdrawal', 'Withdrawal to Bank'), ('fee', 'Platform Fee'), ('bill_payment', 'Bill Payment'), ('promotion', 'Promoted Post Fee')], max_length=20)),
+                ('reference', models.CharField(blank=True, db_index=True, max_length=100)),
+                ('description', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Journal entries',
+            },
+        ),
+        migrations.CreateModel(
+            name='Posting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account', models.CharField(choices=[('available', 'Wallet: available'), ('locked', 'Wallet: locked'), ('escrow', 'Wallet: escrow'), ('external', 'Platform: external funds'), ('revenue', 'Platform: revenue')], max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('entry', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='postings', to='finance.journalentry')),
+                ('wallet', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='postings', to='finance.wallet')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['wallet', 'account'], name='finance_pos_wallet__07106d_idx')],
+            },
+        ),
+        migrations.RunPython(open_wallet_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-18 00:34
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0017_webhookevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idempotencykey',
+            name='claimed_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, help_text='When the running request claimed the key'),
+        ),
+    ]
@@ -1,6 +1,9 @@
+from datetime import timedelta
 from decimal import Decimal
 from django.db import models, transaction
+from django.core.serializers.json import DjangoJSONEncoder
 from django.conf import settings
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 import uuid
 
@@ -100,6 +103,11 @@ class Transaction(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['wallet', '-created_at']),
+        ]
+
     def __str__(self):
         return f"{self.transaction_type} - {self.amount}"
 
@@ -117,6 +125,171 @@ class BankAccount(models.Model):
 
 
 
+class JournalEntry(models.Model):
+    """
+    One balanced movement of money: two or more Postings that sum to zero.
+    Written only through finance.ledger.post(); entries are never edited,
+    a correction is a new entry.
+    """
+
+    class Kind(models.TextChoices):
+        OPENING = 'opening', _('Opening Balance')
+        DEPOSIT = 'deposit', _('Deposit (Top-up)')
+        PAYMENT = 'payment', _('Payment for Order/Job')
+        ESCROW_LOCK = 'escrow_lock', _('Locked in Escrow')
+        ESCROW_RELEASE = 'escrow_release', _('Released from Escrow')
+        REFUND = 'refund', _('Refund')
+        WITHDRAWAL = 'withdrawal', _('Withdrawal to Bank')
+        FEE = 'fee', _('Platform Fee')
+        BILL_PAYMENT = 'bill_payment', _('Bill Payment')
+        PROMOTION = 'promotion', _('Promoted Post Fee')
+
+    kind = models.CharField(max_length=20, choices=Kind.choices)
+    reference = models.CharField(max_length=100, blank=True, db_index=True)
+    description = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = "Journal entries"
+
+    def __str__(self):
+        return f"#{self.pk} {self.kind} {self.reference}".rstrip()
+
+
+class Posting(models.Model):
+    """
+    One leg of a JournalEntry. `amount` is signed: positive increases the
+    account's balance. Wallet accounts mirror the Wallet balance columns;
+    platform accounts (wallet is null) hold the other side of money entering
+    or leaving the platform and the platform's commission.
+    """
+
+    class Account(models.TextChoices):
+        AVAILABLE = 'available', _('Wallet: available')
+        LOCKED = 'locked', _('Wallet: locked')
+        ESCROW = 'escrow', _('Wallet: escrow')
+        EXTERNAL = 'external', _('Platform: external funds')
+        REVENUE = 'revenue', _('Platform: revenue')
+
+    entry = models.ForeignKey(JournalEntry, on_delete=models.PROTECT, related_name='postings')
+    wallet = models.ForeignKey(Wallet, on_delete=models.PROTECT, related_name='postings', null=True, blank=True)
+    account = models.CharField(max_length=20, choices=Account.choices)
+    amount = models.DecimalField(max_digits=14, decimal_places=2)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['wallet', 'account']),
+        ]
+
+    def __str__(self):
+        return f"{self.account} {self.amount}"
+
+
+class Bank(models.Model):
+    """
+    Local copy of Monnify's bank directory, refreshed daily by
+    `manage.py refresh_banks`. `data` is the provider's entry exactly as
+    returned, which BankListView serves unchanged. Banks that drop out of the
+    provider's list are deactivated rather than deleted.
+    """
+    code = models.CharField(max_length=10, unique=True)
+    name = models.CharField(max_length=255)
+    data = models.JSONField(default=dict)
+    is_active = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return f"{self.name} ({self.code})"
+
+
+class WebhookEvent(models.Model):
+    """
+    Inbox row for one provider callback.
+
+    The webhook endpoints only check the request, store the raw payload here
+    and answer 200; `manage.py process_webhooks` runs the handlers (see
+    finance.webhooks). (source, event_id) is unique, so a provider retrying
+    the same callback adds nothing. Events that keep failing, or that can
+    never succeed, end up DEAD for an admin to inspect and requeue.
+    """
+
+    class Source(models.TextChoices):
+        MONNIFY = 'monnify', 'Monnify'
+        CLUBKONNECT_DEPOSIT = 'clubkonnect_deposit', 'Clubkonnect deposit'
+        NELLOBYTE_DATA = 'nellobyte_data', 'Nellobyte data purchase'
+        LOGISTICS_DATA = 'logistics_data', 'Nellobyte data purchase (logistics)'
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        PROCESSED = 'processed', 'Processed'
+        DEAD = 'dead', 'Dead'
+
+    MAX_ATTEMPTS = 5
+
+    source = models.CharField(max_length=20, choices=Source.choices)
+    event_id = models.CharField(max_length=255)
+    payload = models.JSONField(default=dict)
+
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.CharField(max_length=255, blank=True, default='')
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+        unique_together = ('source', 'event_id')
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='webhook_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.source} {self.event_id} ({self.status})"
+
+    def schedule_retry(self, error):
+        """Records a failed attempt; backs off exponentially, then gives up."""
+        self.attempts += 1
+        self.last_error = str(error)[:255]
+        if self.attempts >= self.MAX_ATTEMPTS:
+            self.status = self.Status.DEAD
+        else:
+            self.next_attempt_at = timezone.now() + timedelta(seconds=30 * 2 ** (self.attempts - 1))
+
+    def requeue(self):
+        self.status = self.Status.PENDING
+        self.attempts = 0
+        self.next_attempt_at = timezone.now()
+
+
+class IdempotencyKey(models.Model):
+    """
+    A client-supplied Idempotency-Key and the response it produced, so a
+    retried money-moving request gets the first response back instead of
+    running again (see finance.idempotency). `status_code` is null while the
+    first request is still running; `claimed_at` lets a retry take over a
+    claim whose worker died (IDEMPOTENCY_IN_FLIGHT_TIMEOUT). Rows past `expires_at` are ignored and
+    deleted by `manage.py purge_idempotency_keys`.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64, help_text="SHA-256 of the method, path and body")
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    claimed_at = models.DateTimeField(default=timezone.now, help_text="When the running request claimed the key")
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ('user', 'key')
+
+    def __str__(self):
+        return f"{self.key} ({self.status_code or 'in progress'})"
+
+
 class WithdrawalTicket(models.Model):
     """
     Admin-payout-queue entry. Funds are pre-deducted from the user's
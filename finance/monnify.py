@@ -0,0 +1,149 @@
+"""
+Shared HTTP client for the Monnify API.
+
+Every Monnify call used to start with its own login and go out over a fresh
+connection through bare requests.post/get. MonnifyClient keeps one bearer
+token per process, reused until REFRESH_MARGIN seconds before Monnify says it
+expires (responseBody.expiresIn), and logs in again from a single thread under
+a lock so a burst of calls at expiry makes one login, not one each. Requests
+go through one pooled requests.Session, so connections are kept alive between
+calls.
+
+Transport retries: a connection that could not be opened is retried with
+backoff for any method, since nothing reached Monnify. 429 and 5xx responses
+are retried only for GETs; a POST such as a disbursement is never repeated
+automatically. A 401 means the token was revoked early: the client logs in
+again and resends the request once.
+
+MonnifyAPI (finance.utils) is built on the module-level `monnify` client.
+"""
+import base64
+import logging
+import re
+import threading
+import time
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+
+class MonnifyError(Exception):
+    """Raised when the client cannot get a bearer token from Monnify."""
+
+
+class MonnifyClient:
+    REFRESH_MARGIN = 60          # seconds before expiry at which the token is renewed
+    DEFAULT_TOKEN_TTL = 3600     # used when the login response has no expiresIn
+    DEFAULT_TIMEOUT = 20
+    POOL_SIZE = 10
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._token = None
+        self._expires_at = 0.0
+        self.session = self._build_session()
+
+    def _build_session(self):
+        retry = Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset({'GET'}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=self.POOL_SIZE, pool_maxsize=self.POOL_SIZE, max_retries=retry)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    @staticmethod
+    def url(path):
+        base = settings.MONNIFY_BASE_URL.strip().rstrip('/')
+
+        # Fix the "https:https://" bug: keep only the scheme written next to the host.
+        if "://" in base:
+            parts = base.split("://")
+            scheme = parts[-2].split(':')[-1] or 'https'
+            base = f"{scheme}://{parts[-1]}"
+
+        # Drop any versioning in the base URL; paths carry their own.
+        base = re.sub(r'/api/v(1|2)$', '', base)
+
+        if not path.startswith('/'):
+            path = f"/{path}"
+        return f"{base}{path}"
+
+    # --- token -------------------------------------------------------------
+
+    def token(self):
+        """The current bearer token, logging in first if it is missing or about to expire."""
+        if self._token and time.monotonic() < self._expires_at:
+            return self._token
+        with self._lock:
+            # Another thread may have logged in while this one waited.
+            if self._token and time.monotonic() < self._expires_at:
+                return self._token
+            self._token, self._expires_at = self._login()
+            return self._token
+
+    def invalidate(self, token=None):
+        """Forgets the cached token (only if it is still `token`, when given)."""
+        with self._lock:
+            if token is None or token == self._token:
+                self._token = None
+                self._expires_at = 0.0
+
+    def _login(self):
+        url = self.url("/api/v1/auth/login")
+        credentials = base64.b64encode(f"{settings.MONNIFY_API_KEY}:{settings.MONNIFY_SECRET_KEY}".encode()).decode()
+        try:
+            response = self.session.post(
+                url,
+                headers={"Authorization": f"Basic {credentials}", "Content-Type": "application/json"},
+                timeout=15,
+            )
+        except requests.RequestException as e:
+            logger.error(f"❌ Monnify Connection Error: {e} | URL used: {url}")
+            raise MonnifyError(f"Could not reach Monnify: {e}") from e
+
+        if response.status_code != 200:
+            logger.error(f"❌ Monnify Auth Rejected: {response.status_code} - {response.text}")
+            raise MonnifyError(f"Monnify login rejected with status {response.status_code}")
+
+        body = response.json()['responseBody']
+        expires_in = int(body.get('expiresIn') or self.DEFAULT_TOKEN_TTL)
+        return body['accessToken'], time.monotonic() + max(expires_in - self.REFRESH_MARGIN, 0)
+
+    # --- requests ----------------------------------------------------------
+
+    def request(self, method, path, **kwargs):
+        """
+        Sends an authenticated request to `path` and returns the response.
+        Raises MonnifyError when no token can be obtained and
+        requests.RequestException on transport failures.
+        """
+        kwargs.setdefault('timeout', self.DEFAULT_TIMEOUT)
+        headers = kwargs.pop('headers', None) or {}
+        url = self.url(path)
+        for attempt in range(2):
+            token = self.token()
+            response = self.session.request(
+                method, url, headers={**headers, "Authorization": f"Bearer {token}"}, **kwargs,
+            )
+            if response.status_code != 401 or attempt:
+                return response
+            logger.warning("Monnify rejected a cached token; logging in again")
+            self.invalidate(token)
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+
+monnify = MonnifyClient()
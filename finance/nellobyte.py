@@ -1,9 +1,24 @@
 import logging
+import threading
+import time
 import requests
 from django.conf import settings
+from django.core.cache import caches
+from django.utils.connection import ConnectionProxy
 
 logger = logging.getLogger(__name__)
 
+# A purchase's reference is Nellobyte's OrderID. When Nellobyte returns none,
+# our own RequestID is stored instead, marked with this prefix so a requery
+# knows which id it holds (both can be all digits).
+REQUEST_ID_PREFIX = 'req:'
+
+
+def purchase_reference(resp, request_id):
+    """The reference to store for a purchase: the OrderID, else the marked RequestID."""
+    return resp.get('orderid') or f"{REQUEST_ID_PREFIX}{request_id}"
+
+
 class NellobyteClient:
     def __init__(self):
         self.user_id = settings.NELLOBYTE_USER_ID
@@ -31,9 +46,18 @@ class NellobyteClient:
 
     def fetch_all_variations(self, network_key):
         """
-        Fetches all available plans for a specific network using the V2 plans endpoint.
+        Returns the plans for one network: 'MTN', 'Glo', 'Airtel' or '9mobile'.
 
-        network_key: one of 'MTN', 'Glo', 'Airtel', '9mobile'
+        Served from the shared PlanCatalog, so repeated calls (one per network
+        in DataVariationsView, one per purchase for pricing) reuse a single
+        download of the plans document instead of fetching it each time.
+        """
+        return plan_catalog.plans(network_key)
+
+    def fetch_plan_document(self):
+        """
+        Downloads the V2 plans document and returns its MOBILE_NETWORK mapping.
+        Raises on transport errors or an unexpected response shape.
 
         The V2 endpoint returns:
         {
@@ -53,36 +77,15 @@ class NellobyteClient:
         plan catalog. Confirmed by direct testing — do not add UserID back here.
         """
         url = f"{self.base_url}/APIDatabundlePlansV2.asp"
+        response = requests.get(url, timeout=20)
+        data = response.json()
 
-        try:
-            response = requests.get(url, timeout=20)
-            data = response.json()
-
-            mobile_networks = data.get('MOBILE_NETWORK')
-            if mobile_networks is None:
-                logger.error(
-                    f"[Nellobyte] Unexpected plans response shape for '{network_key}' — "
-                    f"no MOBILE_NETWORK key. Raw response: {response.text[:500]}"
-                )
-                return []
-
-            api_key = self.NETWORK_KEY_MAP.get(network_key, network_key)
-            network_entries = mobile_networks.get(api_key, [])
-
-            if not network_entries:
-                logger.warning(
-                    f"[Nellobyte] No entries found for network '{network_key}' (api_key='{api_key}'). "
-                    f"Available keys: {list(mobile_networks.keys())}"
-                )
-                return []
-
-            # Each entry is { "ID": "01", "PRODUCT": [...] }
-            products = network_entries[0].get('PRODUCT', [])
-            return products
-
-        except Exception as e:
-            logger.error(f"[Nellobyte] fetch_all_variations error for '{network_key}': {e}")
-            return []
+        mobile_networks = data.get('MOBILE_NETWORK')
+        if mobile_networks is None:
+            raise ValueError(
+                f"Unexpected plans response shape — no MOBILE_NETWORK key. Raw response: {response.text[:500]}"
+            )
+        return mobile_networks
 
     def purchase_data(self, request_id, service_id, data_plan, phone):
         url = f"{self.base_url}/APIDatabundleV1.asp"
@@ -136,3 +139,155 @@ class NellobyteClient:
         except Exception as e:
             print(f"NELLOBYTE VIRTUAL ACCOUNT ERROR: {e}")
             return None
+
+
+class PlanCatalog:
+    """
+    Process-wide index of Nellobyte's data plans.
+
+    The plans document is downloaded once and split per network, then stored
+    in the 'provider_plans' cache so every worker shares it. Each process also
+    keeps an in-memory index keyed by (network_key, PRODUCT_ID), which makes a
+    price lookup a single dict hit.
+
+    Freshness:
+    * After REFRESH_AHEAD of the TTL has passed, the next read starts a
+      background refresh and keeps serving the current snapshot.
+    * Once the TTL has passed, a read refreshes synchronously. Only one worker
+      across all processes downloads at a time; the others keep serving the
+      expired snapshot meanwhile.
+    * If Nellobyte is down, the last good snapshot keeps being served for up
+      to STALE_FOR seconds past its TTL. A failed download is not retried by
+      any process for RETRY_AFTER seconds, so an outage costs one timeout per
+      window instead of one per read.
+    """
+    CACHE_KEY = 'nellobyte:plans'
+    REFRESH_LOCK_KEY = 'nellobyte:plans:refreshing'
+    FAILED_KEY = 'nellobyte:plans:failed_at'
+    REFRESH_AHEAD = 0.8
+    STALE_FOR = 24 * 60 * 60
+    RETRY_AFTER = 60
+
+    def __init__(self):
+        self._refresh_lock = threading.Lock()
+        # (entry, index) swapped in as one reference, so readers never see a
+        # half-built index and need no lock.
+        self._snapshot = None
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'CACHE_TIMEOUTS', {}).get('provider_plans', 3600)
+
+    def plans(self, network_key):
+        snapshot = self._current()
+        return list(snapshot[0]['networks'].get(network_key, [])) if snapshot else []
+
+    def get_plan(self, network_key, product_id):
+        """Returns the raw PRODUCT dict for a plan, or None."""
+        snapshot = self._current()
+        return snapshot[1].get((network_key, str(product_id))) if snapshot else None
+
+    def refresh(self):
+        """Downloads the document now. Returns the new snapshot, or None on failure."""
+        try:
+            document = NellobyteClient().fetch_plan_document()
+        except Exception as e:
+            logger.error(f"[Nellobyte] plan catalog refresh failed: {e}")
+            _plans_cache.set(self.FAILED_KEY, time.time(), self.RETRY_AFTER)
+            return None
+
+        networks = {}
+        for network_key, api_key in NellobyteClient.NETWORK_KEY_MAP.items():
+            entries = document.get(api_key) or []
+            if not entries:
+                logger.warning(
+                    f"[Nellobyte] No entries found for network '{network_key}' (api_key='{api_key}'). "
+                    f"Available keys: {list(document.keys())}"
+                )
+            # Each entry is { "ID": "01", "PRODUCT": [...] }
+            networks[network_key] = entries[0].get('PRODUCT', []) if entries else []
+
+        entry = {'fetched_at': time.time(), 'networks': networks}
+        _plans_cache.set(self.CACHE_KEY, entry, self.ttl + self.STALE_FOR)
+        return self._adopt(entry)
+
+    def clear(self):
+        self._snapshot = None
+        _plans_cache.delete_many([self.CACHE_KEY, self.FAILED_KEY])
+
+    # --- internals ---------------------------------------------------------
+
+    def _age(self, snapshot):
+        return time.time() - snapshot[0]['fetched_at']
+
+    def _backing_off(self):
+        failed_at = _plans_cache.get(self.FAILED_KEY)
+        return failed_at is not None and time.time() - failed_at < self.RETRY_AFTER
+
+    def _current(self):
+        snapshot = self._snapshot
+        if snapshot is not None and self._age(snapshot) < self.ttl * self.REFRESH_AHEAD:
+            return snapshot
+
+        # Another worker may have refreshed the shared copy already.
+        shared = _plans_cache.get(self.CACHE_KEY)
+        if shared is not None and (snapshot is None or shared['fetched_at'] > snapshot[0]['fetched_at']):
+            snapshot = self._adopt(shared)
+
+        if snapshot is not None and self._age(snapshot) < self.ttl:
+            if self._age(snapshot) >= self.ttl * self.REFRESH_AHEAD:
+                self._refresh_in_background()
+            return snapshot
+
+        if self._backing_off():
+            return snapshot
+        with self._refresh_lock:
+            # A thread that held the lock before us may have just refreshed or failed.
+            latest = self._snapshot
+            if latest is not None and self._age(latest) < self.ttl:
+                return latest
+            if self._backing_off():
+                return latest
+            # cache.add is atomic: one download across all processes. A process
+            # with no snapshot at all has nothing to serve, so it downloads anyway.
+            owns_lock = _plans_cache.add(self.REFRESH_LOCK_KEY, 1, 60)
+            if not owns_lock and latest is not None:
+                return latest
+            try:
+                fresh = self.refresh()
+            finally:
+                if owns_lock:
+                    _plans_cache.delete(self.REFRESH_LOCK_KEY)
+        if fresh is not None:
+            return fresh
+        if latest is not None:
+            logger.warning(f"[Nellobyte] provider unavailable; serving plans {int(self._age(latest))}s old")
+        return latest
+
+    def _adopt(self, entry):
+        index = {}
+        for network_key, products in entry['networks'].items():
+            for plan in products:
+                pid = str(plan.get('PRODUCT_ID', '') or plan.get('ID', '') or '')
+                index[(network_key, pid)] = plan
+        self._snapshot = (entry, index)
+        return self._snapshot
+
+    def _refresh_in_background(self):
+        # cache.add is atomic, so only one worker across all processes refreshes.
+        if self._backing_off() or not _plans_cache.add(self.REFRESH_LOCK_KEY, 1, 60):
+            return
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                _plans_cache.delete(self.REFRESH_LOCK_KEY)
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+
+_plans_cache = ConnectionProxy(caches, 'provider_plans')
+plan_catalog = PlanCatalog()
@@ -0,0 +1,194 @@
+"""
+Selling prices for data plans.
+
+Every place that turns a Nellobyte plan into a price goes through
+`pricing_engine`:
+- DataPurchaseView and logistics PurchaseDataView, when charging;
+- DataVariationsView, when listing;
+- the admin pricing pages.
+
+The rules (per-network DataMarkup factors, per-plan DataPlanPrice overrides
+and disabled plans) are loaded in two queries into an in-memory table. The
+table is stamped with a version number kept in the shared cache. Saving or
+deleting a DataMarkup or DataPlanPrice bumps that version (see
+finance.signals). Each process compares its table's version with the shared
+one and reloads when it is behind, so an admin edit reaches every worker on
+its next request.
+"""
+import logging
+import threading
+from decimal import Decimal
+from django.core.cache import caches
+from django.db import transaction
+from django.db.utils import OperationalError, ProgrammingError
+from django.utils.connection import ConnectionProxy
+from .models import DataMarkup, DataPlanPrice
+from .nellobyte import plan_catalog
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PRICE_FACTOR = 1.10
+
+SERVICE_TO_NETWORK = {
+    'mtn-data': 'MTN',
+    'glo-data': 'Glo',
+    'airtel-data': 'Airtel',
+    '9mobile-data': '9mobile',
+}
+
+# Field names seen across Nellobyte's V2 response and older conventions.
+CODE_FIELDS = ('PRODUCT_ID', 'ID', 'variation_code', 'id')
+NAME_FIELDS = ('PRODUCT_NAME', 'name', 'Name', 'plan_name', 'PlanName')
+PRICE_FIELDS = ('PRODUCT_AMOUNT', 'price', 'Price', 'amount', 'Amount', 'variation_amount')
+
+
+def _first(plan, fields, default=None):
+    for field in fields:
+        value = plan.get(field)
+        if value is not None:
+            return value
+    return default
+
+
+def plan_code(plan):
+    return str(_first(plan, CODE_FIELDS, default=''))
+
+
+def plan_cost(plan):
+    """Nellobyte's price for a plan as a float, or None when it has none."""
+    raw_price = _first(plan, PRICE_FIELDS)
+    if raw_price is None:
+        return None
+    return float(str(raw_price).replace(',', ''))
+
+
+class PricingRules:
+    """An immutable snapshot of the pricing tables."""
+
+    def __init__(self, version, factors, overrides, disabled):
+        self.version = version
+        self.factors = factors          # network -> price_factor
+        self.overrides = overrides      # (network, code) -> (DataPlanPrice id, selling_price or None)
+        self.disabled = disabled        # {(network, code)}
+
+    def factor_for(self, service_id):
+        return self.factors.get(service_id, DEFAULT_PRICE_FACTOR)
+
+    def is_disabled(self, service_id, code):
+        return (service_id, code) in self.disabled
+
+
+class PricingEngine:
+    VERSION_KEY = 'pricing:rules:version'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rules = None
+
+    # --- rule table --------------------------------------------------------
+
+    def rules(self):
+        version = _version_cache.get(self.VERSION_KEY)
+        if version is None:
+            _version_cache.add(self.VERSION_KEY, 1, None)
+            version = _version_cache.get(self.VERSION_KEY)
+        rules = self._rules
+        if rules is None or rules.version != version:
+            with self._lock:
+                if self._rules is None or self._rules.version != version:
+                    self._rules = self._load(version)
+                rules = self._rules
+        return rules
+
+    def invalidate(self):
+        def bump():
+            try:
+                _version_cache.incr(self.VERSION_KEY)
+            except ValueError:
+                _version_cache.set(self.VERSION_KEY, 1, None)
+
+        # Bump again after commit so a worker that reloaded mid-transaction
+        # (and so cached the old rows under the new version) reloads once more.
+        bump()
+        transaction.on_commit(bump)
+
+    def _load(self, version):
+        factors, overrides, disabled = {}, {}, set()
+        try:
+            for network, factor in DataMarkup.objects.filter(is_active=True).values_list('network', 'price_factor'):
+                factors[network] = float(factor)
+            rows = DataPlanPrice.objects.values_list('id', 'network', 'variation_code', 'selling_price', 'is_active')
+            for pk, network, code, selling_price, is_active in rows:
+                if is_active:
+                    overrides[(network, code)] = (pk, float(selling_price) if selling_price is not None else None)
+                else:
+                    disabled.add((network, code))
+        except (OperationalError, ProgrammingError) as e:
+            # Tables missing (fresh install before migrate): price with defaults.
+            logger.error(f"Pricing rules unavailable, using defaults: {e}")
+        return PricingRules(version, factors, overrides, disabled)
+
+    # --- pricing -----------------------------------------------------------
+
+    def price_plans(self, service_id, plans, include_disabled=False):
+        """
+        Prices a list of raw Nellobyte plans for one network in one pass.
+
+        Returns a dict per plan with variation_code, name, type,
+        original_price, selling_price, overridden, override_id, disabled and
+        the raw plan. Plans without a provider price are dropped. Disabled
+        plans are dropped unless include_disabled is set.
+        """
+        rules = self.rules()
+        factor = rules.factor_for(service_id)
+        priced = []
+        for plan in plans:
+            code = plan_code(plan)
+            disabled = rules.is_disabled(service_id, code)
+            if disabled and not include_disabled:
+                continue
+            original = plan_cost(plan)
+            if original is None:
+                continue
+            override_id, override_price = rules.overrides.get((service_id, code), (None, None))
+            overridden = override_price is not None
+            priced.append({
+                'variation_code': code,
+                'name': str(_first(plan, NAME_FIELDS, default='')),
+                'type': str(_first(plan, ('type', 'Type'), default='Standard')),
+                'original_price': original,
+                'selling_price': override_price if overridden else original * factor,
+                'factor': factor,
+                'overridden': overridden,
+                'override_id': override_id,
+                'disabled': disabled,
+                'plan': plan,
+            })
+        return priced
+
+    def quote(self, service_id, variation_code):
+        """
+        Selling price for one plan, as (Decimal, None) or (None, error message).
+        Disabled plans still get a price; callers decide how to refuse them.
+        """
+        network_key = SERVICE_TO_NETWORK.get(service_id)
+        if not network_key:
+            return None, f"Unknown service: {service_id}"
+
+        plan = plan_catalog.get_plan(network_key, variation_code)
+        if not plan:
+            return None, f"Plan '{variation_code}' not found for {service_id}"
+
+        plan_type = str(plan.get('type') or plan.get('Type') or '').lower()
+        plan_name = str(plan.get('PRODUCT_NAME') or plan.get('name') or plan.get('Name') or '').lower()
+        if 'airtime' in plan_type or 'airtime' in plan_name:
+            return None, f"Plan '{variation_code}' is an airtime plan, not data"
+
+        priced = self.price_plans(service_id, [plan], include_disabled=True)
+        if not priced:
+            return None, "Could not determine plan price from provider"
+        return Decimal(str(round(priced[0]['selling_price'], 2))), None
+
+
+_version_cache = ConnectionProxy(caches, 'default')
+pricing_engine = PricingEngine()
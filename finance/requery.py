@@ -0,0 +1,158 @@
+"""
+Requery of data purchases whose Nellobyte callback never arrived.
+
+A purchase Nellobyte accepted but had not completed (101/102/ORDER_RECEIVED)
+is recorded PENDING with the wallet already debited. If the callback is
+lost, the purchase would stay that way. requery_pending() (run by
+`manage.py requery_pending_purchases`) walks purchases pending for longer
+than a cutoff in batches. It asks Nellobyte for each one's status on a
+bounded thread pool, under a shared rate limit. Only a final order status
+settles a purchase; a rejected query (bad credentials, an unknown id) is
+counted as an error and the purchase is asked about again next run.
+Settled outcomes are applied with the same code as the callback
+(finance.webhooks.settle_data_purchase), so a failure refunds the wallet
+exactly once.
+
+Only finance BILL_PAYMENT Transactions are requeried. Logistics
+DataTransactions are left out: nothing creates them, since
+logistics.views.PurchaseDataView settles and refunds its purchases inline,
+and they carry no ledger entry that a failure could be refunded against.
+
+Only the HTTP calls run on the pool. Results are applied on the calling
+thread, each in its own transaction. A row that a callback settled in the
+meantime is left alone.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Transaction
+from .nellobyte import REQUEST_ID_PREFIX, NellobyteClient
+from .webhooks import remark_says_success, settle_data_purchase
+
+logger = logging.getLogger(__name__)
+
+SUCCEEDED, FAILED, PENDING, SKIPPED, ERRORS = 'succeeded', 'failed', 'pending', 'skipped', 'errors'
+
+# Final order statuses that mean the data was never delivered. Nothing else
+# refunds: INVALID_*/MISSING_* statuses reject the query itself (a bad API
+# key, an id Nellobyte cannot match), not the order.
+FAILED_STATUSES = ('ORDER_CANCELLED', 'ORDER_FAILED', 'ORDER_REFUNDED', 'ORDER_REVERSED')
+
+
+class RateLimiter:
+    """Spaces calls at least 1/rate seconds apart across all threads."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        with self._lock:
+            slot = max(time.monotonic(), self._next)
+            self._next = slot + self.interval
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def classify(resp):
+    """
+    SUCCEEDED or FAILED once Nellobyte reports a final order status, PENDING
+    while it still has the order in progress, and ERRORS when the query was
+    rejected instead of answered (no ORDER_* status).
+    """
+    if not isinstance(resp, dict):
+        return ERRORS
+    status = str(resp.get('status') or resp.get('orderstatus') or '').upper()
+    remark = resp.get('remark') or resp.get('orderremark') or ''
+    if status in FAILED_STATUSES:
+        return FAILED
+    if not status.startswith('ORDER_'):
+        return ERRORS
+    if 'COMPLETED' in status or remark_says_success(remark):
+        return SUCCEEDED
+    return PENDING
+
+
+def _lookup(reference):
+    if reference.startswith(REQUEST_ID_PREFIX):
+        return {'request_id': reference[len(REQUEST_ID_PREFIX):]}
+    # Unmarked rows predate REQUEST_ID_PREFIX: a numeric one is taken as an
+    # OrderID. If it was a RequestID after all, the lookup fails as ERRORS.
+    return {'order_id': reference} if reference.isdigit() else {'request_id': reference}
+
+
+def _pending(cutoff):
+    return Transaction.objects.filter(
+        transaction_type=Transaction.TransactionType.BILL_PAYMENT, status=Transaction.Status.PENDING,
+        created_at__lt=cutoff, reference__isnull=False,
+    ).exclude(reference='')
+
+
+def _batches(queryset, batch_size):
+    last = None
+    while True:
+        page = queryset
+        if last is not None:
+            page = page.filter(Q(created_at__gt=last.created_at) | Q(created_at=last.created_at, pk__gt=last.pk))
+        rows = list(page.order_by('created_at', 'pk')[:batch_size])
+        if not rows:
+            return
+        yield rows
+        last = rows[-1]
+
+
+def _query(client, limiter, lookup):
+    limiter.wait()
+    try:
+        return client.query_transaction(**lookup)
+    except Exception as e:
+        logger.warning(f"Nellobyte requery failed for {lookup}: {e}")
+        return e
+
+
+def _apply(row, resp):
+    if isinstance(resp, Exception):
+        return ERRORS
+    outcome = classify(resp)
+    if outcome == ERRORS:
+        logger.warning(f"Nellobyte requery for {row.reference} was not answered with an order status: {resp}")
+    if outcome in (PENDING, ERRORS):
+        return outcome
+
+    statuscode = str(resp.get('statuscode', ''))
+    with transaction.atomic():
+        row = Transaction.objects.select_for_update().get(pk=row.pk)
+        if row.status != Transaction.Status.PENDING:
+            return SKIPPED  # a callback got there first
+        settle_data_purchase(row, outcome == SUCCEEDED, statuscode, resp.get('remark', ''))
+    return outcome
+
+
+def requery_pending(older_than, batch_size=100, workers=4, rate=5.0, client=None):
+    """
+    Requeries purchases pending for longer than `older_than` (a timedelta)
+    and settles the ones Nellobyte has finished. Returns a Counter of
+    succeeded / failed / pending / skipped / errors.
+    """
+    cutoff = timezone.now() - older_than
+    client = client or NellobyteClient()
+    limiter = RateLimiter(rate)
+    totals = Counter()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='nellobyte-requery') as pool:
+        for batch in _batches(_pending(cutoff), batch_size):
+            responses = pool.map(lambda row: _query(client, limiter, _lookup(row.reference)), batch)
+            for row, resp in zip(batch, responses):
+                try:
+                    totals[_apply(row, resp)] += 1
+                except Exception:
+                    logger.exception(f"Could not settle requeried purchase {row.pk}")
+                    totals[ERRORS] += 1
+    return totals
@@ -5,7 +5,9 @@ import time
 from decimal import Decimal
 from django.conf import settings
 from django.db import transaction
+from . import ledger
 from .models import Wallet, Transaction
+from .utils import WalletManager
 
 
 
@@ -25,11 +27,8 @@ class WalletService:
         Directly distributes funds from Buyer to Seller, Rider, and Platform.
         No escrow involved.
         """
-        buyer_wallet = Wallet.objects.select_for_update().get(user=order.buyer)
-        seller_wallet = Wallet.objects.select_for_update().get(user=order.shop.owner)
-
-        if buyer_wallet.available_balance < order.total_price:
-            raise Exception("Insufficient wallet balance.")
+        buyer_wallet = Wallet.objects.get(user=order.buyer)
+        seller_wallet = Wallet.objects.get(user=order.shop.owner)
 
         # 1. Calculate Splits
         # Commission: 3% capped at ₦15,000
@@ -37,12 +36,15 @@ class WalletService:
 
         seller_share = order.total_price - commission
 
-        # 2. Atomic Movement
-        buyer_wallet.available_balance -= order.total_price
-        buyer_wallet.save()
-
-        seller_wallet.available_balance += seller_share
-        seller_wallet.save()
+        # 2. Atomic Movement (the buyer debit is conditional on the balance covering it)
+        try:
+            ledger.post(ledger.Kind.PAYMENT, [
+                (ledger.available(buyer_wallet), -order.total_price),
+                (ledger.available(seller_wallet), seller_share),
+                (ledger.REVENUE, commission),
+            ], f"Order #{order.id}", str(order.id))
+        except ledger.InsufficientFunds:
+            raise Exception("Insufficient wallet balance.")
 
         # 3. Finalize Order Status
         order.payment_status = 'paid'
@@ -67,10 +69,11 @@ class WalletService:
         """
         Directly refunds the Buyer's balance from the platform/seller.
         """
-        buyer_wallet = Wallet.objects.select_for_update().get(user=order.buyer)
-        
-        buyer_wallet.available_balance += order.total_price
-        buyer_wallet.save()
+        buyer_wallet = Wallet.objects.get(user=order.buyer)
+        WalletManager.credit(
+            buyer_wallet, order.total_price, ledger.Kind.REFUND,
+            description=f"Refund for Order #{order.id}", reference=str(order.id),
+        )
 
         order.payment_status = 'refunded'
         order.save()
@@ -93,14 +96,14 @@ class WithdrawalService:
 
         try:
             with transaction.atomic():
-                wallet = Wallet.objects.select_for_update().get(user=user)
-
-                if wallet.available_balance < amount:
-                    return False, "Insufficient available balance. Locked funds from unconfirmed orders cannot be withdrawn yet."
+                wallet = Wallet.objects.get(user=user)
 
                 # 1. Deduct immediately (Pre-debit)
-                wallet.available_balance -= amount
-                wallet.save()
+                if not WalletManager.debit(
+                    wallet, amount, ledger.Kind.WITHDRAWAL,
+                    description=f"Withdrawal to {account_number}", reference=reference,
+                ):
+                    return False, "Insufficient available balance. Locked funds from unconfirmed orders cannot be withdrawn yet."
 
                 # 2. Call Monnify Disbursement API
                 # This moves real money from your Monnify account to the user
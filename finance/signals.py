@@ -1,9 +1,11 @@
 # finance/signals.py
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
 from django.db import transaction
-from .models import Wallet
+from . import idempotency
+from .models import Wallet, DataMarkup, DataPlanPrice
+from .pricing import pricing_engine
 from .utils import MonnifyAPI
 import threading
 import logging
@@ -50,10 +52,26 @@ def provision_monnify_task(user, wallet):
             wallet.account_number = acc_data['account_number']
             wallet.bank_name = acc_data['bank_name']
             wallet.bank_code = acc_data['bank_code']
-            wallet.save()
+            wallet.save(update_fields=['account_number', 'bank_name', 'bank_code', 'updated_at'])
             logger.info(f"Success: Monnify account {wallet.account_number} provisioned for {user.email}")
         else:
             logger.warning(f"Monnify account creation failed for {user.email}: {error_msg}")
             
     except Exception as e:
-        logger.error(f"CRITICAL: Signal failed to provision account for {user.email} -> {str(e)}")
\ No newline at end of file
+        logger.error(f"CRITICAL: Signal failed to provision account for {user.email} -> {str(e)}")
+
+
+@receiver(post_save, sender=DataMarkup)
+@receiver(post_delete, sender=DataMarkup)
+@receiver(post_save, sender=DataPlanPrice)
+@receiver(post_delete, sender=DataPlanPrice)
+def invalidate_pricing_rules(sender, **kwargs):
+    """Any markup or plan-override change makes every worker reload its pricing table."""
+    pricing_engine.invalidate()
+
+
+@receiver(post_save)
+def note_idempotent_write(sender, raw=False, **kwargs):
+    # Lets a running @idempotent handler know it has written something.
+    if not raw:
+        idempotency.note_write()
@@ -0,0 +1,156 @@
+"""
+A local fake of the Monnify API for tests.
+
+FakeMonnifyServer is a real HTTP server on 127.0.0.1, so tests exercise the
+shared MonnifyClient end to end (login, token reuse, pooled keep-alive
+connections) instead of patching requests. It issues numbered tokens from
+/api/v1/auth/login, answers 401 to any other route called without a live
+token, and serves canned JSON registered with respond():
+
+    server.respond('GET', '/api/v1/banks', {'requestSuccessful': True, 'responseBody': []})
+
+FakeMonnifyMixin starts one server per TestCase class, points MONNIFY_BASE_URL
+at it and drops the client's cached token before each test.
+"""
+import json
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from django.test import override_settings
+
+from .monnify import monnify
+
+LOGIN_PATH = '/api/v1/auth/login'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, so connection reuse is observable
+
+    def do_GET(self):
+        self.server.fake.handle(self)
+
+    do_POST = do_PUT = do_DELETE = do_GET
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeMonnifyServer:
+    def __init__(self, expires_in=3600):
+        self.expires_in = expires_in
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.fake = self
+        self._thread = None
+        self.reset()
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def reset(self):
+        with self._lock:
+            self.requests = []          # (method, path, query, json body) in arrival order
+            self.connections = set()    # client (host, port) pairs seen
+            self.logins = 0
+            self.reject_logins = False
+            self.login_delay = 0        # seconds; widens the window for concurrent logins
+            self._tokens = set()
+            self._routes = defaultdict(list)
+
+    def respond(self, method, path, *bodies, status=200):
+        """Queues responses for `method path`; the last one repeats once the rest are used."""
+        self._routes[(method, path)].extend((status, body) for body in bodies)
+
+    def revoke_tokens(self):
+        with self._lock:
+            self._tokens.clear()
+
+    def calls(self, method, path):
+        return [r for r in self.requests if (r[0], r[1]) == (method, path)]
+
+    # --- request handling ----------------------------------------------------
+
+    def handle(self, handler):
+        parts = urlsplit(handler.path)
+        length = int(handler.headers.get('Content-Length') or 0)
+        raw = handler.rfile.read(length) if length else b''
+        body = json.loads(raw) if raw else None
+        with self._lock:
+            self.requests.append((handler.command, parts.path, parse_qs(parts.query), body))
+            self.connections.add(handler.client_address)
+
+        if (handler.command, parts.path) == ('POST', LOGIN_PATH):
+            status, payload = self._login(handler)
+        elif handler.headers.get('Authorization', '').removeprefix('Bearer ') not in self._tokens:
+            status, payload = 401, {'requestSuccessful': False, 'responseMessage': 'Unauthorized'}
+        else:
+            status, payload = self._next_response(handler.command, parts.path)
+
+        data = json.dumps(payload).encode()
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def _login(self, handler):
+        if self.login_delay:
+            time.sleep(self.login_delay)
+        if self.reject_logins or not handler.headers.get('Authorization', '').startswith('Basic '):
+            return 401, {'requestSuccessful': False, 'responseMessage': 'Invalid credentials'}
+        with self._lock:
+            self.logins += 1
+            token = f"token-{self.logins}"
+            self._tokens.add(token)
+        return 200, {
+            'requestSuccessful': True,
+            'responseBody': {'accessToken': token, 'expiresIn': self.expires_in},
+        }
+
+    def _next_response(self, method, path):
+        with self._lock:
+            queue = self._routes.get((method, path))
+            if not queue:
+                return 404, {'requestSuccessful': False, 'responseMessage': f'No fake response for {method} {path}'}
+            return queue.pop(0) if len(queue) > 1 else queue[0]
+
+
+class FakeMonnifyMixin:
+    """TestCase mixin; subclasses that define setUp must call super().setUp()."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.monnify_server = FakeMonnifyServer().start()
+        cls._monnify_settings = override_settings(
+            MONNIFY_BASE_URL=cls.monnify_server.url,
+            MONNIFY_API_KEY='test-key',
+            MONNIFY_SECRET_KEY='test-secret',
+            MONNIFY_WALLET_ACCOUNT_NUMBER='0000000000',
+        )
+        cls._monnify_settings.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls._monnify_settings.disable()
+        cls.monnify_server.stop()
+
+    def setUp(self):
+        super().setUp()
+        self.monnify_server.reset()
+        monnify.invalidate()
@@ -1,5 +1,3 @@
-import requests
-import base64
 import datetime
 import pytz
 import uuid
@@ -7,7 +5,9 @@ import re
 from django.conf import settings
 from decimal import Decimal
 from django.db import transaction
-from .models import Wallet, Transaction
+from .models import Posting, Wallet, Transaction
+from . import ledger
+from .monnify import MonnifyError, monnify
 import logging
 
 logger = logging.getLogger(__name__)
@@ -18,58 +18,18 @@ class MonnifyAPI:
     """
     @staticmethod
     def _get_url(path):
-        # 1. Get base URL from settings
-        base = settings.MONNIFY_BASE_URL.strip().rstrip('/')
-        
-        # 2. Fix the "https:https://" bug by ensuring we only have one protocol
-        if "://" in base:
-            # Split by :// and take the last part (the actual host)
-            parts = base.split("://")
-            host = parts[-1] 
-            base = f"https://{host}"
-        
-        # 3. Clean up any existing versioning in the base URL
-        base = re.sub(r'/api/v(1|2)$', '', base)
-        
-        # 4. Ensure path starts with /
-        if not path.startswith('/'):
-            path = f"/{path}"
-            
-        return f"{base}{path}"
+        return monnify.url(path)
 
     @staticmethod
     def get_auth_token():
-        # This will now return 'https://api.monnify.com/api/v1/auth/login' correctly
-        url = MonnifyAPI._get_url("/api/v1/auth/login")
-        
-        auth_str = f"{settings.MONNIFY_API_KEY}:{settings.MONNIFY_SECRET_KEY}"
-        encoded_auth = base64.b64encode(auth_str.encode()).decode()
-        
-        headers = {
-            "Authorization": f"Basic {encoded_auth}",
-            "Content-Type": "application/json"
-        }
-        
+        """The shared client's cached bearer token, or None if Monnify login fails."""
         try:
-            # We use verify=True to ensure SSL is valid on PythonAnywhere
-            response = requests.post(url, headers=headers, timeout=15)
-            if response.status_code == 200:
-                return response.json()['responseBody']['accessToken']
-            else:
-                logger.error(f"❌ Monnify Auth Rejected: {response.status_code} - {response.text}")
-                return None
-        except Exception as e:
-            logger.error(f"❌ Monnify Connection Error: {e} | URL used: {url}")
+            return monnify.token()
+        except MonnifyError:
             return None
 
     @staticmethod
     def create_virtual_account(user):
-        token = MonnifyAPI.get_auth_token()
-        if not token: 
-            return None, "Auth Failed"
-
-        url = MonnifyAPI._get_url("/api/v2/bank-transfer/reserved-accounts")
-        
         # Clean name: Only letters and spaces. Max 50 chars.
         raw_name = user.full_name or user.username
         clean_name = re.sub(r'[^a-zA-Z\s]', '', raw_name).strip()[:50]
@@ -92,7 +52,7 @@ class MonnifyAPI:
         }
 
         try:
-            response = requests.post(url, json=payload, headers={"Authorization": f"Bearer {token}"}, timeout=20)
+            response = monnify.post("/api/v2/bank-transfer/reserved-accounts", json=payload)
             data = response.json()
             
             # SUCCESS CASE
@@ -113,12 +73,7 @@ class MonnifyAPI:
                 # 1) Try fetching by wallet's account_reference first
                 ref = user.wallet.account_reference
                 if ref:
-                    fetch_url = MonnifyAPI._get_url(
-                        f"/api/v2/bank-transfer/reserved-accounts/{ref}"
-                    )
-                    fetch_resp = requests.get(
-                        fetch_url, headers={"Authorization": f"Bearer {token}"}
-                    )
+                    fetch_resp = monnify.get(f"/api/v2/bank-transfer/reserved-accounts/{ref}")
                     fetch_data = fetch_resp.json()
 
                     if fetch_data.get('requestSuccessful'):
@@ -130,11 +85,8 @@ class MonnifyAPI:
                         }, None
 
                 # 2) Fallback: list all reserved accounts and find by email
-                list_url = MonnifyAPI._get_url(
-                    "/api/v2/bank-transfer/reserved-accounts?page=0&size=50"
-                )
-                list_resp = requests.get(
-                    list_url, headers={"Authorization": f"Bearer {token}"}
+                list_resp = monnify.get(
+                    "/api/v2/bank-transfer/reserved-accounts", params={"page": 0, "size": 50}
                 )
                 list_data = list_resp.json()
                 if list_data.get('requestSuccessful'):
@@ -149,15 +101,14 @@ class MonnifyAPI:
                                 }, None
 
             return None, data.get('responseMessage', 'Unknown Error')
+        except MonnifyError:
+            return None, "Auth Failed"
         except Exception as e:
             return None, str(e)
 
     @staticmethod
     def initiate_order_payment(order, customer_name, customer_email):
         """Handled the Split Payment logic previously in monnify.py"""
-        token = MonnifyAPI.get_auth_token()
-        url = MonnifyAPI._get_url("/api/v1/merchant/transactions/init-transaction")
-        
         total_amount = float(order.total_price)
         commission = min(total_amount * 0.03, 15000.0)
         vendor_share = total_amount - commission
@@ -178,7 +129,10 @@ class MonnifyAPI:
             "methods": ["CARD", "ACCOUNT_TRANSFER"]
         }
         
-        response = requests.post(url, json=payload, headers={"Authorization": f"Bearer {token}"})
+        try:
+            response = monnify.post("/api/v1/merchant/transactions/init-transaction", json=payload)
+        except MonnifyError:
+            return {"requestSuccessful": False, "responseMessage": "Auth failed"}
         return response.json()
 
     @staticmethod
@@ -187,13 +141,6 @@ class MonnifyAPI:
         Creates a sub-account on Monnify for a vendor.
         Returns the subAccountCode if successful.
         """
-        token = MonnifyAPI.get_auth_token()
-        if not token:
-            return None
-
-        url = MonnifyAPI._get_url("/api/v1/sub-accounts")
-        headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-        
         data = [{
             "currencyCode": "NGN",
             "bankCode": bank_code,
@@ -202,7 +149,10 @@ class MonnifyAPI:
             "defaultSplitPercentage": 100 
         }]
 
-        response = requests.post(url, headers=headers, json=data)
+        try:
+            response = monnify.post("/api/v1/sub-accounts", json=data)
+        except MonnifyError:
+            return None
         res_json = response.json()
 
         if res_json.get('requestSuccessful') and res_json['responseBody']:
@@ -214,14 +164,9 @@ class MonnifyAPI:
     @staticmethod
     def resolve_bank_account(account_number, bank_code):
         """Verifies the account number and returns the account name"""
-        token = MonnifyAPI.get_auth_token()
-        if not token:
-            logger.error("resolve_bank_account: Auth token failed")
-            return None, "Authentication with payment provider failed."
-
         account_number = str(account_number).strip()
         bank_code = str(bank_code).strip()
-        headers = {"Authorization": f"Bearer {token}"}
+        msg = 'Invalid Account or Bank.'
 
         # Try V2 POST first (newer Monnify endpoint), fall back to V1 GET
         endpoints = [
@@ -230,25 +175,23 @@ class MonnifyAPI:
         ]
 
         for path, method in endpoints:
-            url = MonnifyAPI._get_url(path)
-            logger.info(f"Monnify resolve_bank_account — trying {method} {url}")
+            logger.info(f"Monnify resolve_bank_account — trying {method} {path}")
 
             try:
                 if method == "POST":
-                    resp = requests.post(
-                        url, headers={**headers, "Content-Type": "application/json"},
-                        json={"accountNumber": account_number, "bankCode": bank_code},
-                        timeout=15,
+                    resp = monnify.post(
+                        path, json={"accountNumber": account_number, "bankCode": bank_code}, timeout=15,
                     )
                 else:
-                    resp = requests.get(
-                        url, headers=headers,
-                        params={"accountNumber": account_number, "bankCode": bank_code},
-                        timeout=15,
+                    resp = monnify.get(
+                        path, params={"accountNumber": account_number, "bankCode": bank_code}, timeout=15,
                     )
 
                 res_json = resp.json()
                 logger.info(f"Monnify resolve_bank_account response ({method}) — {res_json}")
+            except MonnifyError:
+                logger.error("resolve_bank_account: Auth token failed")
+                return None, "Authentication with payment provider failed."
             except Exception as e:
                 logger.error(f"Monnify resolve_bank_account HTTP error ({method}): {e}")
                 continue
@@ -270,17 +213,6 @@ class MonnifyAPI:
         """
         Transfers funds from the platform's Monnify wallet to a user's bank account.
         """
-        token = MonnifyAPI.get_auth_token()
-        if not token:
-            logger.error("Disbursement Failed: Unable to get Auth Token")
-            return {"requestSuccessful": False, "responseMessage": "Auth failed"}
-
-        url = MonnifyAPI._get_url("/api/v2/disbursements/single")
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
-        }
-        
         # We need the platform's Monnify wallet account number from settings
         source_account = getattr(settings, 'MONNIFY_WALLET_ACCOUNT_NUMBER', '')
         if not source_account:
@@ -298,10 +230,13 @@ class MonnifyAPI:
         }
 
         try:
-            response = requests.post(url, headers=headers, json=payload)
+            response = monnify.post("/api/v2/disbursements/single", json=payload, timeout=30)
             res_json = response.json()
             logger.info(f"Monnify Disbursement Response: {res_json}")
             return res_json
+        except MonnifyError:
+            logger.error("Disbursement Failed: Unable to get Auth Token")
+            return {"requestSuccessful": False, "responseMessage": "Auth failed"}
         except Exception as e:
             logger.error(f"Monnify Disbursement Error: {str(e)}")
             return {"requestSuccessful": False, "responseMessage": f"API Error: {str(e)}"}
@@ -311,23 +246,15 @@ class MonnifyAPI:
         """
         Fetches the list of supported Nigerian banks directly from Monnify.
         """
-        token = MonnifyAPI.get_auth_token()
-        if not token:
-            logger.error("Failed to get auth token for get_banks")
-            return []
-
-        url = MonnifyAPI._get_url("/api/v1/banks")
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
-        }
-
         try:
-            response = requests.get(url, headers=headers)
+            response = monnify.get("/api/v1/banks")
             res_json = response.json()
             if res_json.get('requestSuccessful'):
                 return res_json.get('responseBody', [])
             return []
+        except MonnifyError:
+            logger.error("Failed to get auth token for get_banks")
+            return []
         except Exception as e:
             logger.error(f"Monnify get_banks error: {e}")
             return []
@@ -335,37 +262,63 @@ class MonnifyAPI:
 class WalletManager:
     """
     Handles all internal wallet movements (Marketplace and Data purchases).
+
+    debit() and credit() are the primitives every wallet flow uses. A debit
+    is one conditional UPDATE (`... WHERE available_balance >= amount`, see
+    finance.ledger.apply) whose affected row count says whether the wallet
+    covered it, so callers neither lock the wallet row nor check the balance
+    in Python first.
     """
+    @staticmethod
+    def debit(wallet, amount, kind, counterpart=ledger.EXTERNAL, description='', reference='',
+              account=Posting.Account.AVAILABLE):
+        """
+        Moves `amount` out of one of the wallet's balances (available by
+        default) into `counterpart`. Returns False, changing nothing, when the
+        balance does not cover it.
+        """
+        try:
+            ledger.transfer(kind, ledger.wallet_account(wallet, account), counterpart,
+                            amount, description, reference)
+        except ledger.InsufficientFunds:
+            return False
+        return True
+
+    @staticmethod
+    def credit(wallet, amount, kind, counterpart=ledger.EXTERNAL, description='', reference='',
+               account=Posting.Account.AVAILABLE):
+        """Moves `amount` from `counterpart` into one of the wallet's balances."""
+        ledger.transfer(kind, counterpart, ledger.wallet_account(wallet, account),
+                        amount, description, reference)
+        return True
+
     @staticmethod
     def process_payment(user, amount, transaction_type, description, related_id=None):
         amount = Decimal(str(amount))
-        
+
         try:
             with transaction.atomic():
-                wallet = Wallet.objects.select_for_update().get(user=user)
+                wallet = Wallet.objects.get(user=user)
 
-                if wallet.available_balance < amount:
+                if transaction_type == Transaction.TransactionType.ESCROW_LOCK:
+                    counterpart = ledger.escrow(wallet)
+                elif transaction_type in (Transaction.TransactionType.PROMOTION, Transaction.TransactionType.FEE):
+                    counterpart = ledger.REVENUE
+                else:
+                    counterpart = ledger.EXTERNAL
+
+                if not WalletManager.debit(wallet, amount, transaction_type, counterpart, description):
                     return False, "Insufficient wallet balance."
 
-                ledger = Transaction.objects.create(
+                Transaction.objects.create(
                     wallet=wallet,
                     amount=-amount,
                     transaction_type=transaction_type,
-                    status=Transaction.Status.PENDING,
+                    status=Transaction.Status.SUCCESS,
                     description=description,
                     related_order_id=related_id if transaction_type == 'escrow_lock' else None
                 )
 
-                if transaction_type == Transaction.TransactionType.ESCROW_LOCK:
-                    wallet.available_balance -= amount
-                    wallet.escrow_balance += amount
-                else:
-                    wallet.available_balance -= amount
-                
-                wallet.save()
-                ledger.status = Transaction.Status.SUCCESS
-                ledger.save()
-
                 return True, "Payment processed successfully."
 
         except Wallet.DoesNotExist:
@@ -383,20 +336,16 @@ class WalletManager:
 
         try:
             with transaction.atomic():
-                buyer_wallet = Wallet.objects.select_for_update().get(user=buyer)
-                seller_wallet = Wallet.objects.select_for_update().get(user=seller)
-
-                if buyer_wallet.available_balance < amount:
+                buyer_wallet = Wallet.objects.get(user=buyer)
+                seller_wallet = Wallet.objects.get(user=seller)
+
+                # 1. Deduct from Buyer, 2. Credit Seller (Instant Settlement)
+                if not WalletManager.debit(
+                    buyer_wallet, amount, ledger.Kind.PAYMENT, ledger.available(seller_wallet),
+                    f"Order #{order_id}", str(order_id),
+                ):
                     return False, "Insufficient wallet balance."
 
-                # 1. Deduct from Buyer
-                buyer_wallet.available_balance -= amount
-                buyer_wallet.save()
-
-                # 2. Credit Seller (Instant Settlement)
-                seller_wallet.available_balance += amount
-                seller_wallet.save()
-
                 # 3. Audit Trail: Buyer debit
                 Transaction.objects.create(
                     wallet=buyer_wallet,
@@ -437,20 +386,16 @@ class WalletManager:
 
         try:
             with transaction.atomic():
-                b_wallet = Wallet.objects.select_for_update().get(user=buyer)
-                s_wallet = Wallet.objects.select_for_update().get(user=seller)
-
-                if b_wallet.available_balance < amount:
+                b_wallet = Wallet.objects.get(user=buyer)
+                s_wallet = Wallet.objects.get(user=seller)
+
+                # 1. Deduct from Buyer, 2. Lock in Seller's "Waiting Room"
+                if not WalletManager.debit(
+                    b_wallet, amount, ledger.Kind.PAYMENT, ledger.locked(s_wallet),
+                    f"Order #{display_id}", str(order_id or ''),
+                ):
                     return False, "Insufficient wallet balance."
 
-                # 1. Deduct from Buyer
-                b_wallet.available_balance -= amount
-                b_wallet.save()
-
-                # 2. Lock in Seller's "Waiting Room"
-                s_wallet.locked_balance += amount
-                s_wallet.save()
-
                 # 3. Audit Trail: Buyer debit
                 Transaction.objects.create(
                     wallet=b_wallet,
@@ -491,15 +436,14 @@ class WalletManager:
 
         try:
             with transaction.atomic():
-                s_wallet = Wallet.objects.select_for_update().get(user=order.shop.owner)
-
-                if s_wallet.locked_balance < amount:
-                    return False, "Pending balance insufficient for this order."
+                s_wallet = Wallet.objects.get(user=order.shop.owner)
 
                 # Move from Pending → Available
-                s_wallet.locked_balance -= amount
-                s_wallet.available_balance += amount
-                s_wallet.save()
+                if not WalletManager.debit(
+                    s_wallet, amount, ledger.Kind.ESCROW_RELEASE, ledger.available(s_wallet),
+                    f"Order #{order.id}", str(order.id), account=Posting.Account.LOCKED,
+                ):
+                    return False, "Pending balance insufficient for this order."
 
                 # Audit Trail: Seller's funds unlocked
                 Transaction.objects.create(
@@ -1,6 +1,4 @@
 import logging
-import re
-from django.contrib.auth import get_user_model
 from datetime import datetime
 import pytz
 import uuid
@@ -15,23 +13,26 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework import permissions, status, generics
 from django.db import transaction
-from .models import Wallet, Transaction, BankAccount, WithdrawalTicket, PlatformRevenue, DataMarkup, DataPlanPrice, MONNIFY_DEPOSIT_RATE, MONNIFY_DEPOSIT_CAP
-from market.models import Order
+from .models import Wallet, Transaction, BankAccount, WithdrawalTicket, PlatformRevenue, WebhookEvent, MONNIFY_DEPOSIT_RATE, MONNIFY_DEPOSIT_CAP
 from .serializers import WalletSerializer, TransactionSerializer, DataHistorySerializer, WithdrawalTicketSerializer
 
 MONNIFY_DEPOSIT_RATE = MONNIFY_DEPOSIT_RATE
 MONNIFY_DEPOSIT_CAP  = MONNIFY_DEPOSIT_CAP
 
 from users.permissions import IsVerifiedUser
-from .utils import MonnifyAPI
+from . import banks, ledger, webhooks
+from .idempotency import idempotent
+from .utils import MonnifyAPI, WalletManager
 
 from .vtpass import VTPassClient  # Add this near your other imports
+from market.pagination import CursorFeedPagination
 
 logger = logging.getLogger(__name__)
 
 class TransactionListView(generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = TransactionSerializer
+    pagination_class = CursorFeedPagination
 
     def get_queryset(self):
         return Transaction.objects.filter(wallet=self.request.user.wallet).order_by('-created_at')
@@ -53,7 +54,7 @@ class WalletDetailView(APIView):
                         wallet.bank_name = acc_data.get('bank_name')
                         wallet.bank_code = acc_data.get('bank_code')
                         wallet.account_reference = acc_data.get('account_reference')
-                        wallet.save()
+                        wallet.save(update_fields=['account_number', 'bank_name', 'bank_code', 'account_reference', 'updated_at'])
                 except Exception as e:
                     logger.error(f"Monnify Account Generation Error: {e}")
 
@@ -92,109 +93,15 @@ class MonnifyWebhookView(APIView):
             return Response({"error": "Invalid signature"}, status=status.HTTP_401_UNAUTHORIZED)
 
         data = request.data
-        event_type = data.get('eventType')
-        event_data = data.get('eventData', {})
-        
-        # Log for debugging
-        print(f"WEBHOOK RECEIVED: {event_type}")
-        
-        # CASE 1: Incoming Deposit (User funding wallet or Order Checkout)
-        if event_type == 'SUCCESSFUL_TRANSACTION':
-            payment_ref = event_data.get('paymentReference')
-            amount_paid = Decimal(str(event_data.get('amountPaid', 0)))
-            settlement_amt = Decimal(str(event_data.get('settlementAmount', 0)))
-            fee = amount_paid - settlement_amt
-            
-            # --- FEATURE 1: Order Checkout Logic ---
-            try:
-                with transaction.atomic():
-                    # Find the order by reference (using monnify_reference per our models)
-                    order = Order.objects.get(monnify_reference=payment_ref)
-                    
-                    if order.payment_status != Order.PaymentStatus.PAID:
-                        # Update order status
-                        order.payment_status = Order.PaymentStatus.PAID
-                        order.save()
-
-                        # Update Seller Stats (This fuels your Dashboard image)
-                        shop = order.shop
-                        if shop:
-                            shop.total_sales += int(amount_paid)
-                            shop.save()
-                    
-                logger.info(f"✅ Order marked as PAID via Monnify Webhook (Ref: {payment_ref})")
-                return Response({"status": "success"}, status=200)
-            except Order.DoesNotExist:
-                pass # Fall through to Virtual Account Wallet Funding
-                
-            # --- FEATURE 2: Virtual Account Wallet Funding Logic ---
-            account_ref = event_data.get('product', {}).get('reference') 
-            if account_ref:
-                try:
-                    with transaction.atomic():
-                        wallet = Wallet.objects.select_for_update().get(account_reference=account_ref)
-                        
-                        if not Transaction.objects.filter(reference=payment_ref).exists():
-                            processing_fee = min(
-                                settlement_amt * MONNIFY_DEPOSIT_RATE,
-                                MONNIFY_DEPOSIT_CAP
-                            )
-                            net_credit = settlement_amt - processing_fee
-
-                            wallet.available_balance += net_credit
-                            wallet.save()
-                            
-                            Transaction.objects.create(
-                                wallet=wallet,
-                                amount=net_credit,
-                                transaction_type=Transaction.TransactionType.DEPOSIT,
-                                status=Transaction.Status.SUCCESS,
-                                reference=payment_ref,
-                                description=f"Bank Deposit (Fee: ₦{processing_fee})" 
-                            )
-                    logger.info(f"✅ Wallet {wallet.id} credited with ₦{net_credit} (net of ₦{processing_fee} processing fee)")
-                    return Response({"status": "success"}, status=200)
-                except Wallet.DoesNotExist:
-                    logger.error(f"❌ Webhook Error: Wallet with reference {account_ref} not found.")
-                    return Response({"error": "Wallet not found"}, status=status.HTTP_404_NOT_FOUND)
-                except Exception as e:
-                    logger.error(f"❌ Webhook Processing Error: {str(e)}")
-                    return Response({"error": "Internal Error"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-            else:
-                return Response({"error": "Unhandled payment reference"}, status=404)
-
-        # CASE 2: Outgoing Withdrawal (Monnify finished sending money to bank)
-        elif event_type == 'DISBURSEMENT_SUCCESS':
-            ref = event_data.get('reference')
-            Transaction.objects.filter(reference=ref).update(status=Transaction.Status.SUCCESS)
-            logger.info(f"✅ Disbursement successful for ref {ref}")
-            return Response({"status": "success"}, status=status.HTTP_200_OK)
-
-        elif event_type == 'DISBURSEMENT_FAILED':
-            ref = event_data.get('reference')
-            try:
-                with transaction.atomic():
-                    ledger = Transaction.objects.select_for_update().get(reference=ref)
-                    # Only refund if the wallet was actually deducted (SUCCESS status).
-                    # PENDING transactions haven't deducted the wallet yet.
-                    if ledger.status == Transaction.Status.SUCCESS:
-                        ledger.wallet.available_balance += abs(ledger.amount)
-                        ledger.wallet.save()
-                        ledger.status = Transaction.Status.FAILED
-                        ledger.description += " (Failed: Refunded)"
-                        ledger.save()
-                        logger.warning(f"⚠️ Disbursement failed and refunded for ref {ref}")
-                    else:
-                        ledger.status = Transaction.Status.FAILED
-                        ledger.save(update_fields=['status'])
-                        logger.warning(f"⚠️ Disbursement failed for ref {ref} (was PENDING, no refund needed)")
-            except Exception as e:
-                logger.error(f"❌ Webhook Refund failure: {e}")
-
+        event, created = webhooks.ingest(
+            WebhookEvent.Source.MONNIFY, webhooks.monnify_event_id(data, request.body), data,
+        )
+        logger.info(f"Monnify webhook {data.get('eventType')} queued as {event.event_id} (duplicate: {not created})")
         return Response({"status": "success"}, status=200)
 
 
-from .nellobyte import NellobyteClient
+from .nellobyte import NellobyteClient, purchase_reference
+from .pricing import pricing_engine
 from market.pagination import MarketPageNumberPagination
 
 class DataPurchaseView(APIView):
@@ -204,67 +111,10 @@ class DataPurchaseView(APIView):
     """
     permission_classes = [permissions.IsAuthenticated]
 
-    SERVICE_TO_NETWORK = {
-        'mtn-data': 'MTN',
-        'glo-data': 'Glo',
-        'airtel-data': 'Airtel',
-        '9mobile-data': '9mobile',
-    }
-
     def _fetch_live_price(self, service_id, variation_code):
-        network_key = self.SERVICE_TO_NETWORK.get(service_id)
-        if not network_key:
-            return None, f"Unknown service: {service_id}"
-
-        client = NellobyteClient()
-        plans = client.fetch_all_variations(network_key)
-
-        matched = None
-        for plan in plans:
-            pid = str(plan.get('PRODUCT_ID', '') or plan.get('ID', '') or '')
-            if pid == variation_code:
-                matched = plan
-                break
-
-        if not matched:
-            return None, f"Plan '{variation_code}' not found for {service_id}"
-
-        plan_type = str(matched.get('type') or matched.get('Type') or '').lower()
-        plan_name = str(matched.get('PRODUCT_NAME') or matched.get('name') or matched.get('Name') or '').lower()
-        if 'airtime' in plan_type or 'airtime' in plan_name:
-            return None, f"Plan '{variation_code}' is an airtime plan, not data"
-
-        raw_price = None
-        for key in ('PRODUCT_AMOUNT', 'price', 'Price', 'amount', 'Amount', 'variation_amount'):
-            val = matched.get(key)
-            if val is not None:
-                raw_price = val
-                break
-
-        if raw_price is None:
-            return None, "Could not determine plan price from provider"
-
-        original_price = float(str(raw_price).replace(',', ''))
-        # Check per-plan override first
-        try:
-            dpp = DataPlanPrice.objects.get(
-                network=service_id, variation_code=variation_code,
-                is_active=True, selling_price__isnull=False
-            )
-            verified = round(float(dpp.selling_price), 2)
-            return Decimal(str(verified)), None
-        except DataPlanPrice.DoesNotExist:
-            pass
-        factor = 1.10
-        try:
-            dm = DataMarkup.objects.get(network=service_id, is_active=True)
-            factor = float(dm.price_factor)
-        except DataMarkup.DoesNotExist:
-            pass
-
-        verified = round(original_price * factor, 2)
-        return Decimal(str(verified)), None
+        return pricing_engine.quote(service_id, variation_code)
 
+    @idempotent
     def post(self, request):
         logger.info(f"Data Purchase Request: {request.data}")
         service_id = request.data.get('service_id')
@@ -284,9 +134,7 @@ class DataPurchaseView(APIView):
         request_id = str(uuid.uuid4().hex)[:12]
 
         # Reject purchase if this plan has been disabled by the auto‑disable system
-        if DataPlanPrice.objects.filter(
-            network=service_id, variation_code=data_plan, is_active=False
-        ).exists():
+        if pricing_engine.rules().is_disabled(service_id, data_plan):
             logger.error(f"Data Purchase 400: Plan {service_id}/{data_plan} is currently unavailable")
             return Response({
                 "error": "This data plan is temporarily unavailable. Please try another plan."
@@ -309,24 +157,26 @@ class DataPurchaseView(APIView):
 
             status_code = str(resp.get('statuscode'))
             order_status = resp.get('status', '')
+            reference = purchase_reference(resp, request_id)
 
             if status_code == '100':
                 with transaction.atomic():
-                    wallet = Wallet.objects.select_for_update().get(user=request.user)
-                    if wallet.available_balance < amount:
+                    if not WalletManager.debit(
+                        wallet, amount, ledger.Kind.BILL_PAYMENT,
+                        description=f"Nellobyte Data: {service_id.upper()} ({data_plan}) to {phone}",
+                        reference=reference,
+                    ):
                         return Response({"error": "Insufficient wallet balance."}, status=400)
 
-                    wallet.available_balance -= amount
-                    wallet.save()
-
                     Transaction.objects.create(
                         wallet=wallet,
                         amount=-amount,
                         transaction_type=Transaction.TransactionType.BILL_PAYMENT,
                         status=Transaction.Status.SUCCESS,
                         description=f"Nellobyte Data: {service_id.upper()} ({data_plan}) to {phone}",
-                        reference=resp.get('orderid', request_id)
+                        reference=reference
                     )
+                    wallet.refresh_from_db(fields=['available_balance'])
 
                 return Response({
                     "message": "Data purchase successful!",
@@ -336,21 +186,22 @@ class DataPurchaseView(APIView):
 
             elif 'ORDER_RECEIVED' in order_status or status_code in ('', '101', '102'):
                 with transaction.atomic():
-                    wallet = Wallet.objects.select_for_update().get(user=request.user)
-                    if wallet.available_balance < amount:
+                    if not WalletManager.debit(
+                        wallet, amount, ledger.Kind.BILL_PAYMENT,
+                        description=f"Nellobyte Data: {service_id.upper()} ({data_plan}) to {phone}",
+                        reference=reference,
+                    ):
                         return Response({"error": "Insufficient wallet balance."}, status=400)
 
-                    wallet.available_balance -= amount
-                    wallet.save()
-
                     Transaction.objects.create(
                         wallet=wallet,
                         amount=-amount,
                         transaction_type=Transaction.TransactionType.BILL_PAYMENT,
                         status=Transaction.Status.PENDING,
                         description=f"Nellobyte Data: {service_id.upper()} ({data_plan}) to {phone} (Pending)",
-                        reference=resp.get('orderid', request_id)
+                        reference=reference
                     )
+                    wallet.refresh_from_db(fields=['available_balance'])
 
                 logger.info(f"Data Purchase 202: Order queued — orderid={resp.get('orderid')} status={order_status}")
                 return Response({
@@ -368,7 +219,7 @@ class DataPurchaseView(APIView):
                         transaction_type=Transaction.TransactionType.BILL_PAYMENT,
                         status=Transaction.Status.FAILED,
                         description=f"Nellobyte Data: {service_id.upper()} ({data_plan}) to {phone} (Failed: {error_msg})",
-                        reference=resp.get('orderid', request_id)
+                        reference=reference
                     )
 
                 logger.error(f"Data Purchase 400: Nellobyte Error: {error_msg} | Code: {status_code} | Raw: {resp}")
@@ -400,116 +251,27 @@ class DataVariationsView(APIView):
         '9mobile-data':('9mobile', '9mobile'),
     }
 
-    _markup_cache = {}
-    _plan_override_cache = None
-    _disabled_plans_cache = None
-
-    def _load_disabled_plans(self):
-        if self._disabled_plans_cache is None:
-            self._disabled_plans_cache = set()
-            try:
-                for dpp in DataPlanPrice.objects.filter(is_active=False):
-                    self._disabled_plans_cache.add((dpp.network, dpp.variation_code))
-            except Exception:
-                pass
-        return self._disabled_plans_cache
-
-    def _load_plan_overrides(self):
-        if self._plan_override_cache is None:
-            self._plan_override_cache = {}
-            try:
-                for dpp in DataPlanPrice.objects.filter(is_active=True, selling_price__isnull=False):
-                    self._plan_override_cache[(dpp.network, dpp.variation_code)] = float(dpp.selling_price)
-            except Exception:
-                pass
-        return self._plan_override_cache
-
-    def _get_price_factor(self, service_id):
-        if service_id not in self._markup_cache:
-            try:
-                markup = DataMarkup.objects.get(network=service_id, is_active=True)
-                self._markup_cache[service_id] = float(markup.price_factor)
-            except DataMarkup.DoesNotExist:
-                self._markup_cache[service_id] = 1.10
-        return self._markup_cache[service_id]
-
-    def _get_plan_field(self, plan, *keys, default=None):
-        """Try multiple possible field names from Nellobyte response."""
-        for key in keys:
-            val = plan.get(key)
-            if val is not None:
-                return val
-        return default
-
-    def _format_plan(self, plan, provider_label=None, service_id=None):
-        """
-        Format a raw Nellobyte V2 PRODUCT item into the standardized response.
-
-        Nellobyte V2 fields:  PRODUCT_ID, PRODUCT_NAME, PRODUCT_AMOUNT, PRODUCT_CODE
-        Fallbacks for older / alternative field conventions are kept.
-        Returns None if the plan has been disabled via DataPlanPrice.is_active=False.
-        """
-        variation_code = str(self._get_plan_field(
-            plan,
-            'PRODUCT_ID', 'ID', 'variation_code', 'id',
-            default=''
-        ))
-
-        if service_id:
-            disabled = self._load_disabled_plans()
-            if (service_id, variation_code) in disabled:
-                logger.info(f"Skipping disabled plan: {service_id}/{variation_code}")
-                return None
-        name = str(self._get_plan_field(
-            plan,
-            'PRODUCT_NAME', 'name', 'Name', 'plan_name', 'PlanName',
-            default=''
-        ))
-        raw_price = self._get_plan_field(
-            plan,
-            'PRODUCT_AMOUNT',
-            'price', 'Price',
-            'amount', 'Amount',
-            'variation_amount',
-            default=0
-        )
-        original_price = float(str(raw_price).replace(',', ''))
-        # Check per-plan override first
-        overrides = self._load_plan_overrides()
-        override_key = (service_id, variation_code)
-        if override_key in overrides:
-            selling_price = overrides[override_key]
-        else:
-            factor = self._get_price_factor(service_id) if service_id else 1.10
-            selling_price = original_price * factor
-        plan_type = str(self._get_plan_field(plan, 'type', 'Type', default='Standard'))
-
-        formatted = {
-            "variation_code": variation_code,
-            "name": name,
-            "variation_amount": str(round(selling_price, 2)),
-            "original_amount":  str(round(original_price, 2)),
-            "type": plan_type,
-        }
-        if provider_label:
-            formatted["provider"] = provider_label
-        return formatted
+    def _format_plans(self, raw_plans, provider_label, service_id):
+        """Prices a provider's raw plans in one pass and shapes them for the app."""
+        formatted_plans = []
+        for priced in pricing_engine.price_plans(service_id, raw_plans):
+            formatted_plans.append({
+                "variation_code": priced['variation_code'],
+                "name": priced['name'],
+                "variation_amount": str(round(priced['selling_price'], 2)),
+                "original_amount":  str(round(priced['original_price'], 2)),
+                "type": priced['type'],
+                "provider": provider_label,
+                "service_id": service_id,
+            })
+        return formatted_plans
 
     def _fetch_all_raw_plans(self, client):
         """Fetch and format plans from ALL providers. Returns flat list of formatted plans."""
         all_plans = []
         for svc, (net_id, label) in self.NETWORK_MAPPING.items():
             try:
-                raw = client.fetch_all_variations(net_id)
-                for plan in raw:
-                    try:
-                        formatted = self._format_plan(plan, provider_label=label, service_id=svc)
-                        if formatted is not None:
-                            formatted['service_id'] = svc
-                            all_plans.append(formatted)
-                    except Exception as e:
-                        logger.error(f"Failed to format plan for {svc}: {e}")
-                        continue
+                all_plans.extend(self._format_plans(client.fetch_all_variations(net_id), label, svc))
             except Exception as e:
                 logger.error(f"Failed to fetch plans for {svc}: {e}")
                 continue
@@ -517,18 +279,7 @@ class DataVariationsView(APIView):
 
     def _fetch_single_raw_plans(self, client, service_id, network_id, provider_label):
         """Fetch and format plans for a single provider. Returns flat list."""
-        raw = client.fetch_all_variations(network_id)
-        formatted_plans = []
-        for plan in raw:
-            try:
-                formatted = self._format_plan(plan, provider_label=provider_label, service_id=service_id)
-                if formatted is not None:
-                    formatted['service_id'] = service_id
-                    formatted_plans.append(formatted)
-            except Exception as e:
-                logger.error(f"Failed to format plan for {provider_label}: {e}")
-                continue
-        return formatted_plans
+        return self._format_plans(client.fetch_all_variations(network_id), provider_label, service_id)
 
     def get(self, request):
         service_id = request.query_params.get('service_id')
@@ -568,7 +319,7 @@ class VerifyBankAccountView(APIView):
             }, status=400)
 
         try:
-            account_name, error_msg = MonnifyAPI.resolve_bank_account(account_number, bank_code)
+            account_name, error_msg = banks.resolve_account_name(account_number, bank_code)
             if account_name:
                 logger.info(f"VerifyBankAccount 200: {account_name}")
                 return Response({"account_name": account_name}, status=200)
@@ -579,17 +330,23 @@ class VerifyBankAccountView(APIView):
             return Response({"error": f"Monnify says: {str(e)}"}, status=400)
 
 class BankListView(APIView):
+    """
+    The bank directory from the local Bank table (see finance.banks).
+    Responses carry an ETag; a matching If-None-Match gets a 304.
+    """
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
         try:
-            # Call Monnify utility to get the bank list
-            banks = MonnifyAPI.get_banks()
-            return Response(banks, status=200)
+            etag, bank_list = banks.directory()
         except Exception as e:
             logger.error(f"Failed to fetch banks: {e}")
             return Response({"error": "Could not load bank list"}, status=500)
 
+        if request.headers.get('If-None-Match') == etag:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        return Response(bank_list, status=200, headers={'ETag': etag})
+
 class WithdrawalView(APIView):
     """
     User-facing: submit bank details for admin-manual payout.
@@ -598,6 +355,7 @@ class WithdrawalView(APIView):
     """
     permission_classes = [permissions.IsAuthenticated]
 
+    @idempotent
     def post(self, request):
         amount = request.data.get('amount')
         bank_code = request.data.get('bank_code')
@@ -622,7 +380,7 @@ class WithdrawalView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        wallet = Wallet.objects.select_for_update().get(user=request.user)
+        wallet = Wallet.objects.get(user=request.user)
         if wallet.available_balance < amount_dec:
             return Response(
                 {"error": "Insufficient available balance."},
@@ -680,17 +438,17 @@ class AdminConfirmPayoutView(APIView):
             )
 
         with transaction.atomic():
-            wallet = Wallet.objects.select_for_update().get(user=ticket.user)
+            wallet = Wallet.objects.get(user=ticket.user)
 
-            if wallet.available_balance < ticket.amount:
+            if not WalletManager.debit(
+                wallet, ticket.amount, ledger.Kind.WITHDRAWAL,
+                description=f"Withdrawal ticket #{ticket.pk}",
+            ):
                 return Response(
                     {"error": "Insufficient balance. User funds may have been used elsewhere."},
                     status=status.HTTP_400_BAD_REQUEST,
                 )
 
-            wallet.available_balance -= ticket.amount
-            wallet.save()
-
             Transaction.objects.create(
                 wallet=wallet,
                 amount=-ticket.amount,
@@ -746,92 +504,16 @@ def clubkonnect_deposit_webhook(request):
     # Clubkonnect typically sends: orderid, statuscode, amount, and orderremark
     # The 'orderremark' usually contains the account name we set up: "NELLOBYTE-YUS (username)"
     #
-    # SECURITY: Clubkonnect callbacks are not signed, so the incoming statuscode/amount
-    # query params must never be trusted directly (anyone can call this URL with any
-    # amount/remark). We independently requery Clubkonnect's own API for the order
-    # before crediting anything, and dedupe on orderid so a replayed callback can't
-    # credit twice.
-    User = get_user_model()
-
+    # Clubkonnect callbacks are not signed, so nothing in them is trusted here:
+    # the inbox handler requeries the order before crediting anything.
     orderid = request.query_params.get('orderid')
-    remark = request.query_params.get('orderremark', '')
 
     if not orderid:
         logger.warning(f"Clubkonnect deposit webhook missing orderid: {request.query_params.dict()}")
         return Response("Missing orderid", status=400)
 
-    if Transaction.objects.filter(reference=orderid, transaction_type='deposit').exists():
-        logger.info(f"Clubkonnect deposit webhook: orderid={orderid} already processed, ignoring replay")
-        return Response("Already processed", status=200)
-
-    try:
-        verify_resp = NellobyteClient().query_transaction(order_id=orderid)
-    except Exception as e:
-        logger.error(f"Clubkonnect deposit webhook: query_transaction failed for orderid={orderid}: {e}")
-        return Response("Verification request failed", status=502)
-
-    logger.info(f"Clubkonnect deposit webhook: orderid={orderid} verify_resp={verify_resp}")
-
-    # Be conservative: only proceed if the requery response clearly confirms success.
-    # NOTE: Clubkonnect's exact field names for this query type aren't confirmed from
-    # docs — the raw response is logged above so this matching can be tightened once
-    # a real response has been inspected in production logs.
-    status_fields = [
-        str(verify_resp.get(k, '')).strip().lower()
-        for k in ('status', 'orderstatus', 'ORDER_STATUS', 'statuscode')
-        if isinstance(verify_resp, dict)
-    ]
-    is_verified_success = any(v in ('success', 'successful', 'completed', '200', '100') for v in status_fields)
-
-    if not is_verified_success:
-        logger.warning(f"Clubkonnect deposit webhook: orderid={orderid} could not be verified as successful, rejecting. Response: {verify_resp}")
-        return Response("Could not verify transaction", status=400)
-
-    verified_amount_raw = None
-    for k in ('amount', 'amount_paid', 'AMOUNT', 'Amount'):
-        if isinstance(verify_resp, dict) and verify_resp.get(k) is not None:
-            verified_amount_raw = verify_resp.get(k)
-            break
-
-    if verified_amount_raw is None:
-        logger.warning(f"Clubkonnect deposit webhook: orderid={orderid} verified but no amount found in response: {verify_resp}")
-        return Response("Could not verify amount", status=400)
-
-    try:
-        verified_amount = Decimal(str(verified_amount_raw))
-    except Exception:
-        logger.error(f"Clubkonnect deposit webhook: orderid={orderid} unparseable amount {verified_amount_raw!r}")
-        return Response("Invalid amount", status=400)
-
-    match = re.search(r'\((.*?)\)', remark)
-    if not match:
-        return Response("Username not found in remark", status=400)
-    username = match.group(1)
-
-    try:
-        with transaction.atomic():
-            user = User.objects.get(username=username)
-            wallet, _ = Wallet.objects.get_or_create(user=user)
-            wallet = Wallet.objects.select_for_update().get(pk=wallet.pk)
-
-            wallet.available_balance += verified_amount
-            wallet.save()
-
-            Transaction.objects.create(
-                wallet=wallet,
-                amount=verified_amount,
-                transaction_type='deposit',
-                status='success',
-                reference=orderid,
-                description=f"Auto-Fund: {remark}"
-            )
-        logger.info(f"Clubkonnect deposit webhook: credited user={username} amount={verified_amount} orderid={orderid}")
-        return Response("Wallet Updated", status=200)
-    except User.DoesNotExist:
-        return Response(f"User {username} not found", status=404)
-    except Exception as e:
-        logger.error(f"Clubkonnect deposit webhook: error crediting orderid={orderid}: {e}")
-        return Response(f"Error: {str(e)}", status=400)
+    webhooks.ingest(WebhookEvent.Source.CLUBKONNECT_DEPOSIT, orderid, request.query_params.dict())
+    return Response("Received", status=200)
 
 
 @csrf_exempt
@@ -846,60 +528,5 @@ def webhook_data_callback(request):
     if not orderid or not statuscode:
         return HttpResponse("Missing orderid or statuscode", status=400)
 
-    try:
-        txn = Transaction.objects.get(reference=orderid, transaction_type=Transaction.TransactionType.BILL_PAYMENT)
-    except Transaction.DoesNotExist:
-        logger.error(f"Nellobyte callback: Transaction not found for orderid={orderid}")
-        return HttpResponse("Transaction not found", status=404)
-
-    with transaction.atomic():
-        txn = Transaction.objects.select_for_update().get(pk=txn.pk)
-
-        if orderremark:
-            txn.description = (txn.description or '') + f" | Remark: {orderremark}"
-
-        # Some Nellobyte callbacks return non-100 codes even when the
-        # data was successfully delivered (e.g. "successfully sold").
-        # Check the remark text — if it indicates success, honour it.
-        remark_lower = (orderremark or '').lower()
-        succeeded = any(kw in remark_lower for kw in ['successfully sold', 'successful', 'completed successfully'])
-
-        if statuscode == '100' or succeeded:
-            txn.status = Transaction.Status.SUCCESS
-            txn.description += f" (Completed: code={statuscode})"
-            txn.save()
-            logger.info(f"Nellobyte callback: Transaction {txn.id} marked SUCCESS (orderid={orderid})")
-            return HttpResponse("OK", status=200)
-        else:
-            txn.status = Transaction.Status.FAILED
-            txn.description += f" (Failed: code={statuscode})"
-            if txn.amount < 0 and 'Refunded' not in txn.description:
-                wallet = Wallet.objects.select_for_update().get(pk=txn.wallet_id)
-                wallet.available_balance += abs(txn.amount)
-                wallet.save()
-                txn.description += " (Wallet Refunded)"
-            txn.save()
-
-            # Auto-disable plans that fail with provider-side errors
-            if any(kw in remark_lower for kw in ['no active sim', 'inactive sim', 'not have an active sim']):
-                match = re.search(r'([A-Z]+-DATA)\s*\(([^)]+)\)', txn.description)
-                if match:
-                    raw_service = match.group(1).lower()
-                    variation_code = match.group(2)
-                    service_map = {
-                        'mtn-data': 'mtn-data',
-                        'glo-data': 'glo-data',
-                        '9mobile-data': '9mobile-data',
-                        'airtel-data': 'airtel-data',
-                    }
-                    service_id = service_map.get(raw_service)
-                    if service_id:
-                        DataPlanPrice.objects.update_or_create(
-                            network=service_id,
-                            variation_code=variation_code,
-                            defaults={'is_active': False, 'plan_name': f'Auto-disabled: {orderremark}'}
-                        )
-                        logger.info(f"Auto-disabled plan {service_id}/{variation_code} due to provider error")
-
-            logger.warning(f"Nellobyte callback: Transaction {txn.id} marked FAILED (orderid={orderid}, code={statuscode})")
-            return HttpResponse("OK", status=200)
+    webhooks.ingest(WebhookEvent.Source.NELLOBYTE_DATA, f"{orderid}:{statuscode}", request.GET.dict())
+    return HttpResponse("OK", status=200)
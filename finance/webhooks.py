@@ -0,0 +1,411 @@
+"""
+Webhook inbox.
+
+Provider callbacks used to do all their work inline, including a blocking
+requery to Clubkonnect, while the provider waited; slow answers made the
+provider time out and send the callback again. Now an endpoint only checks
+the request and calls ingest(), which stores the raw payload as a
+WebhookEvent keyed by the provider's own event id, and answers 200.
+
+process_batch() is the worker side (run by `manage.py process_webhooks`): it
+leases due events in one short transaction, then runs the handler registered
+for each source in a transaction of its own, so a failing event rolls back
+only its own writes and no row lock is held across another event's handler.
+A handler registered with @handler(source, atomic=False) opens its own
+transaction, which lets it make a slow provider call (the Clubkonnect
+requery) before taking any locks. Handlers must be idempotent. The inbox drops exact duplicates, but an event
+can still run again after a crash or a requeue. A handler raises
+PermanentFailure for events that can never succeed, which go straight to
+DEAD. Any other exception is retried with backoff until
+WebhookEvent.MAX_ATTEMPTS.
+
+Handlers for finance's own callbacks are below; other apps register theirs
+with @handler(source) from their AppConfig.ready().
+"""
+import hashlib
+import logging
+import re
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from market.models import Order
+from notifications import outbox
+from . import ledger
+from .models import (
+    DataPlanPrice, MONNIFY_DEPOSIT_CAP, MONNIFY_DEPOSIT_RATE, Transaction, Wallet, WebhookEvent,
+)
+from .nellobyte import NellobyteClient
+from .utils import WalletManager
+
+logger = logging.getLogger(__name__)
+
+Source = WebhookEvent.Source
+Status = WebhookEvent.Status
+
+HANDLERS = {}
+# Sources whose handler manages its own transaction (see handler()).
+SELF_MANAGED = set()
+
+# How long a claimed event stays invisible to other workers.
+CLAIM_LEASE = timedelta(minutes=5)
+
+
+class PermanentFailure(Exception):
+    """The event can never be processed as sent; it is dead-lettered without retries."""
+
+
+def handler(source, atomic=True):
+    def register(func):
+        HANDLERS[source] = func
+        if atomic:
+            SELF_MANAGED.discard(source)
+        else:
+            SELF_MANAGED.add(source)
+        return func
+    return register
+
+
+def ingest(source, event_id, payload):
+    """Stores a callback unless (source, event_id) is already in the inbox. Returns (event, created)."""
+    return WebhookEvent.objects.get_or_create(source=source, event_id=event_id[:255], defaults={'payload': payload})
+
+
+def payload_digest(raw):
+    """Fallback event id for callbacks that carry no id of their own."""
+    return hashlib.sha256(raw).hexdigest()
+
+
+# --- worker ----------------------------------------------------------------
+
+def _claim(batch_size, now):
+    """
+    Leases up to batch_size due events to this worker and returns them. The
+    lease expiry doubles as the claim token: only rows this call moved to it
+    come back, even if another worker raced for the same ids.
+    """
+    lease_until = now + CLAIM_LEASE
+    with transaction.atomic():
+        ids = list(
+            WebhookEvent.objects.select_for_update(skip_locked=True)
+            .filter(status=Status.PENDING, next_attempt_at__lte=now)
+            .order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return []
+        WebhookEvent.objects.filter(
+            pk__in=ids, status=Status.PENDING, next_attempt_at__lte=now,
+        ).update(next_attempt_at=lease_until)
+    return list(
+        WebhookEvent.objects.filter(pk__in=ids, status=Status.PENDING, next_attempt_at=lease_until).order_by('id')
+    )
+
+
+def _run(event, now):
+    try:
+        run = HANDLERS.get(event.source)
+        if run is None:
+            raise PermanentFailure(f"No handler registered for {event.source}")
+        if event.source in SELF_MANAGED:
+            run(event.payload)
+        else:
+            with transaction.atomic():
+                run(event.payload)
+    except PermanentFailure as e:
+        logger.warning(f"Webhook {event} dead-lettered: {e}")
+        event.attempts += 1
+        event.status = Status.DEAD
+        event.last_error = str(e)[:255]
+    except Exception as e:
+        logger.exception(f"Webhook {event} failed")
+        event.schedule_retry(e)
+    else:
+        event.attempts += 1
+        event.status = Status.PROCESSED
+        event.processed_at = now
+        event.last_error = ''
+    event.save(update_fields=['status', 'attempts', 'next_attempt_at', 'last_error', 'processed_at'])
+
+
+def process_batch(batch_size=100):
+    """Runs up to batch_size due events. Returns how many it handled."""
+    now = timezone.now()
+    due = _claim(batch_size, now)
+    for event in due:
+        _run(event, now)
+    return len(due)
+
+
+# --- Monnify ---------------------------------------------------------------
+
+def monnify_event_id(data, raw):
+    event_data = data.get('eventData') or {}
+    reference = (
+        event_data.get('transactionReference') or event_data.get('reference')
+        or event_data.get('paymentReference')
+    )
+    if not reference:
+        return payload_digest(raw)
+    return f"{data.get('eventType', '')}:{reference}"
+
+
+@handler(Source.MONNIFY)
+def handle_monnify(data):
+    event_type = data.get('eventType')
+    event_data = data.get('eventData') or {}
+
+    if event_type == 'SUCCESSFUL_TRANSACTION':
+        _monnify_payment(event_data)
+    elif event_type == 'DISBURSEMENT_SUCCESS':
+        ref = event_data.get('reference')
+        Transaction.objects.filter(reference=ref).update(status=Transaction.Status.SUCCESS)
+        logger.info(f"✅ Disbursement successful for ref {ref}")
+    elif event_type == 'DISBURSEMENT_FAILED':
+        _monnify_disbursement_failed(event_data.get('reference'))
+
+
+def _monnify_payment(event_data):
+    payment_ref = event_data.get('paymentReference')
+    amount_paid = Decimal(str(event_data.get('amountPaid', 0)))
+    settlement_amt = Decimal(str(event_data.get('settlementAmount', 0)))
+
+    # --- Order Checkout ---
+    # Find the order by reference (monnify_reference). A split checkout is
+    # paid once, under the checkout_reference shared by its per-shop orders.
+    orders = list(Order.objects.select_for_update().filter(
+        Q(monnify_reference=payment_ref) | Q(checkout_reference=payment_ref)
+    ).select_related('shop'))
+    if orders:
+        newly_paid = []
+        for order in orders:
+            if order.payment_status != Order.PaymentStatus.PAID:
+                order.payment_status = Order.PaymentStatus.PAID
+                order.save()
+                newly_paid.append(order)
+
+                # Update Seller Stats (This fuels your Dashboard image)
+                shop = order.shop
+                if shop:
+                    shop.total_sales += int(amount_paid if len(orders) == 1 else order.total_price)
+                    shop.save()
+
+        # Replays find the orders already PAID and queue nothing.
+        outbox.orders_paid(newly_paid)
+        logger.info(f"✅ Order marked as PAID via Monnify Webhook (Ref: {payment_ref})")
+        return
+
+    # --- Virtual Account Wallet Funding ---
+    account_ref = (event_data.get('product') or {}).get('reference')
+    if not account_ref:
+        raise PermanentFailure(f"Unhandled payment reference {payment_ref}")
+    try:
+        wallet = Wallet.objects.get(account_reference=account_ref)
+    except Wallet.DoesNotExist:
+        raise PermanentFailure(f"Wallet with reference {account_ref} not found")
+
+    if Transaction.objects.filter(reference=payment_ref).exists():
+        return
+    processing_fee = min(settlement_amt * MONNIFY_DEPOSIT_RATE, MONNIFY_DEPOSIT_CAP)
+    net_credit = settlement_amt - processing_fee
+
+    ledger.post(ledger.Kind.DEPOSIT, [
+        (ledger.EXTERNAL, -settlement_amt),
+        (ledger.available(wallet), net_credit),
+        (ledger.REVENUE, processing_fee),
+    ], "Bank Deposit", payment_ref)
+    Transaction.objects.create(
+        wallet=wallet,
+        amount=net_credit,
+        transaction_type=Transaction.TransactionType.DEPOSIT,
+        status=Transaction.Status.SUCCESS,
+        reference=payment_ref,
+        description=f"Bank Deposit (Fee: ₦{processing_fee})"
+    )
+    outbox.wallet_funded(wallet, net_credit)
+    logger.info(f"✅ Wallet {wallet.id} credited with ₦{net_credit} (net of ₦{processing_fee} processing fee)")
+
+
+def _monnify_disbursement_failed(ref):
+    try:
+        txn = Transaction.objects.select_for_update().get(reference=ref)
+    except Transaction.DoesNotExist:
+        raise PermanentFailure(f"No transaction for disbursement {ref}")
+
+    # Only refund if the wallet was actually deducted (SUCCESS status).
+    # PENDING transactions haven't deducted the wallet yet; FAILED ones were
+    # already handled.
+    if txn.status == Transaction.Status.SUCCESS:
+        WalletManager.credit(
+            txn.wallet_id, abs(txn.amount), ledger.Kind.REFUND,
+            description="Failed disbursement", reference=ref,
+        )
+        txn.status = Transaction.Status.FAILED
+        txn.description += " (Failed: Refunded)"
+        txn.save()
+        logger.warning(f"⚠️ Disbursement failed and refunded for ref {ref}")
+    elif txn.status == Transaction.Status.PENDING:
+        txn.status = Transaction.Status.FAILED
+        txn.save(update_fields=['status'])
+        logger.warning(f"⚠️ Disbursement failed for ref {ref} (was PENDING, no refund needed)")
+
+
+# --- Clubkonnect deposits ----------------------------------------------------
+
+def _clubkonnect_deposit_exists(orderid):
+    return Transaction.objects.filter(reference=orderid, transaction_type=Transaction.TransactionType.DEPOSIT).exists()
+
+
+@handler(Source.CLUBKONNECT_DEPOSIT, atomic=False)
+def handle_clubkonnect_deposit(params):
+    # SECURITY: Clubkonnect callbacks are not signed, so the incoming
+    # statuscode/amount must never be trusted directly. The order is requeried
+    # from Clubkonnect's own API before anything is credited, and the
+    # Transaction reference dedupes replays.
+    orderid = params['orderid']
+    remark = params.get('orderremark', '')
+
+    if _clubkonnect_deposit_exists(orderid):
+        logger.info(f"Clubkonnect deposit: orderid={orderid} already processed, ignoring replay")
+        return
+
+    # A failed requery raises and is retried. It runs before the credit's
+    # transaction opens, so no lock waits on Clubkonnect.
+    verify_resp = NellobyteClient().query_transaction(order_id=orderid)
+    logger.info(f"Clubkonnect deposit: orderid={orderid} verify_resp={verify_resp}")
+
+    # Be conservative: only proceed if the requery response clearly confirms success.
+    # NOTE: Clubkonnect's exact field names for this query type aren't confirmed from
+    # docs — the raw response is logged above so this matching can be tightened once
+    # a real response has been inspected in production logs.
+    if not isinstance(verify_resp, dict):
+        raise PermanentFailure(f"Unexpected requery response for orderid={orderid}: {verify_resp!r}")
+    status_fields = [
+        str(verify_resp.get(k, '')).strip().lower()
+        for k in ('status', 'orderstatus', 'ORDER_STATUS', 'statuscode')
+    ]
+    if not any(v in ('success', 'successful', 'completed', '200', '100') for v in status_fields):
+        raise PermanentFailure(f"orderid={orderid} could not be verified as successful: {verify_resp}")
+
+    verified_amount_raw = next(
+        (verify_resp[k] for k in ('amount', 'amount_paid', 'AMOUNT', 'Amount') if verify_resp.get(k) is not None),
+        None,
+    )
+    if verified_amount_raw is None:
+        raise PermanentFailure(f"orderid={orderid} verified but no amount found in response: {verify_resp}")
+    try:
+        verified_amount = Decimal(str(verified_amount_raw))
+    except Exception:
+        raise PermanentFailure(f"orderid={orderid} unparseable amount {verified_amount_raw!r}")
+
+    # The remark carries the account name we set up: "NELLOBYTE-YUS (username)".
+    match = re.search(r'\((.*?)\)', remark)
+    if not match:
+        raise PermanentFailure(f"Username not found in remark {remark!r}")
+    username = match.group(1)
+    try:
+        user = get_user_model().objects.get(username=username)
+    except get_user_model().DoesNotExist:
+        raise PermanentFailure(f"User {username} not found")
+
+    with transaction.atomic():
+        wallet, _ = Wallet.objects.select_for_update().get_or_create(user=user)
+        if _clubkonnect_deposit_exists(orderid):
+            return  # credited while this event was requerying
+        WalletManager.credit(
+            wallet, verified_amount, ledger.Kind.DEPOSIT,
+            description=f"Auto-Fund: {remark}", reference=orderid,
+        )
+        Transaction.objects.create(
+            wallet=wallet,
+            amount=verified_amount,
+            transaction_type=Transaction.TransactionType.DEPOSIT,
+            status=Transaction.Status.SUCCESS,
+            reference=orderid,
+            description=f"Auto-Fund: {remark}"
+        )
+    logger.info(f"Clubkonnect deposit: credited user={username} amount={verified_amount} orderid={orderid}")
+
+
+# --- Nellobyte data purchases ------------------------------------------------
+
+PROVIDER_SIM_ERRORS = ('no active sim', 'inactive sim', 'not have an active sim')
+
+
+@handler(Source.NELLOBYTE_DATA)
+def handle_nellobyte_data(params):
+    orderid = params['orderid']
+    statuscode = params['statuscode']
+    orderremark = params.get('orderremark', '')
+
+    # The callback can beat the purchase view's own commit; not-found is retried.
+    txn = Transaction.objects.select_for_update().get(
+        reference=orderid, transaction_type=Transaction.TransactionType.BILL_PAYMENT,
+    )
+
+    succeeded = statuscode == '100' or remark_says_success(orderremark)
+    if txn.status == (Transaction.Status.SUCCESS if succeeded else Transaction.Status.FAILED):
+        return  # a re-run of an event that was already applied
+    settle_data_purchase(txn, succeeded, statuscode, orderremark)
+
+
+def remark_says_success(remark):
+    # Some Nellobyte callbacks return non-100 codes even when the
+    # data was successfully delivered (e.g. "successfully sold").
+    # Check the remark text — if it indicates success, honour it.
+    remark_lower = (remark or '').lower()
+    return any(kw in remark_lower for kw in ['successfully sold', 'successful', 'completed successfully'])
+
+
+def settle_data_purchase(txn, succeeded, statuscode, orderremark=''):
+    """
+    Marks a data-purchase Transaction SUCCESS, or FAILED with the wallet
+    refunded. The caller holds the row lock (select_for_update). Shared by
+    the callback handler and `manage.py requery_pending_purchases`.
+    """
+    orderid = txn.reference
+    remark_lower = (orderremark or '').lower()
+    if orderremark:
+        txn.description = (txn.description or '') + f" | Remark: {orderremark}"
+
+    if succeeded:
+        txn.status = Transaction.Status.SUCCESS
+        txn.description += f" (Completed: code={statuscode})"
+        txn.save()
+        logger.info(f"Nellobyte data: Transaction {txn.id} marked SUCCESS (orderid={orderid})")
+        return
+
+    txn.status = Transaction.Status.FAILED
+    txn.description += f" (Failed: code={statuscode})"
+    if txn.amount < 0 and 'Refunded' not in txn.description:
+        WalletManager.credit(
+            txn.wallet_id, abs(txn.amount), ledger.Kind.REFUND,
+            description="Failed data purchase", reference=orderid,
+        )
+        txn.description += " (Wallet Refunded)"
+    txn.save()
+
+    # Auto-disable plans that fail with provider-side errors
+    if any(kw in remark_lower for kw in PROVIDER_SIM_ERRORS):
+        match = re.search(r'([A-Z]+-DATA)\s*\(([^)]+)\)', txn.description)
+        if match:
+            raw_service = match.group(1).lower()
+            variation_code = match.group(2)
+            service_map = {
+                'mtn-data': 'mtn-data',
+                'glo-data': 'glo-data',
+                '9mobile-data': '9mobile-data',
+                'airtel-data': 'airtel-data',
+            }
+            service_id = service_map.get(raw_service)
+            if service_id:
+                DataPlanPrice.objects.update_or_create(
+                    network=service_id,
+                    variation_code=variation_code,
+                    defaults={'is_active': False, 'plan_name': f'Auto-disabled: {orderremark}'}
+                )
+                logger.info(f"Auto-disabled plan {service_id}/{variation_code} due to provider error")
+
+    logger.warning(f"Nellobyte data: Transaction {txn.id} marked FAILED (orderid={orderid}, code={statuscode})")
@@ -4,4 +4,21 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "globalink_core.settings")
 
 from django.core.asgi import get_asgi_application
 
-application = get_asgi_application()
+# Initialise Django before importing anything that touches models.
+django_asgi_app = get_asgi_application()
+
+try:
+    from channels.routing import ProtocolTypeRouter, URLRouter
+except ImportError:
+    application = django_asgi_app
+else:
+    from chat.middleware import JWTAuthMiddleware
+    from chat.routing import websocket_urlpatterns
+
+    # Sockets authenticate with the JWT bearer token, not cookies, so there is
+    # no cross-site hijacking to guard against with an Origin check. The mobile
+    # app's native socket client sends no Origin header at all.
+    application = ProtocolTypeRouter({
+        'http': django_asgi_app,
+        'websocket': JWTAuthMiddleware(URLRouter(websocket_urlpatterns)),
+    })
@@ -1,4 +1,5 @@
 import os
+import tempfile
 import environ
 from pathlib import Path
 from datetime import timedelta
@@ -61,7 +62,8 @@ INSTALLED_APPS = [
     'jobs',
     'logistics',
     'finance',
-    'chat'
+    'chat',
+    'notifications',
 ]
 
 # Channels (optional — only if package is installed)
@@ -134,15 +136,68 @@ USE_I18N = True
 USE_TZ = True
 
 # 10. Static & Media Files
-# Cache (local-memory for dev; swap to Redis for production)
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'globalink-cache',
-        'TIMEOUT': 300,
-    }
+# Cache. CACHE_URL selects one backend shared by every alias below:
+#   locmemcache://globalink-cache         per-process, dev only (default)
+#   filecache:///var/tmp/globalink-cache  shared by all workers on one host
+#   dbcache://globalink_cache             shared via the database; run `manage.py createcachetable`
+#   redis://127.0.0.1:6379/1              shared across hosts (needs the `redis` package)
+# Local-memory caches are per worker, so invalidation in one process never
+# reaches the others. Multi-process deployments should use file, db or redis.
+CACHE_URL = env('CACHE_URL', default='locmemcache://globalink-cache')
+
+# Who is online must be visible to every worker, so the 'presence' alias
+# never uses a per-process local-memory cache (users.checks enforces this).
+# With the locmem default it falls back to a file cache on this host; set
+# PRESENCE_CACHE_URL (or CACHE_URL) to redis when running on several hosts.
+PRESENCE_CACHE_URL = env('PRESENCE_CACHE_URL', default=(
+    f"filecache://{os.path.join(tempfile.gettempdir(), 'globalink-presence')}"
+    if CACHE_URL.startswith('locmemcache') else CACHE_URL
+))
+
+# One alias per subsystem, each with its own key prefix and default TTL (seconds).
+CACHE_TIMEOUTS = {
+    'default': env.int('CACHE_TTL_DEFAULT', default=300),
+    'catalog': env.int('CACHE_TTL_CATALOG', default=300),                # market.catalog listings
+    'provider_plans': env.int('CACHE_TTL_PROVIDER_PLANS', default=3600), # Nellobyte data plans
+    'bank_list': env.int('CACHE_TTL_BANK_LIST', default=86400),          # Monnify bank directory
+    'dashboard': env.int('CACHE_TTL_DASHBOARD', default=60),             # admin stats aggregates
+    'presence': env.int('CACHE_TTL_PRESENCE', default=90),               # users.presence online window
+    'account_names': env.int('CACHE_TTL_ACCOUNT_NAMES', default=86400),  # resolved bank-account names
 }
 
+# How often each process writes buffered presence heartbeats to User.last_seen
+# from a background thread; 0 writes every heartbeat immediately. uWSGI (the
+# PythonAnywhere web workers) runs no threads unless started with
+# --enable-threads; without it, set PRESENCE_FLUSH_INTERVAL=0.
+PRESENCE_FLUSH_INTERVAL = env.int('PRESENCE_FLUSH_INTERVAL', default=60)
+
+# Longest a chat message poll may hold its request with `wait=N` (seconds).
+# A waiting poll occupies a whole sync worker and reads the conversation row
+# once a second, so keep this low under WSGI (PythonAnywhere) unless there
+# are workers to spare, and only raise it when serving over ASGI. 0 turns
+# long-polling off; clients then get an immediate answer.
+CHAT_LONG_POLL_MAX_WAIT = env.float('CHAT_LONG_POLL_MAX_WAIT', default=5.0)
+
+
+def _cache_alias(alias, timeout):
+    config = env.cache_url_config(PRESENCE_CACHE_URL if alias == 'presence' else CACHE_URL)
+    config['TIMEOUT'] = timeout
+    config['KEY_PREFIX'] = f'globalink:{alias}'
+    # Local-memory and file caches clear() by wiping their whole store, so
+    # give each alias its own store to keep one subsystem from flushing another.
+    if config['BACKEND'].endswith('LocMemCache'):
+        config['LOCATION'] = f"{config.get('LOCATION', '')}-{alias}"
+    elif config['BACKEND'].endswith('FileBasedCache'):
+        config['LOCATION'] = os.path.join(config['LOCATION'], alias)
+    return config
+
+
+CACHES = {alias: _cache_alias(alias, timeout) for alias, timeout in CACHE_TIMEOUTS.items()}
+
+# Product full-text search backend (dotted path). Blank = pick by database
+# vendor: FTS5 on SQLite, tsvector on PostgreSQL. See market/search.py.
+MARKET_SEARCH_BACKEND = env('MARKET_SEARCH_BACKEND', default='')
+
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
@@ -166,6 +221,30 @@ EMAIL_HOST_USER = env('EMAIL_HOST_USER', default='')
 EMAIL_HOST_PASSWORD = env('EMAIL_HOST_PASSWORD', default='')
 DEFAULT_FROM_EMAIL = env('DEFAULT_FROM_EMAIL', default='noreply@globalink.com')
 
+# Read chat messages older than this many days are moved to the archive
+# table by `manage.py archive_chat_messages`.
+CHAT_ARCHIVE_AFTER_DAYS = env.int('CHAT_ARCHIVE_AFTER_DAYS', default=90)
+
+# Push notifications (see notifications/outbox.py). The sender is a dotted
+# path; notifications.senders.LocMemPushSender keeps pushes in memory.
+PUSH_NOTIFICATION_SENDER = env('PUSH_NOTIFICATION_SENDER', default='notifications.senders.ExpoPushSender')
+EXPO_ACCESS_TOKEN = env('EXPO_ACCESS_TOKEN', default='')
+
+# `manage.py requery_pending_purchases` (see finance/requery.py) asks Nellobyte
+# about data purchases still pending after this many minutes, with at most
+# NELLOBYTE_REQUERY_WORKERS requests in flight and NELLOBYTE_REQUERY_RATE per second.
+DATA_PURCHASE_REQUERY_AFTER_MINUTES = env.int('DATA_PURCHASE_REQUERY_AFTER_MINUTES', default=15)
+NELLOBYTE_REQUERY_WORKERS = env.int('NELLOBYTE_REQUERY_WORKERS', default=4)
+NELLOBYTE_REQUERY_RATE = env.float('NELLOBYTE_REQUERY_RATE', default=5.0)
+
+# Stored responses for Idempotency-Key retries (see finance/idempotency.py)
+# are replayed for this many seconds; `manage.py purge_idempotency_keys`
+# deletes expired ones.
+IDEMPOTENCY_KEY_TTL = env.int('IDEMPOTENCY_KEY_TTL', default=86400)
+# A key whose first request has not answered after this many seconds (its
+# worker was killed) is taken over by the next retry instead of a 409.
+IDEMPOTENCY_IN_FLIGHT_TIMEOUT = env.int('IDEMPOTENCY_IN_FLIGHT_TIMEOUT', default=120)
+
 # --- Account Deletion ---
 ACCOUNT_DELETION_GRACE_PERIOD_DAYS = 30
 FRONTEND_URL = env('FRONTEND_URL', default='http://localhost:3000')
@@ -15,7 +15,10 @@ from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 import json
 from finance.models import Wallet, Transaction, WithdrawalTicket, PlatformRevenue, DataMarkup, DataPlanPrice
+from finance import ledger
 from finance.nellobyte import NellobyteClient
+from finance.utils import WalletManager
+from finance.pricing import pricing_engine
 from market.models import Shop, Order, PromotedPostPricing
 
 User = get_user_model()
@@ -170,13 +173,13 @@ class WithdrawalTicketUpdateStatusView(LoginRequiredMixin, UserPassesTestMixin,
 
         if action == 'approve':
             with transaction.atomic():
-                wallet = Wallet.objects.select_for_update().get(user=ticket.user)
-                if wallet.available_balance < ticket.amount:
+                wallet = Wallet.objects.get(user=ticket.user)
+                if not WalletManager.debit(
+                    wallet, ticket.amount, ledger.Kind.WITHDRAWAL,
+                    description=f"Withdrawal ticket #{ticket.pk}",
+                ):
                     return HttpResponse('Insufficient balance.', status=400)
 
-                wallet.available_balance -= ticket.amount
-                wallet.save()
-
                 Transaction.objects.create(
                     wallet=wallet,
                     amount=-ticket.amount,
@@ -193,15 +196,9 @@ class WithdrawalTicketUpdateStatusView(LoginRequiredMixin, UserPassesTestMixin,
             return HttpResponse('approved')
 
         elif action == 'reject':
-            with transaction.atomic():
-                wallet, _ = Wallet.objects.select_for_update().get_or_create(
-                    user=ticket.user
-                )
-                wallet.available_balance += ticket.amount
-                wallet.save()
-
-                ticket.status = WithdrawalTicket.StatusChoices.REJECTED
-                ticket.save()
+            # Tickets are only debited on approval, so there is nothing to give back.
+            ticket.status = WithdrawalTicket.StatusChoices.REJECTED
+            ticket.save(update_fields=['status'])
             return HttpResponse('rejected')
 
         return HttpResponse('Invalid action.', status=400)
@@ -226,29 +223,14 @@ class AdminDataPricingView(LoginRequiredMixin, UserPassesTestMixin, View):
         for svc, net in self.SERVICE_TO_NETWORK.items():
             entry = {'network': svc, 'network_label': net, 'samples': [], 'error': None}
             try:
-                client = NellobyteClient()
-                plans = client.fetch_all_variations(net)
-                factor = 1.10
-                try:
-                    dm = DataMarkup.objects.get(network=svc, is_active=True)
-                    factor = float(dm.price_factor)
-                except DataMarkup.DoesNotExist:
-                    pass
-                for plan in plans[:3]:
-                    raw_price = None
-                    for key in ('PRODUCT_AMOUNT', 'price', 'Price', 'amount', 'Amount', 'variation_amount'):
-                        val = plan.get(key)
-                        if val is not None:
-                            raw_price = val
-                            break
-                    if raw_price is not None:
-                        original = float(str(raw_price).replace(',', ''))
-                        entry['samples'].append({
-                            'name': plan.get('PRODUCT_NAME', plan.get('name', 'Plan')),
-                            'original_price': str(round(original, 2)),
-                            'factor': str(round(factor, 2)),
-                            'selling_price': str(round(original * factor, 2)),
-                        })
+                plans = NellobyteClient().fetch_all_variations(net)
+                for priced in pricing_engine.price_plans(svc, plans[:3], include_disabled=True):
+                    entry['samples'].append({
+                        'name': priced['plan'].get('PRODUCT_NAME', priced['plan'].get('name', 'Plan')),
+                        'original_price': str(round(priced['original_price'], 2)),
+                        'factor': str(round(priced['factor'], 2)),
+                        'selling_price': str(round(priced['original_price'] * priced['factor'], 2)),
+                    })
             except Exception as e:
                 entry['error'] = str(e)
             preview.append(entry)
@@ -304,9 +286,6 @@ class AdminDataPricingView(LoginRequiredMixin, UserPassesTestMixin, View):
 
         markup.save()
 
-        from finance.views import DataVariationsView
-        DataVariationsView._markup_cache.pop(markup.network, None)
-
         return JsonResponse({
             'status': 'success',
             'markup': {
@@ -403,63 +382,23 @@ class AdminDataPlansView(LoginRequiredMixin, UserPassesTestMixin, View):
 
     def get(self, request):
         client = NellobyteClient()
-        overrides = {}
-        try:
-            for dpp in DataPlanPrice.objects.filter(is_active=True):
-                overrides[(dpp.network, dpp.variation_code)] = dpp
-        except OperationalError:
-            overrides = {}
-
         all_plans = []
         for svc, (net_key, label) in NETWORK_INFO.items():
             try:
                 plans = client.fetch_all_variations(net_key)
             except Exception:
                 continue
-            factor = 1.10
-            try:
-                dm = DataMarkup.objects.get(network=svc, is_active=True)
-                factor = float(dm.price_factor)
-            except (DataMarkup.DoesNotExist, OperationalError):
-                pass
-            for plan in plans:
-                code = str(plan.get('PRODUCT_ID', '') or plan.get('variation_code', '') or '')
-                name = str(plan.get('PRODUCT_NAME', '') or plan.get('name', '') or '')
-                raw_price = None
-                for key in ('PRODUCT_AMOUNT', 'price', 'Price', 'amount', 'Amount', 'variation_amount'):
-                    val = plan.get(key)
-                    if val is not None:
-                        raw_price = val
-                        break
-                if raw_price is None:
-                    continue
-                original = float(str(raw_price).replace(',', ''))
-                key = (svc, code)
-                if key in overrides:
-                    dpp = overrides[key]
-                    sp = float(dpp.selling_price) if dpp.selling_price is not None else None
-                    all_plans.append({
-                        'id': dpp.id,
-                        'network': svc,
-                        'network_label': label,
-                        'variation_code': code,
-                        'plan_name': name,
-                        'original_price': str(round(original, 2)),
-                        'selling_price': str(round(sp, 2)) if sp is not None else None,
-                        'overridden': sp is not None,
-                    })
-                else:
-                    sp = round(original * factor, 2)
-                    all_plans.append({
-                        'id': None,
-                        'network': svc,
-                        'network_label': label,
-                        'variation_code': code,
-                        'plan_name': name,
-                        'original_price': str(round(original, 2)),
-                        'selling_price': str(sp),
-                        'overridden': False,
-                    })
+            for priced in pricing_engine.price_plans(svc, plans, include_disabled=True):
+                all_plans.append({
+                    'id': priced['override_id'],
+                    'network': svc,
+                    'network_label': label,
+                    'variation_code': priced['variation_code'],
+                    'plan_name': priced['name'],
+                    'original_price': str(round(priced['original_price'], 2)),
+                    'selling_price': str(round(priced['selling_price'], 2)),
+                    'overridden': priced['overridden'],
+                })
         return JsonResponse({'plans': all_plans})
 
     def post(self, request):
@@ -491,4 +430,6 @@ class AdminDataPlansView(LoginRequiredMixin, UserPassesTestMixin, View):
                 saved += 1
             except Exception:
                 continue
+        # Queryset .update() skips the save signals, so refresh the pricing table here.
+        pricing_engine.invalidate()
         return JsonResponse({'status': 'success', 'saved': saved})
@@ -3,13 +3,17 @@ from decimal import Decimal
 from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
 from django.http import HttpResponse
+from django.db import transaction
 import logging
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, permissions
-from finance.models import Transaction, DataMarkup, DataPlanPrice
+from finance import ledger, webhooks
+from finance.models import Transaction, Wallet, WebhookEvent
+from finance.idempotency import idempotent
 from finance.utils import WalletManager
 from finance.nellobyte import NellobyteClient
+from finance.pricing import pricing_engine
 from .models import DataTransaction
 
 logger = logging.getLogger(__name__)
@@ -17,62 +21,22 @@ logger = logging.getLogger(__name__)
 class PurchaseDataView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
-    SERVICE_TO_NETWORK = {
-        'mtn-data': 'MTN',
-        'glo-data': 'Glo',
-        'airtel-data': 'Airtel',
-        '9mobile-data': '9mobile',
-    }
-
     def _fetch_live_price(self, service_id, variation_code):
-        network_key = self.SERVICE_TO_NETWORK.get(service_id)
-        if not network_key:
-            return None, f"Unknown service: {service_id}"
-
-        client = NellobyteClient()
-        plans = client.fetch_all_variations(network_key)
-
-        matched = None
-        for plan in plans:
-            pid = str(plan.get('PRODUCT_ID', '') or plan.get('ID', '') or '')
-            if pid == variation_code:
-                matched = plan
-                break
-
-        if not matched:
-            return None, f"Plan '{variation_code}' not found for {service_id}"
-
-        raw_price = None
-        for key in ('PRODUCT_AMOUNT', 'price', 'Price', 'amount', 'Amount', 'variation_amount'):
-            val = matched.get(key)
-            if val is not None:
-                raw_price = val
-                break
-
-        if raw_price is None:
-            return None, "Could not determine plan price from provider"
-
-        original_price = float(str(raw_price).replace(',', ''))
-        # Check per-plan override first
-        try:
-            dpp = DataPlanPrice.objects.get(
-                network=service_id, variation_code=variation_code,
-                is_active=True, selling_price__isnull=False
+        return pricing_engine.quote(service_id, variation_code)
+
+    def _refund(self, user, amount, description):
+        with transaction.atomic():
+            wallet = Wallet.objects.get(user=user)
+            WalletManager.credit(wallet, amount, ledger.Kind.REFUND, description=description)
+            Transaction.objects.create(
+                wallet=wallet,
+                amount=amount,
+                transaction_type=Transaction.TransactionType.REFUND,
+                status=Transaction.Status.SUCCESS,
+                description=f"Refund: {description}",
             )
-            verified = round(float(dpp.selling_price), 2)
-            return Decimal(str(verified)), None
-        except DataPlanPrice.DoesNotExist:
-            pass
-        factor = 1.10
-        try:
-            dm = DataMarkup.objects.get(network=service_id, is_active=True)
-            factor = float(dm.price_factor)
-        except DataMarkup.DoesNotExist:
-            pass
-
-        verified = round(original_price * factor, 2)
-        return Decimal(str(verified)), None
 
+    @idempotent
     def post(self, request):
         user = request.user
         service_id = request.data.get("serviceID")
@@ -122,8 +86,7 @@ class PurchaseDataView(APIView):
                 }, status=200)
             else:
                 # AUTO-REFUND if Nellobyte fails
-                user.wallet.available_balance += float(amount)
-                user.wallet.save()
+                self._refund(user, amount, description)
                 return Response({
                     "error": "Provider Error",
                     "details": res_data.get("remark") or res_data.get("status")
@@ -131,8 +94,7 @@ class PurchaseDataView(APIView):
 
         except Exception as e:
             # SAFETY REFUND if network crashes
-            user.wallet.available_balance += float(amount)
-            user.wallet.save()
+            self._refund(user, amount, description)
             return Response({"error": f"Connection failed: {str(e)}"}, status=502)
 
 
@@ -147,23 +109,7 @@ def nellobyte_callback(request):
     if not orderid:
         return HttpResponse("Missing orderid", status=400)
 
-    try:
-        txn = DataTransaction.objects.get(order_id=orderid)
-    except DataTransaction.DoesNotExist:
-        logger.error(f"Nellobyte callback: DataTransaction not found for orderid={orderid}")
-        return HttpResponse("Transaction not found", status=404)
-
-    if statuscode == '100':
-        txn.status = DataTransaction.Status.SUCCESS
-        txn.remark = f"statuscode={statuscode} orderstatus={orderstatus}"
-        txn.save()
-        logger.info(f"DataTransaction {txn.id} marked SUCCESS (orderid={orderid})")
-    else:
-        txn.status = DataTransaction.Status.FAILED
-        txn.remark = f"statuscode={statuscode} orderstatus={orderstatus}"
-        txn.save()
-        logger.warning(f"DataTransaction {txn.id} marked FAILED (orderid={orderid}, code={statuscode})")
-
+    webhooks.ingest(WebhookEvent.Source.LOGISTICS_DATA, f"{orderid}:{statuscode}", request.GET.dict())
     return HttpResponse("OK", status=200)
 
 
@@ -0,0 +1,25 @@
+"""Inbox handler for Nellobyte callbacks on logistics data purchases (see finance.webhooks)."""
+import logging
+
+from finance.models import WebhookEvent
+from finance.webhooks import handler
+from .models import DataTransaction
+
+logger = logging.getLogger(__name__)
+
+
+@handler(WebhookEvent.Source.LOGISTICS_DATA)
+def handle_nellobyte_data(params):
+    orderid = params['orderid']
+    statuscode = params.get('statuscode')
+    orderstatus = params.get('orderstatus', '')
+
+    # The callback can beat the purchase view's own save; not-found is retried.
+    txn = DataTransaction.objects.get(order_id=orderid)
+    txn.status = DataTransaction.Status.SUCCESS if statuscode == '100' else DataTransaction.Status.FAILED
+    txn.remark = f"statuscode={statuscode} orderstatus={orderstatus}"
+    txn.save(update_fields=['status', 'remark', 'updated_at'])
+    if txn.status == DataTransaction.Status.SUCCESS:
+        logger.info(f"DataTransaction {txn.id} marked SUCCESS (orderid={orderid})")
+    else:
+        logger.warning(f"DataTransaction {txn.id} marked FAILED (orderid={orderid}, code={statuscode})")
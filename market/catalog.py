@@ -0,0 +1,135 @@
+"""
+Shared cache for the public product catalog.
+
+Listing responses are cached once per *normalized* query (category, ordering,
+search, page, ...), not once per URL and user. The public catalog looks the
+same for every visitor, so one cached copy serves them all.
+
+Each entry key embeds a generation number. There is one generation for the
+whole catalog and one per category. Product writes bump the generations they
+affect (see market.signals). Readers then compute a new key and miss, so an
+edit is visible on the next request, and the stale entries simply age out.
+
+Stock is the exception: every checkout changes it, and bumping generations on
+each sale would empty the cache under purchase traffic. Cached pages are
+served with their `stock` values refreshed from one primary-key query
+instead, so checkouts never invalidate anything.
+"""
+import hashlib
+import time
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.connection import ConnectionProxy
+from rest_framework.response import Response
+from .models import Category, Product
+
+# Entries live in the 'catalog' cache alias; its TTL comes from settings.CACHE_TIMEOUTS.
+cache = ConnectionProxy(caches, 'catalog')
+
+ALL_PRODUCTS = 'all'
+
+# Query parameters that change a listing response; anything else (tracking
+# params, cache busters) is ignored so it cannot fragment the cache.
+CATALOG_QUERY_PARAMS = ('category', 'ordering', 'search', 'page', 'page_size', 'paginate', 'cursor')
+
+
+def _generation_key(scope):
+    return f"catalog:gen:{scope}"
+
+
+def _fresh_generation():
+    # Seeded from the clock rather than 1, so a counter that was evicted never
+    # restarts at a value some still-cached entry was written under.
+    return int(time.time() * 1000)
+
+
+def get_generation(scope):
+    key = _generation_key(scope)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, _fresh_generation(), None)
+        generation = cache.get(key)
+    return generation
+
+
+def bump_generations(scopes):
+    scopes = set(scopes)
+
+    def bump():
+        for scope in scopes:
+            key = _generation_key(scope)
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, _fresh_generation(), None)
+
+    # Bump now so this request's own follow-up reads miss, and again after
+    # commit so a reader that refilled the cache mid-transaction is discarded.
+    bump()
+    transaction.on_commit(bump)
+
+
+def bump_categories(category_ids):
+    """Invalidates the whole catalog plus the listings of the given categories."""
+    scopes = {ALL_PRODUCTS}
+    ids = {pk for pk in category_ids if pk is not None}
+    if ids:
+        # Category listings are addressable by id or by slug, so bump both scopes.
+        for pk, slug in Category.objects.filter(pk__in=ids).values_list('pk', 'slug'):
+            scopes.update((f"category:{pk}", f"category:{slug}"))
+    bump_generations(scopes)
+
+
+def with_live_stock(data):
+    """Overwrites the `stock` of every cached product row with the current value."""
+    rows = data.get('results', []) if isinstance(data, dict) else data
+    ids = [row['id'] for row in rows if 'stock' in row]
+    if not ids:
+        return data
+    stock = dict(Product.objects.filter(pk__in=ids).values_list('pk', 'stock'))
+    for row in rows:
+        if row['id'] in stock:
+            row['stock'] = stock[row['id']]
+    return data
+
+
+def normalize_query(request):
+    params = []
+    for name in CATALOG_QUERY_PARAMS:
+        value = request.query_params.get(name)
+        if value in (None, ''):
+            continue
+        if name == 'search':
+            value = ' '.join(value.lower().split())
+        params.append((name, value))
+    return params
+
+
+class CatalogCacheMixin:
+    """
+    Caches list() responses of a public, user-independent ListAPIView in the
+    shared catalog cache. Views set `catalog_namespace` to keep their entries apart.
+    """
+    catalog_namespace = 'products'
+
+    def get_catalog_scope(self, request):
+        category = request.query_params.get('category')
+        return f"category:{category}" if category else ALL_PRODUCTS
+
+    def get_catalog_cache_key(self, request):
+        scope = self.get_catalog_scope(request)
+        query = '&'.join(f"{name}={value}" for name, value in normalize_query(request))
+        # Pagination links are absolute, so the host is part of the response.
+        raw = f"{request.get_host()}?{query}"
+        digest = hashlib.md5(raw.encode()).hexdigest()
+        return f"catalog:{self.catalog_namespace}:{scope}:{get_generation(scope)}:{digest}"
+
+    def list(self, request, *args, **kwargs):
+        key = self.get_catalog_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            return Response(with_live_stock(data))
+        response = super().list(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data)
+        return response
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from market.models import Product
+
+
+class Command(BaseCommand):
+    help = "Recomputes Product.primary_image from each product's primary ProductImage."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of products updated per UPDATE statement (default: 1000).',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        ids = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+        updated = 0
+        # Short id-range batches keep each UPDATE's row locks brief on a live table.
+        for start in range(0, len(ids), batch_size):
+            updated += Product.refresh_primary_images(ids[start:start + batch_size])
+        self.stdout.write(self.style.SUCCESS(f"Refreshed primary_image on {updated} product(s)."))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from market.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the product full-text search index from the Product table."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of products written to the index per batch (default: 1000).',
+        )
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        with transaction.atomic():
+            count = backend.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {count} product(s) with {backend.__class__.__name__}."
+        ))
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.8 on 2026-10-17 09:00
+
+from django.db import migrations
+
+
+SQLITE_CREATE = """
+CREATE VIRTUAL TABLE IF NOT EXISTS market_product_fts
+USING fts5(name, description, category_name, tokenize='unicode61 remove_diacritics 2')
+"""
+
+SQLITE_BACKFILL = """
+INSERT INTO market_product_fts (rowid, name, description, category_name)
+SELECT p.id, p.name, p.description, COALESCE(c.name, '')
+FROM market_product p LEFT JOIN market_category c ON c.id = p.category_id
+"""
+
+POSTGRES_CREATE = """
+CREATE TABLE IF NOT EXISTS market_product_search (
+    product_id bigint PRIMARY KEY REFERENCES market_product (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+    document tsvector NOT NULL
+);
+CREATE INDEX IF NOT EXISTS market_product_search_document_gin ON market_product_search USING GIN (document);
+"""
+
+POSTGRES_BACKFILL = """
+INSERT INTO market_product_search (product_id, document)
+SELECT p.id,
+       setweight(to_tsvector('simple', p.name), 'A')
+       || setweight(to_tsvector('simple', p.description), 'C')
+       || setweight(to_tsvector('simple', COALESCE(c.name, '')), 'B')
+FROM market_product p LEFT JOIN market_category c ON c.id = p.category_id
+ON CONFLICT (product_id) DO NOTHING
+"""
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(SQLITE_CREATE)
+        schema_editor.execute(SQLITE_BACKFILL)
+    elif vendor == 'postgresql':
+        schema_editor.execute(POSTGRES_CREATE)
+        schema_editor.execute(POSTGRES_BACKFILL)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS market_product_fts')
+    elif vendor == 'postgresql':
+        schema_editor.execute('DROP TABLE IF EXISTS market_product_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0026_promotedpost_contact_preference_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-17 22:28
+
+from django.db import migrations, models
+
+
+def backfill_primary_image(apps, schema_editor):
+    Product = apps.get_model('market', 'Product')
+    ProductImage = apps.get_model('market', 'ProductImage')
+    first_primary = ProductImage.objects.filter(
+        product_id=models.OuterRef('pk'), is_primary=True
+    ).order_by('id').values('image')[:1]
+    Product.objects.update(primary_image=models.Subquery(first_primary))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0028_order_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='primary_image',
+            field=models.CharField(blank=True, db_index=True, max_length=500, null=True),
+        ),
+        migrations.RunPython(backfill_primary_image, migrations.RunPython.noop),
+    ]
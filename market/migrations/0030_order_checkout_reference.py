@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-17 22:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0029_product_primary_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='checkout_reference',
+            field=models.CharField(blank=True, db_index=True, max_length=40, null=True),
+        ),
+    ]
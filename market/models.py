@@ -22,6 +22,12 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+class ShopQuerySet(models.QuerySet):
+    def with_product_count(self):
+        """Annotates product_count so ShopSerializer doesn't COUNT per row."""
+        return self.annotate(product_count=models.Count('products'))
+
+
 class Shop(models.Model):
     SHOP_TYPE_CHOICES = (
         ('retailer', 'Retailer'),
@@ -77,6 +83,8 @@ class Shop(models.Model):
     total_sales = models.IntegerField(default=0)
     monnify_sub_account_code = models.CharField(max_length=100, null=True, blank=True)
 
+    objects = ShopQuerySet.as_manager()
+
     def save(self, *args, **kwargs):
         """
         Safely intercepts the model save chain to prevent missing relation or API exceptions.
@@ -125,6 +133,18 @@ class MerchantProfile(models.Model):
     def __str__(self):
         return f"MerchantProfile for {self.user.email}"
 
+class ProductQuerySet(models.QuerySet):
+    def for_listing(self):
+        """
+        Everything ProductSerializer reads, loaded in a fixed number of queries:
+        category joined, shops (with owner and product_count) and images prefetched.
+        """
+        return self.select_related('category').prefetch_related(
+            models.Prefetch('shop', queryset=Shop.objects.select_related('owner').with_product_count()),
+            'images',
+        )
+
+
 class Product(models.Model):
     shop = models.ForeignKey(Shop, on_delete=models.CASCADE, related_name='products', null=True, blank=True)
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True, db_index=True, related_name='products')
@@ -135,6 +155,9 @@ class Product(models.Model):
     stock = models.IntegerField(default=1)
     
     image = models.CharField(max_length=500, blank=True, null=True)
+    # Denormalized URL of the first is_primary ProductImage, kept in sync by
+    # market.signals so cart/checkout payloads never query images per item.
+    primary_image = models.CharField(max_length=500, blank=True, null=True, db_index=True)
     video = models.URLField(max_length=500, blank=True, null=True) 
     video_ad_url = models.URLField(max_length=500, blank=True, null=True)
     is_ad = models.BooleanField(default=False)
@@ -143,6 +166,8 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProductQuerySet.as_manager()
+
     class Meta:
         indexes = [
             models.Index(fields=['category', 'price']),
@@ -153,6 +178,20 @@ class Product(models.Model):
     def __str__(self):
         return self.name
 
+    @classmethod
+    def refresh_primary_images(cls, product_ids=None):
+        """
+        Recomputes primary_image from ProductImage in a single UPDATE.
+        Pass product_ids to limit it to those rows; returns the number updated.
+        """
+        first_primary = ProductImage.objects.filter(
+            product_id=models.OuterRef('pk'), is_primary=True
+        ).order_by('id').values('image')[:1]
+        products = cls.objects.all()
+        if product_ids is not None:
+            products = products.filter(pk__in=product_ids)
+        return products.update(primary_image=models.Subquery(first_primary))
+
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
     # Change from ImageField to CharField to support full Cloudinary URLs
@@ -238,11 +277,19 @@ class Order(models.Model):
 
     order_number = models.PositiveIntegerField(null=True, blank=True)
 
+    # A checkout spanning several shops creates one Order per shop; they share
+    # this reference so the buyer can pay for (and track) them together.
+    checkout_reference = models.CharField(max_length=40, null=True, blank=True, db_index=True)
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ['buyer', 'order_number']
+        indexes = [
+            models.Index(fields=['buyer', '-created_at']),
+            models.Index(fields=['shop', '-created_at']),
+        ]
 
     def save(self, *args, **kwargs):
         if self.order_number is None:
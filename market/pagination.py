@@ -1,6 +1,13 @@
+import base64
+import binascii
 import math
+from datetime import datetime
+from django.db.models import Q, QuerySet
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class MarketPageNumberPagination(PageNumberPagination):
@@ -18,3 +25,82 @@ class MarketPageNumberPagination(PageNumberPagination):
             'previous': self.get_previous_link(),
             'results': data,
         })
+
+
+class CursorFeedPagination(MarketPageNumberPagination):
+    """
+    Page-number pagination with an opt-in keyset ("cursor") mode, for the
+    newest-first feeds (products, buyer/seller orders, transactions).
+
+    Clients that only scroll forward send ?paginate=cursor on the first
+    request and then follow the opaque `next` link. Cursor pages are keyed on
+    (created_at, id), newest first, so they skip the COUNT(*) and OFFSET
+    entirely and page 500 costs the same as page 1. Requests with ?search= or
+    ?ordering= keep page numbers: the keyset cannot express relevance or a
+    client-chosen order.
+    """
+    cursor_query_param = 'cursor'
+    mode_query_param = 'paginate'
+    cursor_ordering = ('-created_at', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_mode = self._wants_cursor(request) and isinstance(queryset, QuerySet)
+        if not self.cursor_mode:
+            return super().paginate_queryset(queryset, request, view)
+        return self._paginate_keyset(queryset, request)
+
+    def get_paginated_response(self, data):
+        if not getattr(self, 'cursor_mode', False):
+            return super().get_paginated_response(data)
+        return Response({
+            'page_size': self.cursor_page_size,
+            'next': self._next_cursor_link(),
+            'previous': None,
+            'results': data,
+        })
+
+    def _wants_cursor(self, request):
+        params = request.query_params
+        if params.get(api_settings.SEARCH_PARAM) or params.get(api_settings.ORDERING_PARAM):
+            return False
+        return params.get(self.mode_query_param) == 'cursor' or self.cursor_query_param in params
+
+    def _paginate_keyset(self, queryset, request):
+        self.request = request
+        self.cursor_page_size = self.get_page_size(request) or self.page_size
+
+        queryset = queryset.order_by(*self.cursor_ordering)
+        raw_cursor = request.query_params.get(self.cursor_query_param)
+        if raw_cursor:
+            created_at, pk = self.decode_cursor(raw_cursor)
+            queryset = queryset.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk)
+            )
+
+        # One extra row tells us whether there is a next page without a COUNT.
+        rows = list(queryset[:self.cursor_page_size + 1])
+        has_next = len(rows) > self.cursor_page_size
+        self.page_rows = rows[:self.cursor_page_size]
+        self.next_position = self.page_rows[-1] if has_next else None
+        return self.page_rows
+
+    def _next_cursor_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    @staticmethod
+    def encode_cursor(obj):
+        raw = f"{obj.created_at.isoformat()}|{obj.pk}"
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(value):
+        try:
+            padded = value + '=' * (-len(value) % 4)
+            created_at, pk = base64.urlsafe_b64decode(padded.encode()).decode().split('|', 1)
+            return datetime.fromisoformat(created_at), int(pk)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise NotFound("Invalid cursor.")
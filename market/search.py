@@ -0,0 +1,255 @@
+"""
+Full-text product search.
+
+ProductListView used to run DRF's SearchFilter over name/description/category,
+which is a LIKE '%term%' scan of the whole product table on every search.
+Products are now mirrored into a database-native full-text index (FTS5 on
+SQLite, a tsvector table on PostgreSQL) kept in sync by the Product/Category
+signals in market/signals.py, and searches are answered from that index with
+ranked, prefix-aware matching.
+
+The backend is picked from settings.MARKET_SEARCH_BACKEND (a dotted path) or,
+when unset, from the database vendor. IContainsSearchBackend keeps the old
+behaviour for databases without full-text support.
+"""
+import logging
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import IntegerField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+from rest_framework import filters
+from rest_framework.settings import api_settings
+
+logger = logging.getLogger(__name__)
+
+# Columns mirrored into the index, in the order the backends expect them.
+SEARCH_FIELDS = ('name', 'description', 'category__name')
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+_NO_RANK = Value(0, output_field=IntegerField())
+
+
+def _tokenize(terms):
+    tokens = []
+    for term in terms:
+        tokens.extend(_TOKEN_RE.findall(term.lower()))
+    return tokens
+
+
+def _document_rows(products):
+    """(id, name, description, category_name) tuples for a batch of products."""
+    return [
+        (
+            p.id,
+            p.name or '',
+            p.description or '',
+            p.category.name if p.category_id and p.category else '',
+        )
+        for p in products
+    ]
+
+
+class BaseSearchBackend:
+    """Interface every product search backend implements."""
+
+    def filter(self, queryset, terms):
+        """Restrict `queryset` to products matching every term, annotated with `search_rank` (lower is better)."""
+        raise NotImplementedError
+
+    def index(self, products):
+        """Insert or refresh the index entries for the given Product instances."""
+
+    def remove(self, product_ids):
+        """Drop the index entries for the given product ids."""
+
+    def rebuild(self, batch_size=1000):
+        """Re-index the whole catalog. Returns the number of products indexed."""
+        from .models import Product
+
+        self.clear()
+        count = 0
+        batch = []
+        products = Product.objects.select_related('category').only(
+            'id', 'name', 'description', 'category__name'
+        ).order_by('id')
+        for product in products.iterator(chunk_size=batch_size):
+            batch.append(product)
+            if len(batch) >= batch_size:
+                self.index(batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            self.index(batch)
+            count += len(batch)
+        return count
+
+    def clear(self):
+        """Empty the index."""
+
+
+class IContainsSearchBackend(BaseSearchBackend):
+    """Unindexed fallback: the same icontains match SearchFilter used to do."""
+
+    def filter(self, queryset, terms):
+        for term in terms:
+            condition = Q()
+            for field in SEARCH_FIELDS:
+                condition |= Q(**{f'{field}__icontains': term})
+            queryset = queryset.filter(condition)
+        return queryset.annotate(search_rank=_NO_RANK)
+
+
+class SQLiteFTSBackend(BaseSearchBackend):
+    """FTS5 virtual table whose rowid is the product id."""
+
+    table = 'market_product_fts'
+    # bm25 column weights: name, description, category_name
+    weights = (10.0, 1.0, 5.0)
+
+    def build_query(self, terms):
+        tokens = _tokenize(terms)
+        if not tokens:
+            return None
+        # Every token must match; the last one as a prefix so "iph" finds "iphone".
+        parts = [f'"{t}"' for t in tokens[:-1]] + [f'"{tokens[-1]}"*']
+        return ' '.join(parts)
+
+    def filter(self, queryset, terms):
+        match = self.build_query(terms)
+        if match is None:
+            return queryset.annotate(search_rank=_NO_RANK)
+        table = self.table
+        weights = ', '.join(str(w) for w in self.weights)
+        ids = RawSQL(f'SELECT rowid FROM {table} WHERE {table} MATCH %s', [match])
+        rank = RawSQL(
+            f'SELECT bm25({table}, {weights}) FROM {table} '
+            f'WHERE {table} MATCH %s AND rowid = "market_product"."id"',
+            [match],
+        )
+        return queryset.filter(id__in=ids).annotate(search_rank=rank)
+
+    def index(self, products):
+        rows = _document_rows(products)
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {self.table} WHERE rowid = %s', [(r[0],) for r in rows]
+            )
+            cursor.executemany(
+                f'INSERT INTO {self.table} (rowid, name, description, category_name) '
+                f'VALUES (%s, %s, %s, %s)',
+                rows,
+            )
+
+    def remove(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {self.table} WHERE rowid = %s', [(pk,) for pk in product_ids]
+            )
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """tsvector shadow table with a GIN index, one row per product."""
+
+    table = 'market_product_search'
+    config = 'simple'
+
+    def build_query(self, terms):
+        tokens = _tokenize(terms)
+        if not tokens:
+            return None
+        return ' & '.join(f'{t}:*' for t in tokens)
+
+    def filter(self, queryset, terms):
+        query = self.build_query(terms)
+        if query is None:
+            return queryset.annotate(search_rank=_NO_RANK)
+        table, config = self.table, self.config
+        ids = RawSQL(
+            f"SELECT product_id FROM {table} WHERE document @@ to_tsquery('{config}', %s)",
+            [query],
+        )
+        # Negated so that, as with bm25, a lower rank sorts first.
+        rank = RawSQL(
+            f"SELECT -ts_rank(document, to_tsquery('{config}', %s)) FROM {table} s "
+            f'WHERE s.product_id = "market_product"."id"',
+            [query],
+        )
+        return queryset.filter(id__in=ids).annotate(search_rank=rank)
+
+    def index(self, products):
+        rows = _document_rows(products)
+        if not rows:
+            return
+        config = self.config
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {self.table} (product_id, document) VALUES ('
+                f"%s, setweight(to_tsvector('{config}', %s), 'A') || "
+                f"setweight(to_tsvector('{config}', %s), 'C') || "
+                f"setweight(to_tsvector('{config}', %s), 'B')) "
+                f'ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document',
+                rows,
+            )
+
+    def remove(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {self.table} WHERE product_id = ANY(%s)', [list(product_ids)]
+            )
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE {self.table}')
+
+
+VENDOR_BACKENDS = {
+    'sqlite': SQLiteFTSBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+_backend = None
+
+
+def get_search_backend():
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'MARKET_SEARCH_BACKEND', None)
+        if path:
+            backend_class = import_string(path)
+        else:
+            backend_class = VENDOR_BACKENDS.get(connection.vendor, IContainsSearchBackend)
+        _backend = backend_class()
+    return _backend
+
+
+class ProductSearchFilter(filters.SearchFilter):
+    """Drop-in replacement for SearchFilter that answers from the full-text index."""
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        return get_search_backend().filter(queryset, terms)
+
+
+class RankedOrderingFilter(filters.OrderingFilter):
+    """
+    Uses search relevance as the default ordering while a search is active;
+    an explicit ?ordering= from the client still wins.
+    """
+
+    def get_default_ordering(self, view):
+        default = super().get_default_ordering(view)
+        request = getattr(view, 'request', None)
+        if request is not None and request.query_params.get(api_settings.SEARCH_PARAM, '').strip():
+            return ['search_rank'] + list(default or [])
+        return default
@@ -29,6 +29,10 @@ class ShopSerializer(serializers.ModelSerializer):
         ]
 
     def get_product_count(self, obj):
+        # Views annotate this via Shop.objects.with_product_count(); fall back for one-off instances.
+        annotated = getattr(obj, 'product_count', None)
+        if annotated is not None:
+            return annotated
         return obj.products.count()
 
 class ProductImageSerializer(serializers.ModelSerializer):
@@ -125,11 +129,8 @@ class CartItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'product', 'product_name', 'product_price', 'product_image', 'quantity']
 
     def get_product_image(self, obj):
-        first_image = obj.product.images.filter(is_primary=True).first()
-        if first_image:
-            # CHANGED: Return as string to avoid domain prepending
-            return str(first_image.image)
-        return None
+        # Denormalized on Product (see market.signals), so no per-item image query.
+        return obj.product.primary_image or None
 
 class CartSerializer(serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
@@ -161,8 +162,7 @@ class CartSyncItemSerializer(serializers.Serializer):
 
     def get_image(self, obj):
         product = obj.get('product') if isinstance(obj, dict) else obj.product
-        first_image = product.images.filter(is_primary=True).first()
-        return str(first_image.image) if first_image else None
+        return product.primary_image or None
 
     def get_stock_warning(self, obj):
         requested = obj.get('quantity', 0) if isinstance(obj, dict) else obj.quantity
@@ -196,11 +196,11 @@ class OrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = [
-            'id', 'order_number', 'buyer', 'shop', 'shop_name', 'items', 'total_price', 
+            'id', 'order_number', 'checkout_reference', 'buyer', 'shop', 'shop_name', 'items', 'total_price', 
             'delivery_status', 'payment_status', 
             'shipping_address_json', 'created_at'
         ]
-        read_only_fields = ['order_number', 'buyer', 'total_price', 'payment_status']
+        read_only_fields = ['order_number', 'checkout_reference', 'buyer', 'total_price', 'payment_status']
 
 
 class BuyerOrderSerializer(serializers.ModelSerializer):
@@ -220,7 +220,7 @@ class BuyerOrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = [
-            'id', 'order_number', 'shop', 'shop_name', 'shop_logo', 'items', 'total_price',
+            'id', 'order_number', 'checkout_reference', 'shop', 'shop_name', 'shop_logo', 'items', 'total_price',
             'delivery_status', 'payment_status',
             'shipping_address_json', 'seller_phone', 'created_at'
         ]
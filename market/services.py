@@ -0,0 +1,225 @@
+import uuid
+from collections import defaultdict
+from decimal import Decimal
+from django.db.models import F
+from django.utils import timezone
+
+from finance import ledger
+from finance.models import Transaction, Wallet
+from notifications import outbox
+from .models import Product, Order, OrderItem, Shop
+
+
+class StockReservationError(ValueError):
+    """Raised by StockReservation.reserve(); carries the per-item outcomes."""
+
+    def __init__(self, reservation):
+        self.reservation = reservation
+        super().__init__(reservation.message)
+
+
+class StockReservation:
+    """
+    Reserves stock for a set of checkout lines.
+
+    Every checkout path (CheckoutView, BuyNowView, CreateOrderView) goes through
+    this class so that they all lock rows the same way:
+
+    * check()   - one unlocked SELECT for an early answer before any writes.
+    * reserve() - must run inside transaction.atomic(). Locks every product in
+                  a single SELECT ... FOR UPDATE ordered by id, so overlapping
+                  carts always lock in the same order and cannot deadlock. It
+                  then decrements stock with a conditional UPDATE per product
+                  (WHERE stock >= qty), which also guards backends that ignore
+                  FOR UPDATE.
+    * create_orders(buyer, shipping_address) - splits the lines into one
+                  Order per shop and bulk-creates all OrderItems.
+
+    `outcomes` holds one dict per product (product_id, requested, available,
+    status). Failed lines keep the same shape, so clients can show every
+    problem line at once.
+    """
+    RESERVED = 'reserved'
+    OUT_OF_STOCK = 'out_of_stock'
+    NOT_FOUND = 'not_found'
+
+    def __init__(self, raw_items):
+        # Duplicate lines for the same product are merged so stock is checked
+        # against the combined quantity.
+        self.quantities = {}
+        for item in raw_items:
+            product_id = int(item['product_id'])
+            self.quantities[product_id] = self.quantities.get(product_id, 0) + int(item['quantity'])
+        self.products = {}
+        self.outcomes = []
+
+    # --- queries -----------------------------------------------------------
+
+    def check(self):
+        return self._evaluate(Product.objects.filter(id__in=list(self.quantities)))
+
+    def reserve(self):
+        locked = Product.objects.select_for_update().filter(id__in=list(self.quantities)).order_by('id')
+        if not self._evaluate(locked):
+            raise StockReservationError(self)
+
+        for product_id in sorted(self.quantities):
+            qty = self.quantities[product_id]
+            updated = Product.objects.filter(pk=product_id, stock__gte=qty).update(stock=F('stock') - qty)
+            if not updated:
+                self._mark_failed(product_id, self.OUT_OF_STOCK)
+                raise StockReservationError(self)
+            self.products[product_id].stock -= qty
+        # No catalog invalidation: cached listings refresh stock on every read.
+        return self
+
+    def create_orders(self, buyer, shipping_address):
+        """
+        Creates one pending Order per shop, all sharing a checkout_reference,
+        and writes every OrderItem in one bulk INSERT. Orders come back in the
+        order their shop first appears in the cart.
+        """
+        lines_by_shop = {}
+        for product, qty in self.lines:
+            lines_by_shop.setdefault(product.shop_id, []).append((product, qty))
+
+        checkout_reference = f"CHK-{uuid.uuid4().hex[:20].upper()}"
+        orders, items = [], []
+        for shop_id, lines in lines_by_shop.items():
+            order = Order.objects.create(
+                buyer=buyer,
+                shop_id=shop_id,
+                checkout_reference=checkout_reference,
+                total_price=sum((product.price * qty for product, qty in lines), Decimal('0.00')),
+                delivery_status=Order.DeliveryStatus.PENDING,
+                payment_status=Order.PaymentStatus.PENDING,
+                shipping_address_json=shipping_address,
+            )
+            orders.append(order)
+            items.extend(
+                OrderItem(order=order, product=product, quantity=qty, price_at_purchase=product.price)
+                for product, qty in lines
+            )
+        OrderItem.objects.bulk_create(items)
+        return orders
+
+    # --- results -----------------------------------------------------------
+
+    @property
+    def ok(self):
+        return all(o['status'] == self.RESERVED for o in self.outcomes)
+
+    @property
+    def failures(self):
+        return [o for o in self.outcomes if o['status'] != self.RESERVED]
+
+    @property
+    def lines(self):
+        """(product, quantity) pairs in the order the client sent them."""
+        return [(self.products[pid], qty) for pid, qty in self.quantities.items() if pid in self.products]
+
+    @property
+    def total_price(self):
+        return sum((product.price * qty for product, qty in self.lines), Decimal('0.00'))
+
+    @property
+    def message(self):
+        failure = next(iter(self.failures), None)
+        if failure is None:
+            return ""
+        if failure['status'] == self.NOT_FOUND:
+            return f"Product #{failure['product_id']} not found."
+        return f"Only {failure['available']} unit(s) of \"{failure['product_name']}\" are available."
+
+    # --- internals ---------------------------------------------------------
+
+    def _evaluate(self, products):
+        self.products = {p.id: p for p in products}
+        self.outcomes = []
+        for product_id, qty in self.quantities.items():
+            product = self.products.get(product_id)
+            if product is None:
+                status = self.NOT_FOUND
+            elif product.stock < qty:
+                status = self.OUT_OF_STOCK
+            else:
+                status = self.RESERVED
+            self.outcomes.append({
+                'product_id': product_id,
+                'product_name': product.name if product else None,
+                'requested': qty,
+                'available': product.stock if product else 0,
+                'status': status,
+            })
+        return self.ok
+
+    def _mark_failed(self, product_id, status):
+        available = Product.objects.filter(pk=product_id).values_list('stock', flat=True).first() or 0
+        for outcome in self.outcomes:
+            if outcome['product_id'] == product_id:
+                outcome.update(status=status, available=available)
+
+
+def pay_orders_from_wallet(user, orders, total_price):
+    """
+    Pays every Order of one checkout with a single buyer debit. Each Order
+    belongs to exactly one shop, so its total goes straight into that
+    shop owner's locked_balance. No wallet row is locked up front: the
+    buyer debit is conditional on the balance covering it (see
+    finance.ledger.apply); ValueError if it does not. Used by CheckoutView
+    and InternalWalletCheckoutView inside their transaction.
+    """
+    buyer_wallet, _ = Wallet.objects.get_or_create(
+        user=user, defaults={'available_balance': Decimal('0.00')}
+    )
+
+    shops = Shop.objects.in_bulk({o.shop_id for o in orders})
+    orders_by_owner = defaultdict(list)
+    for order in orders:
+        order.shop = shops[order.shop_id]
+        orders_by_owner[order.shop.owner_id].append(order)
+
+    seller_transactions = []
+    legs = [(ledger.available(buyer_wallet), -total_price)]
+    for owner_id in sorted(orders_by_owner):
+        seller_wallet, _ = Wallet.objects.get_or_create(
+            user_id=owner_id, defaults={'available_balance': Decimal('0.00')}
+        )
+        legs.append((ledger.locked(seller_wallet), sum(o.total_price for o in orders_by_owner[owner_id])))
+        seller_transactions.extend(
+            Transaction(
+                wallet=seller_wallet,
+                amount=order.total_price,
+                transaction_type=Transaction.TransactionType.PAYMENT,
+                status=Transaction.Status.SUCCESS,
+                related_order_id=str(order.id),
+                description=f"Sales earnings (locked) for Order #{order.order_number or order.id}"
+            )
+            for order in orders_by_owner[owner_id]
+        )
+
+    if len(orders) == 1:
+        related_id, label = str(orders[0].id), f"Order #{orders[0].order_number or orders[0].id}"
+    else:
+        related_id, label = orders[0].checkout_reference, f"Checkout {orders[0].checkout_reference}"
+    try:
+        ledger.post(ledger.Kind.PAYMENT, legs, f"Payment for {label}", orders[0].checkout_reference)
+    except ledger.InsufficientFunds:
+        raise ValueError("Insufficient wallet balance.")
+    Transaction.objects.bulk_create(seller_transactions)
+    Transaction.objects.create(
+        wallet=buyer_wallet,
+        amount=-total_price,
+        transaction_type=Transaction.TransactionType.PAYMENT,
+        status=Transaction.Status.SUCCESS,
+        related_order_id=related_id,
+        description=f"Payment for {label}"
+    )
+
+    Order.objects.filter(pk__in=[o.pk for o in orders]).update(
+        payment_status=Order.PaymentStatus.PAID, updated_at=timezone.now()
+    )
+    # The buyer is looking at the confirmation already; only sellers need a push.
+    outbox.orders_paid(orders, notify_buyer=False)
+    for order in orders:
+        order.payment_status = Order.PaymentStatus.PAID
@@ -1 +1,77 @@
-# Signal file kept empty — rider/delivery code flow removed
\ No newline at end of file
+import logging
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+from .models import Category, Product, ProductImage
+from .catalog import bump_categories
+from .search import get_search_backend
+
+logger = logging.getLogger(__name__)
+
+# Rider/delivery code flow removed — these signals only keep derived product
+# data (the full-text search index, primary_image, catalog cache generations)
+# in step with the Product table.
+
+
+@receiver(post_save, sender=Product)
+def index_product_for_search(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    get_search_backend().index([instance])
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_search(sender, instance, **kwargs):
+    get_search_backend().remove([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created, raw=False, **kwargs):
+    # A renamed category changes the category_name column of every product in it.
+    if created or raw:
+        return
+    products = list(instance.products.select_related('category'))
+    if products:
+        get_search_backend().index(products)
+
+
+@receiver(pre_delete, sender=Category)
+def remember_category_products(sender, instance, **kwargs):
+    instance._product_ids = list(instance.products.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Category)
+def reindex_uncategorised_products(sender, instance, **kwargs):
+    # Deleting a category SET_NULLs its products with a bulk update that
+    # sends no signals, so their index rows would keep the old name.
+    product_ids = getattr(instance, '_product_ids', None)
+    if product_ids:
+        get_search_backend().index(list(Product.objects.filter(pk__in=product_ids).select_related('category')))
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def refresh_product_primary_image(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    Product.refresh_primary_images([instance.product_id])
+    category_id = Product.objects.filter(pk=instance.product_id).values_list('category_id', flat=True).first()
+    bump_categories([category_id])
+
+
+@receiver(pre_save, sender=Product)
+def remember_previous_category(sender, instance, raw=False, **kwargs):
+    # A product moved between categories must drop out of the old listing too.
+    if raw or instance.pk is None:
+        instance._previous_category_id = None
+        return
+    instance._previous_category_id = (
+        Product.objects.filter(pk=instance.pk).values_list('category_id', flat=True).first()
+    )
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_catalog(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    bump_categories([instance.category_id, getattr(instance, '_previous_category_id', None)])
@@ -1,3 +1,509 @@
+import base64
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection, transaction
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from .models import Category, Shop, Product, ProductImage, Order, OrderItem, Cart, CartItem
+from finance.models import Wallet, Transaction
+from finance.testing import FakeMonnifyMixin
+from .pagination import CursorFeedPagination
+from .search import get_search_backend
+from .services import StockReservation, StockReservationError
+
+User = get_user_model()
+
+
+class MarketTestMixin:
+    def make_seller(self, email="seller@example.com", shop_name="Test Shop"):
+        seller = User.objects.create_user(email=email, password="password123", full_name="Seller")
+        shop = Shop.objects.create(owner=seller, name=shop_name, is_active=True)
+        return seller, shop
+
+    def make_product(self, shop, name, description="", category=None, price="1000.00", stock=10):
+        return Product.objects.create(
+            shop=shop, name=name, description=description, category=category,
+            price=Decimal(price), stock=stock,
+        )
+
+
+class ProductSearchTests(MarketTestMixin, TestCase):
+    def setUp(self):
+        caches['catalog'].clear()
+        self.client = APIClient()
+        _, self.shop = self.make_seller()
+        self.phones = Category.objects.create(name="Phones", slug="phones")
+        self.iphone = self.make_product(self.shop, "iPhone 13", "Apple smartphone", self.phones)
+        self.case = self.make_product(self.shop, "Leather case", "Fits the iphone 13 perfectly")
+        self.kettle = self.make_product(self.shop, "Electric kettle", "1.7L steel kettle")
+
+    def search(self, term, **params):
+        caches['catalog'].clear()
+        response = self.client.get(reverse('product-list'), {'search': term, **params})
+        self.assertEqual(response.status_code, 200)
+        return [p['id'] for p in response.json()['results']]
+
+    def test_prefix_match(self):
+        self.assertEqual(set(self.search("iph")), {self.iphone.id, self.case.id})
+
+    def test_name_match_ranks_above_description_match(self):
+        self.assertEqual(self.search("iphone"), [self.iphone.id, self.case.id])
+
+    def test_all_terms_must_match(self):
+        self.assertEqual(self.search("steel kettle"), [self.kettle.id])
+
+    def test_matches_category_name(self):
+        self.assertEqual(self.search("phones"), [self.iphone.id])
+
+    def test_explicit_ordering_overrides_rank(self):
+        self.assertEqual(self.search("iphone", ordering="name"), [self.case.id, self.iphone.id])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.kettle.name = "Cordless toaster"
+        self.kettle.save()
+        self.assertEqual(self.search("toaster"), [self.kettle.id])
+        self.kettle.delete()
+        self.assertEqual(self.search("toaster"), [])
+
+    def test_category_rename_reindexes_products(self):
+        self.phones.name = "Mobiles"
+        self.phones.save()
+        self.assertEqual(self.search("mobiles"), [self.iphone.id])
+
+    def test_category_delete_reindexes_products(self):
+        self.phones.delete()
+        self.assertEqual(self.search("phones"), [])
+        self.assertEqual(self.search("iphone"), [self.iphone.id, self.case.id])
+
+    def test_rebuild_command(self):
+        get_search_backend().clear()
+        self.assertEqual(self.search("kettle"), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.search("kettle"), [self.kettle.id])
+
+
+class CursorPaginationTests(MarketTestMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        _, self.shop = self.make_seller()
+        self.buyer = User.objects.create_user(email="buyer@example.com", password="password123", full_name="Buyer")
+        self.orders = [
+            Order.objects.create(buyer=self.buyer, shop=self.shop, total_price=Decimal('100.00'))
+            for _ in range(5)
+        ]
+        self.client.force_authenticate(user=self.buyer)
+
+    def test_walks_every_order_newest_first_without_count(self):
+        url = reverse('buyer-orders') + '?paginate=cursor&page_size=2'
+        seen = []
+        while url:
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            self.assertNotIn('count', body)
+            self.assertFalse(any('COUNT(' in q['sql'].upper() for q in ctx.captured_queries))
+            seen.extend(o['id'] for o in body['results'])
+            url = body['next']
+        self.assertEqual(seen, [o.id for o in reversed(self.orders)])
+
+    def test_page_number_mode_is_unchanged(self):
+        response = self.client.get(reverse('buyer-orders'), {'page_size': 2})
+        body = response.json()
+        self.assertEqual(body['count'], 5)
+        self.assertEqual(body['total_pages'], 3)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('buyer-orders'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_with_non_numeric_id(self):
+        cursor = CursorFeedPagination.encode_cursor(self.orders[0])
+        forged = base64.urlsafe_b64encode(f"{self.orders[0].created_at.isoformat()}|abc".encode()).decode()
+        self.assertEqual(self.client.get(reverse('buyer-orders'), {'cursor': cursor}).status_code, 200)
+        self.assertEqual(self.client.get(reverse('buyer-orders'), {'cursor': forged}).status_code, 404)
+
+    def test_other_lists_ignore_cursor_mode(self):
+        Category.objects.create(name="Phones", slug="phones")
+        response = self.client.get(reverse('category-list'), {'paginate': 'cursor'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 1)
+
+    def test_search_and_ordering_keep_page_numbers(self):
+        caches['catalog'].clear()
+        self.make_product(self.shop, "Cheap", price="10.00")
+        self.make_product(self.shop, "Dear", price="90.00")
+        response = self.client.get(reverse('product-list'), {'paginate': 'cursor', 'ordering': 'price'})
+        body = response.json()
+        self.assertEqual(body['count'], 2)
+        self.assertEqual([p['name'] for p in body['results']], ["Cheap", "Dear"])
+
+
+class ListQueryCountTests(MarketTestMixin, TestCase):
+    """Listing endpoints must cost the same number of queries at any page size."""
+
+    def setUp(self):
+        caches['catalog'].clear()
+        self.client = APIClient()
+        self.sellers = []
+        for i in range(4):
+            seller, shop = self.make_seller(email=f"seller{i}@example.com", shop_name=f"Shop {i}")
+            self.sellers.append(seller)
+            for j in range(3):
+                product = self.make_product(shop, f"Product {i}-{j}")
+                ProductImage.objects.create(product=product, image=f"https://img.example.com/{i}-{j}.jpg", is_primary=True)
+
+    def assertConstantQueries(self, url, num, authenticate=None):
+        self.client.force_authenticate(user=authenticate)
+        for page_size in (2, 12):
+            caches['catalog'].clear()
+            with self.assertNumQueries(num):
+                response = self.client.get(url, {'page_size': page_size})
+            self.assertEqual(response.status_code, 200)
+
+    def test_product_list(self):
+        # COUNT, products + category, shops + owner + product_count, images
+        self.assertConstantQueries(reverse('product-list'), 4)
+
+    def test_shop_list(self):
+        # COUNT, shops + owner + product_count
+        self.assertConstantQueries(reverse('shop-list'), 2)
+
+    def test_seller_product_list(self):
+        self.assertConstantQueries(reverse('seller-products'), 4, authenticate=self.sellers[0])
+
+    def test_product_count_is_annotated(self):
+        response = self.client.get(reverse('shop-list'))
+        self.assertEqual({s['product_count'] for s in response.json()['results']}, {3})
+
+
+class PrimaryImageTests(MarketTestMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        _, self.shop = self.make_seller()
+        self.buyer = User.objects.create_user(email="buyer@example.com", password="password123", full_name="Buyer")
+        self.client.force_authenticate(user=self.buyer)
+        self.product = self.make_product(self.shop, "Sneakers")
+
+    def primary_image(self):
+        self.product.refresh_from_db(fields=['primary_image'])
+        return self.product.primary_image
+
+    def test_follows_product_image_changes(self):
+        ProductImage.objects.create(product=self.product, image="https://img.example.com/side.jpg")
+        self.assertIsNone(self.primary_image())
+        front = ProductImage.objects.create(product=self.product, image="https://img.example.com/front.jpg", is_primary=True)
+        self.assertEqual(self.primary_image(), "https://img.example.com/front.jpg")
+        front.image = "https://img.example.com/front-v2.jpg"
+        front.save()
+        self.assertEqual(self.primary_image(), "https://img.example.com/front-v2.jpg")
+        front.delete()
+        self.assertIsNone(self.primary_image())
+
+    def test_backfill_command(self):
+        ProductImage.objects.create(product=self.product, image="https://img.example.com/front.jpg", is_primary=True)
+        Product.objects.update(primary_image=None)
+        call_command('backfill_primary_images', stdout=StringIO())
+        self.assertEqual(self.primary_image(), "https://img.example.com/front.jpg")
+
+    def test_cart_payloads_do_not_query_images(self):
+        cart = Cart.objects.create(user=self.buyer)
+        for i in range(5):
+            product = self.make_product(self.shop, f"Item {i}")
+            ProductImage.objects.create(product=product, image=f"https://img.example.com/{i}.jpg", is_primary=True)
+            CartItem.objects.create(cart=cart, product=product, quantity=1)
+
+        for name in ('cart', 'checkout-summary'):
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(reverse(name))
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(any('market_productimage' in q['sql'] for q in ctx.captured_queries))
+
+        response = self.client.get(reverse('checkout-summary'))
+        self.assertEqual(
+            [item['image'] for item in response.json()['items']],
+            [f"https://img.example.com/{i}.jpg" for i in range(5)],
+        )
+
+
+class StockReservationTests(MarketTestMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        _, self.shop = self.make_seller()
+        self.buyer = User.objects.create_user(email="buyer@example.com", password="password123", full_name="Buyer")
+        self.client.force_authenticate(user=self.buyer)
+        self.shirt = self.make_product(self.shop, "Shirt", price="2000.00", stock=5)
+        self.cap = self.make_product(self.shop, "Cap", price="500.00", stock=1)
+
+    def stock(self, product):
+        product.refresh_from_db(fields=['stock'])
+        return product.stock
+
+    def test_checkout_reserves_stock_and_bulk_creates_items(self):
+        response = self.client.post(reverse('checkout'), {'items': [
+            {'product_id': self.cap.id, 'quantity': 1},
+            {'product_id': self.shirt.id, 'quantity': 2},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['amount_to_pay'], '4500.00')
+        self.assertEqual((self.stock(self.shirt), self.stock(self.cap)), (3, 0))
+        self.assertEqual(OrderItem.objects.filter(order_id=response.json()['order_id']).count(), 2)
+
+    def test_out_of_stock_reports_every_line_and_writes_nothing(self):
+        response = self.client.post(reverse('create-order'), {'items': [
+            {'product_id': self.shirt.id, 'quantity': 1},
+            {'product_id': self.cap.id, 'quantity': 1},
+            {'product_id': self.cap.id, 'quantity': 1},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        body = response.json()
+        self.assertEqual(body['status'], 'out_of_stock')
+        self.assertEqual(body['product_id'], self.cap.id)
+        self.assertEqual(
+            [(o['product_id'], o['requested'], o['status']) for o in body['items']],
+            [(self.shirt.id, 1, 'reserved'), (self.cap.id, 2, 'out_of_stock')],
+        )
+        self.assertEqual((self.stock(self.shirt), self.stock(self.cap)), (5, 1))
+        self.assertFalse(Order.objects.exists())
+
+    def test_malformed_items_are_400(self):
+        for items in ([{'product_id': self.shirt.id}], [{'product_id': 'abc', 'quantity': 1}], 'shirt'):
+            response = self.client.post(reverse('create-order'), {'items': items}, format='json')
+            self.assertEqual(response.status_code, 400, items)
+            self.assertIn('errors', response.json())
+        self.assertFalse(Order.objects.exists())
+
+    def test_missing_product_is_404(self):
+        response = self.client.post(reverse('buy-now'), {'product_id': 999999, 'quantity': 1}, format='json')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()['items'][0]['status'], 'not_found')
+
+    def test_conditional_update_catches_stock_sold_after_the_lock_read(self):
+        reservation = StockReservation([{'product_id': self.cap.id, 'quantity': 1}])
+        original = Product.objects.filter
+
+        def filter_then_sell_out(*args, **kwargs):
+            # Simulates a competing writer between the locked read and the UPDATE.
+            if kwargs.get('stock__gte'):
+                Product.objects.filter(pk=self.cap.pk).update(stock=0)
+            return original(*args, **kwargs)
+
+        with transaction.atomic():
+            with patch.object(Product.objects, 'filter', side_effect=filter_then_sell_out):
+                with self.assertRaises(StockReservationError):
+                    reservation.reserve()
+        self.assertEqual(reservation.failures[0]['status'], StockReservation.OUT_OF_STOCK)
+
+
+class SplitCheckoutTests(MarketTestMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.seller_a, shop_a = self.make_seller("a@example.com", "Shop A")
+        self.seller_b, shop_b = self.make_seller("b@example.com", "Shop B")
+        self.buyer = User.objects.create_user(email="buyer@example.com", password="password123", full_name="Buyer")
+        Wallet.objects.filter(user=self.buyer).update(available_balance=Decimal('10000.00'))
+        self.client.force_authenticate(user=self.buyer)
+        self.items = [
+            {'product_id': self.make_product(shop_a, "Shoe", price="1000.00").id, 'quantity': 2},
+            {'product_id': self.make_product(shop_b, "Bag", price="3000.00").id, 'quantity': 1},
+            {'product_id': self.make_product(shop_a, "Sock", price="500.00").id, 'quantity': 1},
+        ]
+
+    def locked_balance(self, user):
+        return Wallet.objects.get(user=user).locked_balance
+
+    def test_wallet_checkout_creates_one_order_per_shop_with_one_debit(self):
+        response = self.client.post(reverse('checkout'), {'items': self.items, 'payment_method': 'wallet'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        reference = response.json()['checkout_reference']
+
+        orders = Order.objects.filter(checkout_reference=reference).order_by('id')
+        self.assertEqual([(o.shop.owner, o.total_price, o.items.count()) for o in orders], [
+            (self.seller_a, Decimal('2500.00'), 2),
+            (self.seller_b, Decimal('3000.00'), 1),
+        ])
+        self.assertTrue(all(o.payment_status == Order.PaymentStatus.PAID for o in orders))
+
+        buyer_wallet = Wallet.objects.get(user=self.buyer)
+        self.assertEqual(buyer_wallet.available_balance, Decimal('4500.00'))
+        self.assertEqual(buyer_wallet.transactions.count(), 1)
+        self.assertEqual((self.locked_balance(self.seller_a), self.locked_balance(self.seller_b)),
+                         (Decimal('2500.00'), Decimal('3000.00')))
+
+    def test_seller_sees_only_their_shop_order(self):
+        self.client.post(reverse('checkout'), {'items': self.items}, format='json')
+        self.client.force_authenticate(user=self.seller_b)
+        results = self.client.get(reverse('seller-orders')).json()['results']
+        self.assertEqual([r['total_price'] for r in results], ['3000.00'])
+
+    def test_pay_split_checkout_by_reference(self):
+        reference = self.client.post(reverse('create-order'), {'items': self.items}, format='json').json()['checkout_reference']
+        response = self.client.post(reverse('wallet-pay'), {'checkout_reference': reference}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['amount_paid'], '5500.00')
+        self.assertEqual(Transaction.objects.filter(wallet__user=self.buyer).count(), 1)
+        self.assertEqual(self.locked_balance(self.seller_b), Decimal('3000.00'))
+
+
+class CatalogCacheTests(MarketTestMixin, TestCase):
+    def setUp(self):
+        caches['catalog'].clear()
+        self.client = APIClient()
+        self.seller, self.shop = self.make_seller()
+        self.phones = Category.objects.create(name="Phones", slug="phones")
+        self.shoes = Category.objects.create(name="Shoes", slug="shoes")
+        self.phone = self.make_product(self.shop, "Phone", category=self.phones, price="50000.00")
+        self.shoe = self.make_product(self.shop, "Shoe", category=self.shoes, price="8000.00")
+
+    # A cache hit still reads live stock with one primary-key query.
+    HIT = 1
+
+    def prices(self, **params):
+        response = self.client.get(reverse('product-list'), params)
+        self.assertEqual(response.status_code, 200)
+        return {p['id']: p['price'] for p in response.json()['results']}
+
+    def test_shared_across_users_and_normalized(self):
+        self.prices(search="Phone")
+        self.client.force_authenticate(user=self.seller)
+        with self.assertNumQueries(self.HIT):
+            self.prices(search="  phone ", utm_source="ad")
+
+    def test_entries_live_in_catalog_alias(self):
+        self.prices()
+        caches['default'].clear()
+        with self.assertNumQueries(self.HIT):
+            self.prices()
+
+    def test_category_filter_by_id_or_slug(self):
+        self.assertEqual(set(self.prices(category=self.phones.id)), {self.phone.id})
+        self.assertEqual(set(self.prices(category="shoes")), {self.shoe.id})
+
+    def test_product_update_is_visible_immediately(self):
+        self.prices()
+        self.client.force_authenticate(user=self.seller)
+        response = self.client.patch(reverse('product-update', args=[self.phone.id]), {'price': '45000.00'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.prices()[self.phone.id], '45000.00')
+
+    def test_edit_only_invalidates_affected_categories(self):
+        self.prices(category="shoes")
+        self.prices(category="phones")
+        self.phone.price = Decimal('1.00')
+        self.phone.save()
+        with self.assertNumQueries(self.HIT):
+            self.prices(category="shoes")
+        self.assertEqual(self.prices(category="phones")[self.phone.id], '1.00')
+
+    def test_moving_category_drops_product_from_old_listing(self):
+        self.prices(category="phones")
+        self.phone.category = self.shoes
+        self.phone.save()
+        self.assertEqual(self.prices(category="phones"), {})
+
+    def test_delete_invalidates(self):
+        self.prices()
+        self.shoe.delete()
+        self.assertEqual(set(self.prices()), {self.phone.id})
+
+    def test_checkout_keeps_cache_and_shows_live_stock(self):
+        self.prices()
+        self.prices(category="phones")
+        buyer = User.objects.create_user(email="buyer@example.com", password="password123", full_name="Buyer")
+        self.client.force_authenticate(user=buyer)
+        response = self.client.post(reverse('checkout'), {'items': [{'product_id': self.phone.id, 'quantity': 3}]}, format='json')
+        self.assertEqual(response.status_code, 201)
+        for params in ({}, {'category': 'phones'}):
+            with self.assertNumQueries(self.HIT):
+                results = self.client.get(reverse('product-list'), params).json()['results']
+            self.assertEqual({p['id']: p['stock'] for p in results}[self.phone.id], 7)
+
+
+class MerchantWithdrawalTests(FakeMonnifyMixin, MarketTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.seller, self.shop = self.make_seller()
+        self.seller.set_transaction_pin("1234")
+        self.seller.save()
+        Wallet.objects.filter(user=self.seller).update(available_balance=Decimal('5000.00'))
+        self.client.force_authenticate(user=self.seller)
+        self.monnify_server.respond('POST', '/api/v2/disbursements/single', {'requestSuccessful': True, 'responseBody': {}})
+
+    def withdraw(self, amount):
+        return self.client.post(reverse('merchant-withdraw'), {
+            'amount': amount, 'bank_code': '058', 'account_number': '0123456789', 'transaction_pin': '1234',
+        }, format='json')
+
+    def test_withdrawals_reuse_the_cached_monnify_token(self):
+        self.assertEqual(self.withdraw('1000.00').status_code, 200)
+        self.assertEqual(self.withdraw('500.00').status_code, 200)
+
+        self.assertEqual(self.monnify_server.logins, 1)
+        payouts = self.monnify_server.calls('POST', '/api/v2/disbursements/single')
+        self.assertEqual([call[3]['amount'] for call in payouts], [1000.0, 500.0])
+        self.assertEqual(Wallet.objects.get(user=self.seller).available_balance, Decimal('3500.00'))
+
+    def test_auth_failure_is_a_bad_gateway(self):
+        self.monnify_server.reject_logins = True
+
+        response = self.withdraw('1000.00')
+
+        self.assertEqual(response.status_code, 502)
+        self.assertFalse(self.monnify_server.calls('POST', '/api/v2/disbursements/single'))
+
+
+class IdempotentCheckoutTests(MarketTestMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        _, shop = self.make_seller()
+        self.buyer = User.objects.create_user(email="buyer@example.com", password="password123", full_name="Buyer")
+        Wallet.objects.filter(user=self.buyer).update(available_balance=Decimal('10000.00'))
+        self.client.force_authenticate(user=self.buyer)
+        self.items = [{'product_id': self.make_product(shop, "Shoe", price="1000.00").id, 'quantity': 2}]
+
+    def checkout(self, key, items=None):
+        return self.client.post(
+            reverse('checkout'), {'items': items or self.items, 'payment_method': 'wallet'},
+            format='json', HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def test_retry_replays_the_first_response_without_charging_again(self):
+        first = self.checkout('checkout-1')
+        with CaptureQueriesContext(connection) as ctx:
+            retry = self.checkout('checkout-1')
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual((retry.status_code, retry.json()), (201, first.json()))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.filter(buyer=self.buyer).count(), 1)
+        self.assertEqual(Wallet.objects.get(user=self.buyer).available_balance, Decimal('8000.00'))
+        # Auth is forced, so the replay is the key lookup alone.
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+    def test_reusing_a_key_for_a_different_body_is_rejected(self):
+        self.checkout('checkout-1')
+        response = self.checkout('checkout-1', items=[{**self.items[0], 'quantity': 3}])
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Order.objects.filter(buyer=self.buyer).count(), 1)
+
+    def test_requests_without_a_key_are_not_deduplicated(self):
+        self.client.post(reverse('checkout'), {'items': self.items, 'payment_method': 'wallet'}, format='json')
+        self.client.post(reverse('checkout'), {'items': self.items, 'payment_method': 'wallet'}, format='json')
+
+        self.assertEqual(Order.objects.filter(buyer=self.buyer).count(), 2)
+
+    def test_server_errors_release_the_key(self):
+        with patch('market.views.pay_orders_from_wallet', side_effect=RuntimeError):
+            self.assertEqual(self.checkout('checkout-1').status_code, 500)
+
+        self.assertEqual(self.checkout('checkout-1').status_code, 201)
+        self.assertEqual(Order.objects.filter(buyer=self.buyer).count(), 1)
@@ -1,4 +1,3 @@
-import base64
 import uuid as uuid_lib
 import logging
 from decimal import Decimal
@@ -6,7 +5,7 @@ from collections import defaultdict
 from django.shortcuts import get_object_or_404
 from django.conf import settings
 from django.db import transaction, models
-from django.db.models import Q, Sum
+from django.db.models import Prefetch, Q, Sum, prefetch_related_objects
 from rest_framework import generics, permissions, status, filters
 from rest_framework.response import Response
 from rest_framework.views import APIView
@@ -14,8 +13,7 @@ from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework import serializers 
 from django.contrib.auth import get_user_model
 from django.utils import timezone
-from django.views.decorators.cache import cache_page
-from django.views.decorators.vary import vary_on_headers
+from django.core.cache import caches
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from rest_framework_simplejwt.authentication import JWTAuthentication
@@ -39,11 +37,19 @@ from .serializers import (
     OrderSerializer, BuyerOrderSerializer, SellerOrderSerializer,
     CartSerializer, CartSyncInputSerializer,
     CartSyncItemSerializer, CartSyncResponseSerializer,
-    CheckoutInputSerializer, BuyNowInputSerializer,
+    CheckoutItemSerializer, CheckoutInputSerializer, BuyNowInputSerializer,
     PromotedPostSerializer, PromotedPostCreateSerializer,
 )
+from .catalog import CatalogCacheMixin
+from .pagination import CursorFeedPagination
+from .search import ProductSearchFilter, RankedOrderingFilter
+from .services import StockReservation, StockReservationError, pay_orders_from_wallet
 from finance.models import Wallet, Transaction, PlatformRevenue
+from finance import ledger
+from finance.monnify import MonnifyError, monnify
+from finance.idempotency import idempotent
 from finance.utils import WalletManager
+from notifications import outbox
 
 
 # --- SELLER / STORE VIEWS ---
@@ -291,7 +297,7 @@ class SellerProductListView(generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return Product.objects.filter(shop__owner=self.request.user).order_by('-created_at')
+        return Product.objects.filter(shop__owner=self.request.user).for_listing().order_by('-created_at')
 
 class ProductCreateView(APIView):
     permission_classes = [permissions.IsAuthenticated]
@@ -340,19 +346,26 @@ class CategoryListView(generics.ListAPIView):
     serializer_class = CategorySerializer
     permission_classes = [permissions.AllowAny]
 
-@method_decorator(cache_page(300), name='dispatch')
-@method_decorator(vary_on_headers('Authorization'), name='dispatch')
-class ProductListView(generics.ListAPIView):
-    queryset = Product.objects.select_related('shop', 'category').prefetch_related('images')
+class ProductListView(CatalogCacheMixin, generics.ListAPIView):
     serializer_class = ProductSerializer
     permission_classes = [AllowAny]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
-    search_fields = ['name', 'description', 'category__name']
+    pagination_class = CursorFeedPagination
+    # ?search= is answered from the full-text index (see market/search.py) and,
+    # unless ?ordering= is given, results come back in relevance order.
+    filter_backends = [ProductSearchFilter, RankedOrderingFilter]
     ordering_fields = ['price', '-price', 'created_at', '-created_at', 'name']
     ordering = ['-created_at']
 
+    def get_queryset(self):
+        queryset = Product.objects.for_listing()
+        category = self.request.query_params.get('category')
+        if category:
+            lookup = {'category_id': category} if category.isdigit() else {'category__slug': category}
+            queryset = queryset.filter(**lookup)
+        return queryset
+
 class ProductDetailView(generics.RetrieveAPIView):
-    queryset = Product.objects.all()
+    queryset = Product.objects.for_listing()
     serializer_class = ProductSerializer
     permission_classes = [permissions.AllowAny]
 
@@ -399,7 +412,7 @@ class CheckoutSummaryView(APIView):
                 "quantity": item.quantity,
                 "unit_price": str(product.price),
                 "subtotal": str(product.price * item.quantity),
-                "image": str(product.images.filter(is_primary=True).first().image) if product.images.filter(is_primary=True).first() else None,
+                "image": product.primary_image or None,
                 "stock_available": product.stock,
                 "shop_name": product.shop.name if product.shop else None,
             })
@@ -414,9 +427,29 @@ class CheckoutSummaryView(APIView):
         })
 
 
+def stock_reservation_error_response(reservation):
+    """Maps a failed StockReservation onto the checkout error payloads."""
+    failure = reservation.failures[0]
+    if failure['status'] == StockReservation.NOT_FOUND:
+        return Response({
+            "status": "error",
+            "message": reservation.message,
+            "items": reservation.outcomes,
+        }, status=status.HTTP_404_NOT_FOUND)
+    return Response({
+        "status": "out_of_stock",
+        "product_id": failure['product_id'],
+        "product_name": failure['product_name'],
+        "available_stock": failure['available'],
+        "message": reservation.message,
+        "items": reservation.outcomes,
+    }, status=status.HTTP_400_BAD_REQUEST)
+
+
 class CheckoutView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    @idempotent
     def post(self, request):
         serializer = CheckoutInputSerializer(data=request.data)
         if not serializer.is_valid():
@@ -450,34 +483,12 @@ class CheckoutView(APIView):
         return self._process_checkout(request.user, raw_items, payment_method, shipping_address)
 
     def _process_checkout(self, user, raw_items, payment_method, shipping_address):
-        total_price = Decimal('0.00')
-        order_items_data = []
-        shop = None
-
-        # Pre-validate stock before any DB writes
-        for item in raw_items:
-            try:
-                product = Product.objects.get(id=item['product_id'])
-            except Product.DoesNotExist:
-                return Response({
-                    "status": "error",
-                    "message": f"Product #{item['product_id']} not found."
-                }, status=status.HTTP_404_NOT_FOUND)
+        reservation = StockReservation(raw_items)
 
-            qty = int(item['quantity'])
-            if product.stock < qty:
-                return Response({
-                    "status": "out_of_stock",
-                    "product_id": product.id,
-                    "product_name": product.name,
-                    "available_stock": product.stock,
-                    "message": f"Only {product.stock} unit(s) of \"{product.name}\" are available."
-                }, status=status.HTTP_400_BAD_REQUEST)
-
-            total_price += product.price * qty
-            order_items_data.append((product, qty))
-            if not shop:
-                shop = product.shop
+        # Pre-validate stock with one unlocked query before any DB writes
+        if not reservation.check():
+            return stock_reservation_error_response(reservation)
+        total_price = reservation.total_price
 
         # Pre-validate wallet balance if paying via wallet
         if payment_method == 'wallet':
@@ -493,48 +504,35 @@ class CheckoutView(APIView):
         # All validations passed — execute the transaction
         try:
             with transaction.atomic():
-                order = Order.objects.create(
-                    buyer=user,
-                    shop=shop,
-                    total_price=total_price,
-                    delivery_status=Order.DeliveryStatus.PENDING,
-                    payment_status=Order.PaymentStatus.PENDING,
-                    shipping_address_json=shipping_address
-                )
-
-                for product, qty in order_items_data:
-                    product = Product.objects.select_for_update().get(id=product.id)
-                    if product.stock < qty:
-                        raise ValueError(f"Stock changed for {product.name}")
-                    OrderItem.objects.create(
-                        order=order,
-                        product=product,
-                        quantity=qty,
-                        price_at_purchase=product.price
-                    )
-                    product.stock -= qty
-                    product.save()
+                reservation.reserve()
+                total_price = reservation.total_price
+                orders = reservation.create_orders(user, shipping_address)
+                order = orders[0]
 
                 if payment_method == 'wallet':
-                    self._process_wallet_payment(user, order, total_price)
+                    pay_orders_from_wallet(user, orders, total_price)
 
-                    order_serializer = OrderSerializer(order)
                     return Response({
                         "status": "success",
                         "message": "Order placed and paid successfully.",
                         "payment_method": "wallet",
-                        "order": order_serializer.data
+                        "checkout_reference": order.checkout_reference,
+                        "order": OrderSerializer(order).data,
+                        "orders": OrderSerializer(orders, many=True).data,
                     }, status=status.HTTP_201_CREATED)
 
-                order_serializer = OrderSerializer(order)
                 return Response({
                     "status": "success",
                     "message": "Order created successfully. Proceed to payment.",
                     "order_id": order.id,
+                    "checkout_reference": order.checkout_reference,
                     "amount_to_pay": str(total_price),
-                    "order": order_serializer.data
+                    "order": OrderSerializer(order).data,
+                    "orders": OrderSerializer(orders, many=True).data,
                 }, status=status.HTTP_201_CREATED)
 
+        except StockReservationError as e:
+            return stock_reservation_error_response(e.reservation)
         except ValueError as e:
             return Response({
                 "status": "error",
@@ -547,52 +545,6 @@ class CheckoutView(APIView):
                 "message": "Checkout failed. Please try again."
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    def _process_wallet_payment(self, user, order, total_price):
-        buyer_wallet, _ = Wallet.objects.select_for_update().get_or_create(
-            user=user, defaults={'available_balance': Decimal('0.00')}
-        )
-
-        if buyer_wallet.available_balance < total_price:
-            raise ValueError("Insufficient wallet balance.")
-
-        buyer_wallet.available_balance -= total_price
-        buyer_wallet.save()
-
-        order_items = OrderItem.objects.filter(order=order).select_related('product__shop__owner')
-        merchant_shares = {}
-        for oi in order_items:
-            owner = oi.product.shop.owner
-            amount = oi.quantity * oi.price_at_purchase
-            merchant_shares[owner] = merchant_shares.get(owner, Decimal('0.00')) + amount
-
-        for owner, amount in merchant_shares.items():
-            seller_wallet, _ = Wallet.objects.select_for_update().get_or_create(
-                user=owner, defaults={'available_balance': Decimal('0.00')}
-            )
-            seller_wallet.locked_balance += amount
-            seller_wallet.save()
-
-            Transaction.objects.create(
-                wallet=seller_wallet,
-                amount=amount,
-                transaction_type=Transaction.TransactionType.PAYMENT,
-                status=Transaction.Status.SUCCESS,
-                related_order_id=str(order.id),
-                description=f"Sales earnings (locked) for Order #{order.order_number or order.id}"
-            )
-
-        Transaction.objects.create(
-            wallet=buyer_wallet,
-            amount=-total_price,
-            transaction_type=Transaction.TransactionType.PAYMENT,
-            status=Transaction.Status.SUCCESS,
-            related_order_id=str(order.id),
-            description=f"Payment for Order #{order.order_number or order.id}"
-        )
-
-        order.payment_status = Order.PaymentStatus.PAID
-        order.save()
-
 
 class BuyNowView(APIView):
     permission_classes = [permissions.IsAuthenticated]
@@ -629,6 +581,7 @@ class CartAPIView(APIView):
 
     def get(self, request):
         cart = self.get_cart(request)
+        prefetch_related_objects([cart], Prefetch('items', CartItem.objects.select_related('product')))
         serializer = CartSerializer(cart)
         return Response(serializer.data)
 
@@ -672,7 +625,7 @@ class CartSyncView(APIView):
         local_items = serializer.validated_data
         product_ids = [item['product_id'] for item in local_items if item['quantity'] > 0]
 
-        products = Product.objects.filter(id__in=product_ids).select_related('shop').prefetch_related('images')
+        products = Product.objects.filter(id__in=product_ids).select_related('shop')
         product_map = {p.id: p for p in products}
 
         cart, _ = Cart.objects.get_or_create(user=request.user)
@@ -750,7 +703,16 @@ class CreateOrderView(APIView):
         logger.info("CreateOrderView request data: %s", request.data)
 
         cart_items = request.data.get('items', [])
-        if not cart_items:
+        if cart_items:
+            serializer = CheckoutItemSerializer(data=cart_items, many=True)
+            if not serializer.is_valid():
+                return Response({
+                    "status": "error",
+                    "message": "Invalid request.",
+                    "errors": serializer.errors
+                }, status=status.HTTP_400_BAD_REQUEST)
+            cart_items = serializer.validated_data
+        else:
             try:
                 cart = Cart.objects.get(user=request.user)
                 db_items = CartItem.objects.filter(cart=cart).select_related('product')
@@ -762,147 +724,97 @@ class CreateOrderView(APIView):
         if not cart_items:
             return Response({"status": "error", "message": "Your cart is empty."}, status=400)
 
+        reservation = StockReservation(cart_items)
         try:
-            total_calculated_price = Decimal('0.00')
-            order_items_to_create = []
-
             with transaction.atomic():
-                for item in cart_items:
-                    product = Product.objects.select_for_update().get(id=item['product_id'])
-                    qty = int(item['quantity'])
-                    
-                    if product.stock < qty:
-                        return Response({
-                            "status": "out_of_stock",
-                            "product_id": product.id,
-                            "available_stock": product.stock,
-                            "message": f"Only {product.stock} unit(s) of \"{product.name}\" are available."
-                        }, status=400)
-                    
-                    total_calculated_price += (product.price * qty)
-                    order_items_to_create.append((product, qty))
-
-                new_order = Order.objects.create(
-                    buyer=request.user,
-                    shop=order_items_to_create[0][0].shop if order_items_to_create else None,
-                    total_price=total_calculated_price,
-                    delivery_status=Order.DeliveryStatus.PENDING,
-                    payment_status=Order.PaymentStatus.PENDING,
-                    shipping_address_json=request.data.get('shipping_address', {})
-                )
-
-                for product, qty in order_items_to_create:
-                    OrderItem.objects.create(
-                        order=new_order, 
-                        product=product, 
-                        quantity=qty, 
-                        price_at_purchase=product.price
-                    )
-                    product.stock -= qty
-                    product.save()
+                reservation.reserve()
+                total_calculated_price = reservation.total_price
+                orders = reservation.create_orders(request.user, request.data.get('shipping_address', {}))
 
             return Response({
                 "status": "success",
                 "message": "Order created successfully.",
-                "order_id": new_order.id,
+                "order_id": orders[0].id,
+                "order_ids": [o.id for o in orders],
+                "checkout_reference": orders[0].checkout_reference,
                 "amount_to_pay": str(total_calculated_price)
             }, status=201)
 
-        except Product.DoesNotExist:
-            return Response({"status": "error", "message": "One or more products not found."}, status=404)
+        except StockReservationError as e:
+            return stock_reservation_error_response(e.reservation)
         except Exception as e:
             logger.exception("Order creation failed for user %s", request.user.id)
             return Response({"status": "error", "message": "Failed to create order. Please try again."}, status=500)
 
 
 class InternalWalletCheckoutView(APIView):
+    """
+    Pays pending orders from the buyer's wallet. Accepts either a single
+    order_id or the checkout_reference shared by every order of a split checkout.
+    """
     permission_classes = [permissions.IsAuthenticated]
 
+    @idempotent
     def post(self, request):
         order_id = request.data.get('order_id')
-        if not order_id:
+        checkout_reference = request.data.get('checkout_reference')
+        if not order_id and not checkout_reference:
             return Response({
                 "status": "error",
                 "message": "Order ID is required."
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            order = Order.objects.get(id=order_id, buyer=request.user)
-        except Order.DoesNotExist:
-            return Response({
-                "status": "error",
-                "message": "Order not found."
-            }, status=status.HTTP_404_NOT_FOUND)
-
-        if order.payment_status == Order.PaymentStatus.PAID:
-            return Response({
-                "status": "error",
-                "message": "This order has already been paid."
-            }, status=status.HTTP_400_BAD_REQUEST)
-
+        lookup = {'id': order_id} if order_id else {'checkout_reference': checkout_reference}
         with transaction.atomic():
-            buyer_wallet, _ = Wallet.objects.select_for_update().get_or_create(
-                user=request.user, defaults={'available_balance': Decimal('0.00')}
-            )
+            orders = list(Order.objects.select_for_update().filter(buyer=request.user, **lookup).order_by('id'))
+            if not orders:
+                return Response({
+                    "status": "error",
+                    "message": "Order not found."
+                }, status=status.HTTP_404_NOT_FOUND)
 
-            if buyer_wallet.available_balance < order.total_price:
+            orders = [o for o in orders if o.payment_status != Order.PaymentStatus.PAID]
+            if not orders:
                 return Response({
-                    "status": "low_balance",
-                    "order_id": order.id,
-                    "amount_to_pay": str(order.total_price),
-                    "available_balance": str(buyer_wallet.available_balance),
-                    "message": f"Insufficient wallet balance. Required: ₦{order.total_price:,.0f}, Available: ₦{buyer_wallet.available_balance:,.0f}."
+                    "status": "error",
+                    "message": "This order has already been paid."
                 }, status=status.HTTP_400_BAD_REQUEST)
 
-            buyer_wallet.available_balance -= order.total_price
-            buyer_wallet.save()
-
-            order_items = OrderItem.objects.filter(order=order).select_related('product__shop__owner')
-            merchant_shares = {}
-            for item in order_items:
-                owner = item.product.shop.owner
-                amount = item.quantity * item.price_at_purchase
-                merchant_shares[owner] = merchant_shares.get(owner, Decimal('0.00')) + amount
-
-            for owner, amount in merchant_shares.items():
-                seller_wallet, _ = Wallet.objects.select_for_update().get_or_create(
-                    user=owner, defaults={'available_balance': Decimal('0.00')}
-                )
-                seller_wallet.locked_balance += amount
-                seller_wallet.save()
-
-                Transaction.objects.create(
-                    wallet=seller_wallet,
-                    amount=amount,
-                    transaction_type=Transaction.TransactionType.PAYMENT,
-                    status=Transaction.Status.SUCCESS,
-                    related_order_id=str(order.id),
-                    description=f"Sales earnings (locked) for Order #{order.order_number or order.id}"
-                )
-
-            Transaction.objects.create(
-                wallet=buyer_wallet,
-                amount=-order.total_price,
-                transaction_type=Transaction.TransactionType.PAYMENT,
-                status=Transaction.Status.SUCCESS,
-                related_order_id=str(order.id),
-                description=f"Payment for Order #{order.order_number or order.id}"
-            )
+            total_price = sum((o.total_price for o in orders), Decimal('0.00'))
+            # A plain read for the friendly low-balance reply; the debit itself
+            # is conditional, so a balance spent meanwhile still can't go negative.
+            buyer_wallet = Wallet.objects.filter(user=request.user).first()
+            available = buyer_wallet.available_balance if buyer_wallet else Decimal('0.00')
+            if available < total_price:
+                return Response({
+                    "status": "low_balance",
+                    "order_id": orders[0].id,
+                    "amount_to_pay": str(total_price),
+                    "available_balance": str(available),
+                    "message": f"Insufficient wallet balance. Required: ₦{total_price:,.0f}, Available: ₦{available:,.0f}."
+                }, status=status.HTTP_400_BAD_REQUEST)
 
-            order.payment_status = Order.PaymentStatus.PAID
-            order.save()
+            try:
+                pay_orders_from_wallet(request.user, orders, total_price)
+            except ValueError as e:
+                return Response({
+                    "status": "error",
+                    "message": str(e)
+                }, status=status.HTTP_400_BAD_REQUEST)
 
         return Response({
             "status": "success",
             "message": "Payment successful. Funds secured until you confirm receipt.",
-            "order_id": order.id,
-            "amount_paid": str(order.total_price)
+            "order_id": orders[0].id,
+            "order_ids": [o.id for o in orders],
+            "amount_paid": str(total_price)
         }, status=status.HTTP_200_OK)
 
 
 class BuyerOrderListView(generics.ListAPIView):
     serializer_class = BuyerOrderSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = CursorFeedPagination
 
     def get_queryset(self):
         return Order.objects.filter(buyer=self.request.user).order_by('-created_at')
@@ -934,19 +846,21 @@ class BuyerConfirmReceiptView(APIView):
                 if order.payment_status == Order.PaymentStatus.CONFIRMED:
                     return Response({"status": "error", "message": "This order has already been confirmed."}, status=400)
 
-                seller_wallet = Wallet.objects.select_for_update().get(user=order.shop.owner)
-
-                if seller_wallet.locked_balance < order.total_price:
-                    return Response({"status": "error", "message": "Unable to process confirmation. Please contact support."}, status=400)
+                seller_wallet = Wallet.objects.get(user=order.shop.owner)
 
                 order_total = order.total_price
 
                 commission = min(order_total * GLAPP_COMMISSION_RATE, GLAPP_COMMISSION_CAP)
                 net_payout = order_total - commission
 
-                seller_wallet.locked_balance -= order_total
-                seller_wallet.available_balance += net_payout
-                seller_wallet.save()
+                try:
+                    ledger.post(ledger.Kind.ESCROW_RELEASE, [
+                        (ledger.locked(seller_wallet), -order_total),
+                        (ledger.available(seller_wallet), net_payout),
+                        (ledger.REVENUE, commission),
+                    ], f"Order #{order.order_number or order.id}", str(order.id))
+                except ledger.InsufficientFunds:
+                    return Response({"status": "error", "message": "Unable to process confirmation. Please contact support."}, status=400)
 
                 PlatformRevenue.add_commission(commission)
 
@@ -963,6 +877,8 @@ class BuyerConfirmReceiptView(APIView):
                 order.delivery_status = Order.DeliveryStatus.DELIVERED
                 order.save()
 
+                outbox.order_confirmed(order, net_payout)
+
                 return Response({
                     "status": "success",
                     "message": "Receipt confirmed. Funds released to seller.",
@@ -987,6 +903,7 @@ class SellerOrderListView(generics.ListAPIView):
     """
     serializer_class = SellerOrderSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = CursorFeedPagination
 
     def get_queryset(self):
         return Order.objects.filter(shop__owner=self.request.user).order_by('-created_at')
@@ -1035,9 +952,11 @@ class SellerUpdateOrderStatusView(APIView):
         if not new_status:
             return Response({"error": "Status is required"}, status=400)
 
-        # 4. Update and Save
-        order.delivery_status = new_status
-        order.save()
+        # 4. Update and Save; the buyer's push is queued in the same transaction.
+        with transaction.atomic():
+            order.delivery_status = new_status
+            order.save()
+            outbox.order_status_changed(order)
 
         # Yusuf: If status is 'ready_for_pickup', it will now show up for the Rider
         return Response({"message": f"Order #{order.order_number or pk} updated to {new_status}"})
@@ -1053,6 +972,11 @@ class AdminDashboardStatsView(APIView):
     permission_classes = [permissions.IsAdminUser] # Only for is_staff=True users
 
     def get(self, request):
+        # Table-wide aggregates; a short-lived copy in the 'dashboard' cache is fresh enough.
+        stats = caches['dashboard'].get_or_set('market:admin-stats', self._compute_stats)
+        return Response(stats)
+
+    def _compute_stats(self):
         # 1. User Stats
         User = get_user_model()
         total_users = User.objects.count()
@@ -1070,7 +994,7 @@ class AdminDashboardStatsView(APIView):
         # 4. Total Volume (Gross Merchandise Value)
         gmv = Order.objects.aggregate(Sum('total_price'))['total_price__sum'] or 0.00
 
-        return Response({
+        return {
             "users": {
                 "total": total_users,
                 "sellers": total_sellers
@@ -1085,7 +1009,7 @@ class AdminDashboardStatsView(APIView):
                 "completed": completed_orders,
                 "paid": paid_orders
             }
-        })
+        }
 
 
 class AdminOverviewView(APIView):
@@ -1281,7 +1205,7 @@ class SellerOrderDetailView(generics.RetrieveUpdateAPIView):
 
 
 class ShopListView(generics.ListAPIView):
-    queryset = Shop.objects.filter(is_active=True).select_related('owner').order_by('-created_at')
+    queryset = Shop.objects.filter(is_active=True).select_related('owner').with_product_count().order_by('-created_at')
     serializer_class = ShopSerializer
     permission_classes = [AllowAny]
     filter_backends = [filters.SearchFilter]
@@ -1290,21 +1214,20 @@ class ShopListView(generics.ListAPIView):
 
 
 class ShopDetailView(generics.RetrieveAPIView):
-    queryset = Shop.objects.all()
+    queryset = Shop.objects.select_related('owner').with_product_count()
     serializer_class = ShopSerializer
     permission_classes = [AllowAny] # Anyone can visit a shop
 
 
 
 
-@method_decorator(cache_page(300), name='dispatch')
-@method_decorator(vary_on_headers('Authorization'), name='dispatch')
-class ProductVideoFeedView(generics.ListAPIView):
+class ProductVideoFeedView(CatalogCacheMixin, generics.ListAPIView):
     serializer_class = ProductSerializer
     permission_classes = [permissions.AllowAny]
+    catalog_namespace = 'video-feed'
 
     def get_queryset(self):
-        return Product.objects.exclude(video="").exclude(video__isnull=True).select_related('shop', 'category').prefetch_related('images').order_by('-created_at')
+        return Product.objects.exclude(video="").exclude(video__isnull=True).for_listing().order_by('-created_at')
 
 
 
@@ -1524,22 +1447,6 @@ class MyShopStatusView(APIView):
 class MerchantWithdrawalView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
-    def _monnify_auth_token(self):
-        url = settings.MONNIFY_BASE_URL.rstrip('/') + '/api/v1/auth/login'
-        auth_str = f"{settings.MONNIFY_API_KEY}:{settings.MONNIFY_SECRET_KEY}"
-        encoded = base64.b64encode(auth_str.encode()).decode()
-        try:
-            resp = requests.post(
-                url,
-                headers={"Authorization": f"Basic {encoded}", "Content-Type": "application/json"},
-                timeout=15,
-            )
-            if resp.status_code == 200:
-                return resp.json()['responseBody']['accessToken']
-        except Exception as e:
-            logger.error(f"Monnify auth failure: {e}")
-        return None
-
     def post(self, request):
         amount = request.data.get('amount')
         bank_code = request.data.get('bank_code')
@@ -1566,15 +1473,7 @@ class MerchantWithdrawalView(APIView):
         if amount_dec <= 0:
             return Response({"error": "Amount must be greater than zero."}, status=status.HTTP_400_BAD_REQUEST)
 
-        token = self._monnify_auth_token()
-        if not token:
-            return Response(
-                {"error": "Could not authenticate with payment processor. Try again."},
-                status=status.HTTP_502_BAD_GATEWAY,
-            )
-
         reference = f"WTH-{uuid_lib.uuid4().hex[:12]}-{int(timezone.now().timestamp())}"
-        disbursement_url = settings.MONNIFY_BASE_URL.rstrip('/') + '/api/v2/disbursements/single'
         payload = {
             "amount": float(amount_dec),
             "reference": reference,
@@ -1586,16 +1485,13 @@ class MerchantWithdrawalView(APIView):
         }
 
         try:
-            disburse_resp = requests.post(
-                disbursement_url,
-                json=payload,
-                headers={
-                    "Authorization": f"Bearer {token}",
-                    "Content-Type": "application/json",
-                },
-                timeout=30,
-            )
+            disburse_resp = monnify.post('/api/v2/disbursements/single', json=payload, timeout=30)
             result = disburse_resp.json()
+        except MonnifyError:
+            return Response(
+                {"error": "Could not authenticate with payment processor. Try again."},
+                status=status.HTTP_502_BAD_GATEWAY,
+            )
         except requests.RequestException as e:
             logger.error(f"Monnify disbursement connection failure: {e}")
             return Response(
@@ -1611,17 +1507,17 @@ class MerchantWithdrawalView(APIView):
             )
 
         with transaction.atomic():
-            wallet = Wallet.objects.select_for_update().get(user=request.user)
+            wallet = Wallet.objects.get(user=request.user)
 
-            if wallet.available_balance < amount_dec:
+            if not WalletManager.debit(
+                wallet, amount_dec, ledger.Kind.WITHDRAWAL,
+                description=f"Withdrawal to {account_number}", reference=reference,
+            ):
                 return Response(
                     {"error": "Insufficient available balance. Locked funds cannot be withdrawn."},
                     status=status.HTTP_400_BAD_REQUEST,
                 )
 
-            wallet.available_balance -= amount_dec
-            wallet.save()
-
             Transaction.objects.create(
                 wallet=wallet,
                 amount=-amount_dec,
@@ -1651,6 +1547,7 @@ class PromotedPostCreateView(APIView):
     """
     permission_classes = [permissions.IsAuthenticated]
 
+    @idempotent
     def post(self, request):
         serializer = PromotedPostCreateSerializer(data=request.data, context={'request': request})
         serializer.is_valid(raise_exception=True)
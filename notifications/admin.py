@@ -0,0 +1,12 @@
+from django.contrib import admin
+
+from .models import PushNotification
+
+
+@admin.register(PushNotification)
+class PushNotificationAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'kind', 'title', 'status', 'attempts', 'created_at', 'sent_at')
+    list_filter = ('status', 'kind')
+    search_fields = ('user__email', 'title')
+    raw_id_fields = ('user',)
+    readonly_fields = ('created_at', 'sent_at')
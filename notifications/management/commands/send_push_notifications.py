@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from notifications.outbox import dispatch_batch
+from notifications.senders import get_sender
+
+
+class Command(BaseCommand):
+    help = 'Delivers queued push notifications from the outbox in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help='Notifications claimed per batch (default: 100).',
+        )
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep polling the outbox instead of exiting once it is drained.',
+        )
+        parser.add_argument(
+            '--interval', type=float, default=2.0,
+            help='Seconds to sleep between polls of an empty outbox with --loop (default: 2).',
+        )
+
+    def handle(self, *args, **options):
+        sender = get_sender()
+        handled = 0
+        while True:
+            count = dispatch_batch(sender, batch_size=options['batch_size'])
+            handled += count
+            if count:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f"Processed {handled} push notification(s)."))
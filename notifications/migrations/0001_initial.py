@@ -0,0 +1,40 @@
+# Generated by Django 5.2.8 on 2026-10-17 22:56
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PushNotification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('chat_message', 'Chat Message'), ('order_status', 'Order Status'), ('order_confirmed', 'Order Confirmed'), ('order_paid', 'Order Paid'), ('wallet_funded', 'Wallet Funded')], max_length=20)),
+                ('title', models.CharField(max_length=120)),
+                ('body', models.CharField(blank=True, default='', max_length=240)),
+                ('data', models.JSONField(blank=True, default=dict)),
+                ('collapse_key', models.CharField(blank=True, default='', max_length=64)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('coalesced', 'Coalesced'), ('skipped', 'Skipped'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.CharField(blank=True, default='', max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='push_notifications', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='push_due_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,63 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+
+
+class PushNotification(models.Model):
+    """
+    Outbox row for one push notification.
+
+    Rows are written in the same transaction as the event they announce (see
+    notifications.outbox), so a push is queued if and only if the event
+    committed. The send_push_notifications command delivers them.
+    """
+
+    class Kind(models.TextChoices):
+        CHAT_MESSAGE = 'chat_message', 'Chat Message'
+        ORDER_STATUS = 'order_status', 'Order Status'
+        ORDER_CONFIRMED = 'order_confirmed', 'Order Confirmed'
+        ORDER_PAID = 'order_paid', 'Order Paid'
+        WALLET_FUNDED = 'wallet_funded', 'Wallet Funded'
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        SENT = 'sent', 'Sent'
+        COALESCED = 'coalesced', 'Coalesced'   # superseded by a newer push with the same collapse_key
+        SKIPPED = 'skipped', 'Skipped'         # recipient has no push token
+        FAILED = 'failed', 'Failed'
+
+    MAX_ATTEMPTS = 5
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='push_notifications')
+    kind = models.CharField(max_length=20, choices=Kind.choices)
+    title = models.CharField(max_length=120)
+    body = models.CharField(max_length=240, blank=True, default='')
+    data = models.JSONField(default=dict, blank=True)
+    # Pending pushes for the same user and key are sent as one (the newest).
+    collapse_key = models.CharField(max_length=64, blank=True, default='')
+
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.CharField(max_length=255, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='push_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} for {self.user_id} ({self.status})"
+
+    def schedule_retry(self, error):
+        """Records a failed attempt; backs off exponentially, then gives up."""
+        self.attempts += 1
+        self.last_error = str(error)[:255]
+        if self.attempts >= self.MAX_ATTEMPTS:
+            self.status = self.Status.FAILED
+        else:
+            self.next_attempt_at = timezone.now() + timedelta(seconds=30 * 2 ** (self.attempts - 1))
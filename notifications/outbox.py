@@ -0,0 +1,201 @@
+"""
+Push-notification outbox.
+
+Code that changes state a user cares about (a chat message, an order status,
+a payment) calls one of the helpers below inside its own transaction. The
+helper only INSERTs PushNotification rows, so the request never waits on the
+push service, and a rolled-back change never sends a push.
+
+dispatch_batch() is the worker side (run by `manage.py send_push_notifications`):
+it claims a batch of due rows, coalesces pending pushes that share a
+collapse_key into the newest one, hands the rest to the configured sender,
+and records the outcome, with exponential backoff for retryable failures.
+The push service is called outside any transaction: a claim is a lease on
+next_attempt_at, so no row lock is held across the network round-trip, and
+a worker that dies mid-send leaves its rows to be retried once the lease
+lapses.
+"""
+import logging
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+from .models import PushNotification
+
+logger = logging.getLogger(__name__)
+
+Kind = PushNotification.Kind
+Status = PushNotification.Status
+
+# How long a claimed batch stays invisible to other workers.
+CLAIM_LEASE = timedelta(minutes=5)
+
+
+def enqueue(user_id, kind, title, body='', data=None, collapse_key=''):
+    return PushNotification.objects.create(
+        user_id=user_id, kind=kind, title=title[:120], body=body[:240],
+        data=data or {}, collapse_key=collapse_key,
+    )
+
+
+# --- events ----------------------------------------------------------------
+
+def chat_message(message):
+    conversation = message.conversation
+    recipient_id = conversation.seller_id if message.sender_id == conversation.buyer_id else conversation.buyer_id
+    sender = message.sender
+    return enqueue(
+        recipient_id, Kind.CHAT_MESSAGE,
+        title=sender.full_name or sender.email,
+        body=message.text,
+        data={'conversation_id': conversation.id, 'message_id': message.id},
+        # A burst of messages in one chat becomes a single push.
+        collapse_key=f"chat:{conversation.id}",
+    )
+
+
+def order_status_changed(order):
+    return enqueue(
+        order.buyer_id, Kind.ORDER_STATUS,
+        title=f"Order #{order.order_number or order.id}",
+        body=f"Your order is now {order.get_delivery_status_display()}.",
+        data={'order_id': order.id, 'delivery_status': order.delivery_status},
+        collapse_key=f"order:{order.id}",
+    )
+
+
+def order_confirmed(order, net_payout):
+    return enqueue(
+        order.shop.owner_id, Kind.ORDER_CONFIRMED,
+        title=f"Order #{order.order_number or order.id} confirmed",
+        body=f"The buyer confirmed receipt. ₦{net_payout} has been released to your wallet.",
+        data={'order_id': order.id},
+    )
+
+
+def orders_paid(orders, notify_buyer=True):
+    """One push to each order's seller and, optionally, one to the buyer for the whole checkout."""
+    if not orders:
+        return []
+    rows = []
+    if notify_buyer:
+        rows.append(PushNotification(
+            user_id=orders[0].buyer_id, kind=Kind.ORDER_PAID,
+            title="Payment received",
+            body=f"Your payment for {len(orders)} order(s) was confirmed.",
+            data={'order_ids': [order.id for order in orders]},
+        ))
+    rows.extend(
+        PushNotification(
+            user_id=order.shop.owner_id, kind=Kind.ORDER_PAID,
+            title=f"New paid order #{order.order_number or order.id}",
+            body=f"₦{order.total_price} is held in escrow until the buyer confirms receipt.",
+            data={'order_id': order.id},
+        )
+        for order in orders if order.shop_id
+    )
+    return PushNotification.objects.bulk_create(rows)
+
+
+def wallet_funded(wallet, amount):
+    return enqueue(
+        wallet.user_id, Kind.WALLET_FUNDED,
+        title="Wallet funded",
+        body=f"₦{amount} has been added to your wallet.",
+        data={'amount': str(amount)},
+    )
+
+
+# --- worker ----------------------------------------------------------------
+
+def _coalesce(notifications, now):
+    """
+    Marks superseded and undeliverable rows and returns the ones to send.
+    Within each (user, collapse_key) only the newest row is sent; it carries
+    how many pushes it stands for.
+    """
+    newest = {}
+    counts = {}
+    for n in notifications:
+        if n.collapse_key:
+            key = (n.user_id, n.collapse_key)
+            counts[key] = counts.get(key, 0) + 1
+            if key not in newest or n.id > newest[key].id:
+                newest[key] = n
+
+    to_send = []
+    for n in notifications:
+        key = (n.user_id, n.collapse_key)
+        if n.collapse_key and newest[key] is not n:
+            n.status = Status.COALESCED
+            n.sent_at = now
+        elif not n.user.push_token:
+            n.status = Status.SKIPPED
+        else:
+            if n.collapse_key and counts[key] > 1:
+                n.data = {**n.data, 'coalesced': counts[key]}
+            to_send.append(n)
+    return to_send
+
+
+def _claim(batch_size, now):
+    """
+    Leases up to batch_size due rows to this worker and returns them. The
+    lease expiry doubles as the claim token: only rows this call moved to it
+    come back, even if another worker raced for the same ids.
+    """
+    lease_until = now + CLAIM_LEASE
+    with transaction.atomic():
+        ids = list(
+            PushNotification.objects.select_for_update(skip_locked=True)
+            .filter(status=Status.PENDING, next_attempt_at__lte=now)
+            .order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return []
+        PushNotification.objects.filter(
+            pk__in=ids, status=Status.PENDING, next_attempt_at__lte=now,
+        ).update(next_attempt_at=lease_until)
+    return list(
+        PushNotification.objects.filter(pk__in=ids, status=Status.PENDING, next_attempt_at=lease_until)
+        .select_related('user').order_by('id')
+    )
+
+
+def dispatch_batch(sender, batch_size=100):
+    """Delivers up to batch_size due notifications. Returns how many rows it handled."""
+    now = timezone.now()
+    due = _claim(batch_size, now)
+    if not due:
+        return 0
+
+    to_send = _coalesce(due, now)
+    try:
+        results = sender.send_messages(to_send) if to_send else []
+    except Exception as e:
+        logger.exception("Push sender failed")
+        results = [e] * len(to_send)
+
+    dead_tokens = set()
+    for n, error in zip(to_send, results):
+        if error is None:
+            n.status = Status.SENT
+            n.sent_at = now
+        elif getattr(error, 'retry', True):
+            n.schedule_retry(error)
+        else:
+            n.attempts += 1
+            n.status = Status.FAILED
+            n.last_error = str(error)[:255]
+            if getattr(error, 'invalid_token', False):
+                dead_tokens.add((n.user_id, n.user.push_token))
+
+    with transaction.atomic():
+        PushNotification.objects.bulk_update(
+            due, ['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at', 'data'],
+        )
+        User = get_user_model()
+        for user_id, token in dead_tokens:
+            # Only clear the token we sent to; the app may have registered a new one since.
+            User.objects.filter(pk=user_id, push_token=token).update(push_token=None)
+    return len(due)
@@ -0,0 +1,96 @@
+"""
+Push senders.
+
+The outbox worker hands each batch of notifications to the sender named by
+settings.PUSH_NOTIFICATION_SENDER (a dotted path), in the same way Django
+picks an email backend. send_messages() returns one entry per notification:
+None when it was delivered, or a PushError saying whether to retry.
+"""
+import logging
+
+import requests
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class PushError:
+    def __init__(self, message, retry=True, invalid_token=False):
+        self.message = message
+        self.retry = retry
+        # The device token is dead; the worker clears it from the user.
+        self.invalid_token = invalid_token
+
+    def __str__(self):
+        return self.message
+
+
+class BasePushSender:
+    def send_messages(self, notifications):
+        raise NotImplementedError
+
+
+class ExpoPushSender(BasePushSender):
+    """Sends through Expo's push service, which the mobile app registers tokens with."""
+    URL = 'https://exp.host/--/api/v2/push/send'
+    CHUNK_SIZE = 100  # Expo's limit per request
+    TIMEOUT = 15
+
+    def __init__(self):
+        self.session = requests.Session()
+        access_token = getattr(settings, 'EXPO_ACCESS_TOKEN', '')
+        if access_token:
+            self.session.headers['Authorization'] = f"Bearer {access_token}"
+
+    def send_messages(self, notifications):
+        results = []
+        for start in range(0, len(notifications), self.CHUNK_SIZE):
+            results.extend(self._send_chunk(notifications[start:start + self.CHUNK_SIZE]))
+        return results
+
+    def _send_chunk(self, notifications):
+        payload = [
+            {
+                'to': n.user.push_token,
+                'title': n.title,
+                'body': n.body,
+                'data': {**n.data, 'kind': n.kind},
+                'sound': 'default',
+            }
+            for n in notifications
+        ]
+        try:
+            response = self.session.post(self.URL, json=payload, timeout=self.TIMEOUT)
+            response.raise_for_status()
+            tickets = response.json().get('data') or []
+        except (requests.RequestException, ValueError) as e:
+            logger.error(f"Expo push request failed: {e}")
+            return [PushError(f"Request failed: {e}") for _ in notifications]
+
+        results = []
+        for index in range(len(notifications)):
+            ticket = tickets[index] if index < len(tickets) else {}
+            if ticket.get('status') == 'ok':
+                results.append(None)
+                continue
+            error = (ticket.get('details') or {}).get('error', '')
+            message = ticket.get('message') or error or 'No ticket returned'
+            if error == 'DeviceNotRegistered':
+                results.append(PushError(message, retry=False, invalid_token=True))
+            else:
+                results.append(PushError(message, retry=error not in ('InvalidCredentials', 'MessageTooBig')))
+        return results
+
+
+class LocMemPushSender(BasePushSender):
+    """Keeps pushes in LocMemPushSender.outbox instead of sending them. For tests and local dev."""
+    outbox = []
+
+    def send_messages(self, notifications):
+        LocMemPushSender.outbox.extend(notifications)
+        return [None] * len(notifications)
+
+
+def get_sender():
+    return import_string(settings.PUSH_NOTIFICATION_SENDER)()
@@ -0,0 +1,198 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import MagicMock, patch
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from chat.models import Conversation
+from finance.models import Wallet
+from market.models import Order, Shop
+from .models import PushNotification
+from .outbox import dispatch_batch, enqueue
+from .senders import ExpoPushSender, LocMemPushSender, PushError
+
+User = get_user_model()
+Status = PushNotification.Status
+
+
+class FailingSender:
+    def __init__(self, error):
+        self.error = error
+
+    def send_messages(self, notifications):
+        return [self.error] * len(notifications)
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        LocMemPushSender.outbox = []
+        self.client = APIClient()
+        self.buyer = User.objects.create_user(
+            email="buyer@example.com", password="password123", full_name="Buyer", push_token="ExponentPushToken[buyer]",
+        )
+        self.seller = User.objects.create_user(
+            email="seller@example.com", password="password123", full_name="Seller", push_token="ExponentPushToken[seller]",
+        )
+        self.shop = Shop.objects.create(owner=self.seller, name="Shop", is_active=True)
+
+    def send_chat(self, text, conversation):
+        self.client.force_authenticate(user=self.buyer)
+        self.client.post(reverse('chat-send-message', args=[conversation.id]), {'text': text}, format='json')
+
+    def test_chat_burst_is_coalesced_into_one_push(self):
+        conversation = Conversation.objects.create(buyer=self.buyer, seller=self.seller)
+        for text in ("one", "two", "three"):
+            self.send_chat(text, conversation)
+        self.assertEqual(PushNotification.objects.filter(user=self.seller).count(), 3)
+
+        dispatch_batch(LocMemPushSender())
+
+        self.assertEqual(len(LocMemPushSender.outbox), 1)
+        sent = LocMemPushSender.outbox[0]
+        self.assertEqual(sent.body, "three")
+        self.assertEqual(sent.data['coalesced'], 3)
+        self.assertEqual(
+            sorted(PushNotification.objects.values_list('status', flat=True)),
+            [Status.COALESCED, Status.COALESCED, Status.SENT],
+        )
+
+    def test_order_status_change_queues_a_push_for_the_buyer(self):
+        order = Order.objects.create(buyer=self.buyer, shop=self.shop, total_price=Decimal('500.00'))
+        self.client.force_authenticate(user=self.seller)
+
+        self.client.post(reverse('seller-order-status-change', args=[order.id]), {'status': 'shipped'}, format='json')
+
+        push = PushNotification.objects.get()
+        self.assertEqual(push.user, self.buyer)
+        self.assertEqual(push.kind, PushNotification.Kind.ORDER_STATUS)
+        self.assertEqual(push.data, {'order_id': order.id, 'delivery_status': 'shipped'})
+
+    def test_receipt_confirmation_queues_a_push_for_the_seller(self):
+        order = Order.objects.create(
+            buyer=self.buyer, shop=self.shop, total_price=Decimal('500.00'),
+            payment_status=Order.PaymentStatus.PAID,
+        )
+        Wallet.objects.update_or_create(user=self.seller, defaults={'locked_balance': Decimal('500.00')})
+        self.client.force_authenticate(user=self.buyer)
+
+        response = self.client.post(reverse('buyer-confirm-receipt', args=[order.id]))
+
+        self.assertEqual(response.status_code, 200)
+        push = PushNotification.objects.get()
+        self.assertEqual(push.user, self.seller)
+        self.assertEqual(push.kind, PushNotification.Kind.ORDER_CONFIRMED)
+
+    def test_users_without_a_token_are_skipped(self):
+        self.buyer.push_token = None
+        self.buyer.save()
+        enqueue(self.buyer.id, PushNotification.Kind.WALLET_FUNDED, "Wallet funded")
+
+        dispatch_batch(LocMemPushSender())
+
+        self.assertEqual(PushNotification.objects.get().status, Status.SKIPPED)
+        self.assertEqual(LocMemPushSender.outbox, [])
+
+    def test_retryable_failures_back_off_then_give_up(self):
+        push = enqueue(self.buyer.id, PushNotification.Kind.WALLET_FUNDED, "Wallet funded")
+        sender = FailingSender(PushError("503"))
+
+        dispatch_batch(sender)
+        push.refresh_from_db()
+        self.assertEqual((push.status, push.attempts), (Status.PENDING, 1))
+        self.assertGreater(push.next_attempt_at, timezone.now())
+        self.assertEqual(dispatch_batch(sender), 0)  # not due yet
+
+        for _ in range(PushNotification.MAX_ATTEMPTS - 1):
+            PushNotification.objects.update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+            dispatch_batch(sender)
+        push.refresh_from_db()
+        self.assertEqual((push.status, push.attempts), (Status.FAILED, PushNotification.MAX_ATTEMPTS))
+
+    def test_unregistered_device_clears_the_token(self):
+        enqueue(self.buyer.id, PushNotification.Kind.WALLET_FUNDED, "Wallet funded")
+
+        dispatch_batch(FailingSender(PushError("gone", retry=False, invalid_token=True)))
+
+        self.assertEqual(PushNotification.objects.get().status, Status.FAILED)
+        self.buyer.refresh_from_db()
+        self.assertIsNone(self.buyer.push_token)
+
+    def test_claimed_rows_are_leased_until_the_send_finishes(self):
+        enqueue(self.buyer.id, PushNotification.Kind.WALLET_FUNDED, "Wallet funded")
+        concurrent = []
+
+        class ReentrantSender(LocMemPushSender):
+            def send_messages(self, notifications):
+                # Another worker polling mid-send finds nothing due.
+                concurrent.append(dispatch_batch(LocMemPushSender()))
+                return super().send_messages(notifications)
+
+        self.assertEqual(dispatch_batch(ReentrantSender()), 1)
+        self.assertEqual(concurrent, [0])
+        self.assertEqual(PushNotification.objects.get().status, Status.SENT)
+
+    def test_a_lapsed_lease_is_claimed_again(self):
+        push = enqueue(self.buyer.id, PushNotification.Kind.WALLET_FUNDED, "Wallet funded")
+        with patch.object(LocMemPushSender, 'send_messages', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                dispatch_batch(LocMemPushSender())
+        self.assertEqual(dispatch_batch(LocMemPushSender()), 0)
+
+        PushNotification.objects.filter(pk=push.pk).update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(dispatch_batch(LocMemPushSender()), 1)
+        self.assertEqual(len(LocMemPushSender.outbox), 1)
+
+    @override_settings(PUSH_NOTIFICATION_SENDER='notifications.senders.LocMemPushSender')
+    def test_command_drains_the_outbox_in_batches(self):
+        for i in range(5):
+            enqueue(self.buyer.id, PushNotification.Kind.WALLET_FUNDED, f"Funded {i}")
+        out = StringIO()
+
+        call_command('send_push_notifications', '--batch-size', '2', stdout=out)
+
+        self.assertIn("Processed 5", out.getvalue())
+        self.assertEqual(len(LocMemPushSender.outbox), 5)
+        self.assertFalse(PushNotification.objects.filter(status=Status.PENDING).exists())
+
+    def test_expo_sender_maps_tickets_to_results(self):
+        first = enqueue(self.buyer.id, PushNotification.Kind.WALLET_FUNDED, "a")
+        second = enqueue(self.seller.id, PushNotification.Kind.WALLET_FUNDED, "b")
+        sender = ExpoPushSender()
+        response = MagicMock()
+        response.json.return_value = {'data': [
+            {'status': 'ok', 'id': 'x'},
+            {'status': 'error', 'message': 'not registered', 'details': {'error': 'DeviceNotRegistered'}},
+        ]}
+
+        with patch.object(sender.session, 'post', return_value=response) as post:
+            results = sender.send_messages([first, second])
+
+        self.assertEqual(post.call_args.kwargs['json'][0]['to'], "ExponentPushToken[buyer]")
+        self.assertIsNone(results[0])
+        self.assertFalse(results[1].retry)
+        self.assertTrue(results[1].invalid_token)
+
+
+class OutboxTransactionTests(TransactionTestCase):
+    def test_sender_runs_outside_a_transaction(self):
+        user = User.objects.create_user(
+            email="buyer@example.com", password="password123", full_name="Buyer", push_token="ExponentPushToken[buyer]",
+        )
+        enqueue(user.id, PushNotification.Kind.WALLET_FUNDED, "Wallet funded")
+        in_transaction = []
+
+        class RecordingSender(LocMemPushSender):
+            def send_messages(self, notifications):
+                in_transaction.append(connection.in_atomic_block)
+                return super().send_messages(notifications)
+
+        dispatch_batch(RecordingSender())
+
+        self.assertEqual(in_transaction, [False])
+        self.assertEqual(PushNotification.objects.get().status, Status.SENT)
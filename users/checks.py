@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core import checks
+
+
+@checks.register(checks.Tags.caches)
+def presence_cache_is_shared(app_configs, **kwargs):
+    """Presence kept in one worker's memory shows users offline to every other worker."""
+    backend = settings.CACHES.get('presence', {}).get('BACKEND', '')
+    if backend.endswith('LocMemCache'):
+        return [checks.Error(
+            "The 'presence' cache alias uses a local-memory cache, which each worker keeps to itself.",
+            hint="Point PRESENCE_CACHE_URL at a file, database or redis cache.",
+            id='users.E001',
+        )]
+    return []
@@ -0,0 +1,136 @@
+"""
+Who is online, without writing to the users table on every heartbeat.
+
+A heartbeat stores the current time under `presence:<user id>` in the
+'presence' cache alias, whose TTL (settings.CACHE_TIMEOUTS['presence']) is the
+online window: a user is online while their key exists and drops offline when
+it expires. The alias is shared by every worker (settings.PRESENCE_CACHE_URL
+is never a local-memory cache), so all of them see the same heartbeats.
+Nothing is written to the User row at heartbeat time, so the
+post_save handlers on User (wallet provisioning) never run for presence.
+
+User.last_seen is still kept for offline users. Each process buffers the
+latest heartbeat per user, and a background thread (started by the first
+heartbeat) writes the buffer with one bulk_update of last_seen every
+PRESENCE_FLUSH_INTERVAL seconds, sooner once MAX_PENDING users are waiting,
+and once more when the interpreter exits. Requests never wait on the write,
+and a process that goes quiet is still flushed. bulk_update sends no
+signals. A process that is killed outright loses at most one interval of
+last_seen updates. With PRESENCE_FLUSH_INTERVAL = 0 there is no thread and
+every heartbeat is written immediately.
+User.is_online is no longer written; read presence through this module.
+"""
+import atexit
+import logging
+import threading
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import connection
+from django.utils import timezone
+from django.utils.connection import ConnectionProxy
+
+logger = logging.getLogger(__name__)
+
+_cache = ConnectionProxy(caches, 'presence')
+
+
+class PresenceService:
+    MAX_PENDING = 500  # flush early when this many users are buffered
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._wake = threading.Event()
+        self._flusher = None
+
+    @staticmethod
+    def _key(user_id):
+        return f"presence:{user_id}"
+
+    def heartbeat(self, user_id):
+        now = timezone.now()
+        _cache.set(self._key(user_id), now.timestamp())
+        self._record(user_id, now)
+
+    def go_offline(self, user_id):
+        _cache.delete(self._key(user_id))
+        self._record(user_id, timezone.now())
+
+    def is_online(self, user_id):
+        return _cache.get(self._key(user_id)) is not None
+
+    def lookup(self, users):
+        """
+        {user id: {'is_online', 'last_seen'}} for the given users in one cache
+        round trip. last_seen is the latest heartbeat for online users and the
+        stored User.last_seen for the rest.
+        """
+        users = {user.id: user for user in users}
+        found = _cache.get_many([self._key(user_id) for user_id in users])
+        result = {}
+        for user_id, user in users.items():
+            beat = found.get(self._key(user_id))
+            result[user_id] = {
+                'is_online': beat is not None,
+                'last_seen': datetime.fromtimestamp(beat, tz=dt_timezone.utc) if beat is not None else user.last_seen,
+            }
+        return result
+
+    def flush(self):
+        """Writes buffered last_seen values in one bulk UPDATE. Returns how many users were written."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        User = get_user_model()
+        try:
+            User.objects.bulk_update(
+                [User(pk=user_id, last_seen=seen) for user_id, seen in pending.items()],
+                ['last_seen'], batch_size=self.MAX_PENDING,
+            )
+        except Exception:
+            # Put the batch back for the next flush; heartbeats since then are newer.
+            with self._lock:
+                self._pending = {**pending, **self._pending}
+            raise
+        return len(pending)
+
+    def _record(self, user_id, seen):
+        background = settings.PRESENCE_FLUSH_INTERVAL > 0
+        with self._lock:
+            self._pending[user_id] = seen
+            full = len(self._pending) >= self.MAX_PENDING
+            if background and (self._flusher is None or not self._flusher.is_alive()):
+                self._start_flusher()
+        if not background:
+            self.flush()
+        elif full:
+            self._wake.set()
+
+    def _start_flusher(self):
+        if self._flusher is None:
+            atexit.register(self._flush_at_exit)
+        self._flusher = threading.Thread(target=self._run_flusher, name='presence-flusher', daemon=True)
+        self._flusher.start()
+
+    def _run_flusher(self):
+        while True:
+            self._wake.wait(max(settings.PRESENCE_FLUSH_INTERVAL, 1))
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Could not write buffered last_seen values")
+            finally:
+                connection.close()
+
+    def _flush_at_exit(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Could not write buffered last_seen values at exit")
+
+
+presence = PresenceService()
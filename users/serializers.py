@@ -1,21 +1,57 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
+from django.db import models
 from .models import Address
+from .presence import presence
 
 User = get_user_model()
 
+class UserListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        # One presence lookup for the whole page instead of one per user.
+        users = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        self.context.setdefault('presence', {}).update(presence.lookup(users))
+        return super().to_representation(users)
+
+
 class UserSerializer(serializers.ModelSerializer):
     """
     Standard User Serializer for reading user data.
     """
     class Meta:
+        list_serializer_class = UserListSerializer
         model = User
         fields = [
             'id', 'email', 'full_name', 'phone_number', 'profile_image',
             'roles', 'active_role', 'kyc_status', 'language_preference','is_staff','push_token','is_online','last_seen',
             'is_deactivation_pending', 'deletion_requested_at',
         ]
-        read_only_fields = ['id', 'roles', 'kyc_status', 'is_deactivation_pending', 'deletion_requested_at']
+        read_only_fields = ['id', 'roles', 'kyc_status', 'is_deactivation_pending', 'deletion_requested_at', 'last_seen']
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Presence lives in the cache (users.presence), not in these columns.
+        # Lists look up the whole page at once (UserListSerializer); a user
+        # nested in a list of other objects is looked up once per response.
+        states = self.context.setdefault('presence', {})
+        if instance.id not in states:
+            states.update(presence.lookup([instance]))
+        state = states[instance.id]
+        data['is_online'] = state['is_online']
+        data['last_seen'] = serializers.DateTimeField().to_representation(state['last_seen']) if state['last_seen'] else None
+        return data
+
+    def update(self, instance, validated_data):
+        # The app reports presence by PATCHing is_online; record it as a
+        # heartbeat instead of saving (and signalling on) the User row.
+        if 'is_online' in validated_data:
+            if validated_data.pop('is_online'):
+                presence.heartbeat(instance.id)
+            else:
+                presence.go_offline(instance.id)
+            if not validated_data:
+                return instance
+        return super().update(instance, validated_data)
 
 class RegistrationSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
@@ -1,3 +1,147 @@
-from django.test import TestCase
+import threading
+from unittest.mock import patch
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import connection
+from django.db.models.signals import post_save
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from chat.models import Conversation
+from .checks import presence_cache_is_shared
+from .presence import PresenceService, presence
+from .serializers import UserSerializer
+
+User = get_user_model()
+
+
+@override_settings(PRESENCE_FLUSH_INTERVAL=3600)
+class PresenceTests(TestCase):
+    def setUp(self):
+        caches['presence'].clear()
+        presence.flush()
+        # Leave nothing buffered for the shared flusher thread to write later.
+        self.addCleanup(presence.flush)
+        self.client = APIClient()
+        self.user = User.objects.create_user(email="user@example.com", password="password123", full_name="User")
+        self.other = User.objects.create_user(email="other@example.com", password="password123", full_name="Other")
+        self.client.force_authenticate(user=self.user)
+
+    def test_heartbeat_does_not_write_the_user_row(self):
+        with CaptureQueriesContext(connection) as ctx, patch.object(post_save, 'send') as signal:
+            response = self.client.post(reverse('presence'), {}, format='json')
+
+        self.assertTrue(response.data['is_online'])
+        self.assertTrue(presence.is_online(self.user.id))
+        self.assertFalse([q for q in ctx.captured_queries if q['sql'].startswith('UPDATE')])
+        signal.assert_not_called()
+
+    def test_profile_is_online_patch_becomes_a_heartbeat(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.patch(reverse('profile'), {'is_online': True}, format='json')
+
+        self.assertTrue(response.data['is_online'])
+        self.assertFalse([q for q in ctx.captured_queries if q['sql'].startswith('UPDATE')])
+
+        self.client.patch(reverse('profile'), {'is_online': False}, format='json')
+        self.assertFalse(presence.is_online(self.user.id))
+
+    def test_flush_writes_last_seen_in_one_batch(self):
+        service = PresenceService()
+        service.heartbeat(self.user.id)
+        service.heartbeat(self.other.id)
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(service.flush(), 2)
+
+        self.assertEqual(len([q for q in ctx.captured_queries if q['sql'].startswith('UPDATE')]), 1)
+        self.user.refresh_from_db()
+        self.assertIsNotNone(self.user.last_seen)
+
+    @override_settings(PRESENCE_FLUSH_INTERVAL=0)
+    def test_zero_interval_writes_every_heartbeat(self):
+        PresenceService().heartbeat(self.user.id)
+        self.user.refresh_from_db()
+        self.assertIsNotNone(self.user.last_seen)
+
+    def background_flushes(self, service):
+        flushed = threading.Event()
+        threads = []
+
+        def flush():
+            service._pending.clear()
+            threads.append(threading.current_thread().name)
+            flushed.set()
+            return 0
+
+        patcher = patch.object(service, 'flush', side_effect=flush)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return flushed, threads
+
+    @override_settings(PRESENCE_FLUSH_INTERVAL=1)
+    def test_a_quiet_process_is_flushed_in_the_background(self):
+        service = PresenceService()
+        flushed, threads = self.background_flushes(service)
+
+        service.heartbeat(self.user.id)
+        self.assertEqual(threads, [])  # not on the request path
+
+        self.assertTrue(flushed.wait(5))
+        self.assertEqual(threads[0], 'presence-flusher')
+
+    def test_a_full_buffer_wakes_the_flusher(self):
+        service = PresenceService()
+        service.MAX_PENDING = 2
+        flushed, threads = self.background_flushes(service)
+
+        service.heartbeat(self.user.id)
+        service.heartbeat(self.other.id)
+
+        self.assertTrue(flushed.wait(5))  # long before PRESENCE_FLUSH_INTERVAL
+        self.assertEqual(threads, ['presence-flusher'])
+
+    def test_failed_flush_keeps_the_buffer(self):
+        service = PresenceService()
+        with override_settings(PRESENCE_FLUSH_INTERVAL=0), \
+                patch.object(User.objects, 'bulk_update', side_effect=RuntimeError("db down")):
+            with self.assertRaises(RuntimeError):
+                service.heartbeat(self.user.id)
+        self.assertEqual(service.flush(), 1)
+
+    def test_user_list_looks_up_presence_once(self):
+        presence.heartbeat(self.other.id)
+        with patch.object(PresenceService, 'lookup', wraps=presence.lookup) as lookup:
+            data = UserSerializer([self.user, self.other], many=True).data
+        lookup.assert_called_once()
+        self.assertEqual([row['is_online'] for row in data], [False, True])
+
+    def test_local_memory_presence_cache_is_rejected(self):
+        self.assertEqual(presence_cache_is_shared(None), [])
+        local = {**settings.CACHES, 'presence': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        with override_settings(CACHES=local):
+            self.assertEqual([e.id for e in presence_cache_is_shared(None)], ['users.E001'])
+
+    def test_bulk_lookup(self):
+        presence.heartbeat(self.other.id)
+
+        response = self.client.get(reverse('presence'), {'ids': f"{self.user.id},{self.other.id}"})
+
+        self.assertFalse(response.data['presence'][str(self.user.id)]['is_online'])
+        self.assertTrue(response.data['presence'][str(self.other.id)]['is_online'])
+
+    def test_inbox_shows_partner_presence_with_one_cache_lookup(self):
+        third = User.objects.create_user(email="third@example.com", password="password123", full_name="Third")
+        Conversation.objects.create(buyer=self.user, seller=self.other)
+        Conversation.objects.create(buyer=third, seller=self.user)
+        presence.heartbeat(self.other.id)
+
+        with patch.object(PresenceService, 'lookup', wraps=presence.lookup) as lookup:
+            response = self.client.get(reverse('chat-conversations'))
+
+        lookup.assert_called_once()
+        online = {row['other_user_name']: row['other_user_online'] for row in response.data['results']}
+        self.assertEqual(online, {"Other": True, "Third": False})
@@ -1,6 +1,6 @@
 from django.urls import path
 from django.views.decorators.csrf import csrf_exempt
-from .views import AdminDashboardStatsView, CustomRegisterView, AdminKYCListView, AdminKYCActionView, UserProfileView, AddRoleView, KYCSubmissionView, SetTransactionPINView, UpdateBVNView, CustomLoginView, RequestAccountDeletionView, CancelAccountDeletionView, RequestPasswordResetView, ConfirmPasswordResetView
+from .views import AdminDashboardStatsView, CustomRegisterView, AdminKYCListView, AdminKYCActionView, UserProfileView, AddRoleView, KYCSubmissionView, SetTransactionPINView, UpdateBVNView, CustomLoginView, RequestAccountDeletionView, CancelAccountDeletionView, RequestPasswordResetView, ConfirmPasswordResetView, PresenceView
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 urlpatterns = [
@@ -15,6 +15,7 @@ urlpatterns = [
     path('profile/', UserProfileView.as_view(), name='profile'),
     path('roles/add/', AddRoleView.as_view(), name='add_role'), # POST { "role": "seller" }
     path('set-pin/', SetTransactionPINView.as_view(), name='set-pin'),
+    path('presence/', PresenceView.as_view(), name='presence'),
 
     # KYC
     path('kyc/upload/', KYCSubmissionView.as_view(), name='kyc_upload'),
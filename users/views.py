@@ -6,8 +6,10 @@ from rest_framework.parsers import MultiPartParser, FormParser
 from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.cache import caches
 from django.db.models import Sum
 from .serializers import UserSerializer, RegistrationSerializer, KYCUploadSerializer, AdminKYCSerializer
+from .presence import presence
 from django.shortcuts import get_object_or_404
 from django.contrib.auth import authenticate, login
 from rest_framework_simplejwt.tokens import RefreshToken
@@ -150,6 +152,11 @@ class AdminDashboardStatsView(APIView):
     permission_classes = [permissions.IsAdminUser] # Only for is_staff=True users
 
     def get(self, request):
+        # Table-wide aggregates; a short-lived copy in the 'dashboard' cache is fresh enough.
+        stats = caches['dashboard'].get_or_set('users:admin-stats', self._compute_stats)
+        return Response(stats)
+
+    def _compute_stats(self):
         # 1. User Stats
         User = get_user_model()
         total_users = User.objects.count()
@@ -167,7 +174,7 @@ class AdminDashboardStatsView(APIView):
         # 4. Total Volume (Gross Merchandise Value)
         gmv = Order.objects.aggregate(Sum('total_price'))['total_price__sum'] or 0.00
 
-        return Response({
+        return {
             "users": {
                 "total": total_users,
                 "sellers": total_sellers
@@ -182,7 +189,7 @@ class AdminDashboardStatsView(APIView):
                 "pending": pending_orders,
                 "completed": completed_orders
             }
-        })
+        }
 
 
 
@@ -291,7 +298,7 @@ class UpdateBVNView(APIView):
             wallet.account_number = acc_data['account_number']
             wallet.bank_name = acc_data['bank_name']
             wallet.bank_code = acc_data['bank_code']
-            wallet.save()
+            wallet.save(update_fields=['account_number', 'bank_name', 'bank_code', 'updated_at'])
             logger.info("UpdateBVN: virtual account %s created", acc_data['account_number'])
             return Response({"message": "Success", "account": acc_data}, status=200)
 
@@ -497,4 +504,44 @@ class ConfirmPasswordResetView(APIView):
         PasswordResetOTP.objects.filter(user=user, is_used=False).exclude(id=otp.id).update(is_used=True)
 
         logger.info("PASSWORD RESET completed: email=%r", email)
-        return Response({"message": "Password reset successful. You can now log in with your new password."}, status=status.HTTP_200_OK)
\ No newline at end of file
+        return Response({"message": "Password reset successful. You can now log in with your new password."}, status=status.HTTP_200_OK)
+
+class PresenceView(APIView):
+    """
+    POST: heartbeat from the app; send {"online": false} when it goes to the
+    background. GET ?ids=1,2,3: presence for up to MAX_IDS users at once.
+    Both go through users.presence and never write the User row.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    MAX_IDS = 100
+
+    def post(self, request):
+        online = request.data.get('online', True)
+        if online in (False, 'false', '0', 0):
+            presence.go_offline(request.user.id)
+            online = False
+        else:
+            presence.heartbeat(request.user.id)
+            online = True
+        return Response({"status": "success", "is_online": online}, status=status.HTTP_200_OK)
+
+    def get(self, request):
+        try:
+            ids = [int(value) for value in request.query_params.get('ids', '').split(',') if value.strip()]
+        except ValueError:
+            return Response({"status": "error", "message": "ids must be a comma-separated list of user ids."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(ids) > self.MAX_IDS:
+            return Response({"status": "error", "message": f"At most {self.MAX_IDS} ids per request."}, status=status.HTTP_400_BAD_REQUEST)
+
+        users = User.objects.filter(id__in=ids).only('id', 'last_seen')
+        states = presence.lookup(users)
+        return Response({
+            "status": "success",
+            "presence": {
+                str(user_id): {
+                    "is_online": state['is_online'],
+                    "last_seen": state['last_seen'].isoformat() if state['last_seen'] else None,
+                }
+                for user_id, state in states.items()
+            },
+        }, status=status.HTTP_200_OK)